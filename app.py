@@ -7,14 +7,13 @@ import datetime
 import base64
 from typing import Dict, List, Tuple
 import time
-import random
 import json
 import uuid
 import os
 import re
-from urllib.parse import urlencode, quote
 import gc
 from streamlit.errors import StreamlitAPIException, StreamlitSecretNotFoundError
+from pollinations_fanout import fan_out_pollinations
 
 # 為免費方案設定限制
 MAX_HISTORY_ITEMS = 15
@@ -123,29 +122,18 @@ def generate_images_with_retry(client, **params) -> Tuple[bool, any]:
     n_images = params.get("n", 1)
 
     if provider == "Pollinations.ai":
-        generated_images = []
-        for i in range(n_images):
-            try:
-                current_params = params.copy()
-                current_params["seed"] = random.randint(0, 1000000)
-                prompt = current_params.get("prompt", "")
-                if (neg_prompt := current_params.get("negative_prompt")): prompt += f" --no {neg_prompt}"
-                width, height = str(current_params.get("size", "1024x1024")).split('x')
-                api_params = {k: v for k, v in {"model": current_params.get("model"), "width": width, "height": height, "seed": current_params.get("seed"), "nologo": current_params.get("nologo"), "private": current_params.get("private"), "enhance": current_params.get("enhance"), "safe": current_params.get("safe")}.items() if v}
-                cfg = get_active_config()
-                headers = {}
-                auth_mode = cfg.get('pollinations_auth_mode', '免費')
-                if auth_mode == '令牌' and cfg.get('pollinations_token'): headers['Authorization'] = f"Bearer {cfg['pollinations_token']}"
-                elif auth_mode == '域名' and cfg.get('pollinations_referrer'): headers['Referer'] = cfg['pollinations_referrer']
-                response = requests.get(f"{cfg['base_url']}/prompt/{quote(prompt)}?{urlencode(api_params)}", headers=headers, timeout=120)
-                if response.ok:
-                    b64_json = base64.b64encode(response.content).decode()
-                    image_obj = type('Image', (object,), {'b64_json': b64_json})
-                    generated_images.append(image_obj)
-                else: st.warning(f"第 {i+1} 張圖片生成失敗: HTTP {response.status_code}")
-            except Exception as e:
-                st.warning(f"第 {i+1} 張圖片生成時出錯: {e}")
-                continue
+        # 所有種子並行請求，完成一張即預覽一張
+        results = [None] * n_images
+        preview_area = st.empty()
+        with preview_area.container(): preview_cols = st.columns(min(n_images, 2))
+        for i, response in fan_out_pollinations(params, get_active_config(), n_images, max_seed=1000000):
+            if isinstance(response, Exception): st.warning(f"第 {i+1} 張圖片生成時出錯: {response}")
+            elif response.ok:
+                results[i] = base64.b64encode(response.content).decode()
+                with preview_cols[i % len(preview_cols)]: st.image(response.content, caption=f"#{i+1}", use_container_width=True)
+            else: st.warning(f"第 {i+1} 張圖片生成失敗: HTTP {response.status_code}")
+        preview_area.empty()
+        generated_images = [type('Image', (object,), {'b64_json': b64_json}) for b64_json in results if b64_json is not None]
         if generated_images:
             response_obj = type('Response', (object,), {'data': generated_images})
             return True, response_obj
@@ -1,23 +1,37 @@
 import streamlit as st
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI, APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
 from PIL import Image
 import requests
+from requests.adapters import HTTPAdapter
 from io import BytesIO
 import datetime
 import base64
-from typing import Dict, List, Tuple, Optional
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Tuple, Optional
 import time
 import random
 import json
 import uuid
 import os
+import hashlib
+import sqlite3
 import re
 from urllib.parse import urlencode, quote
 import gc
 from streamlit.errors import StreamlitAPIException, StreamlitSecretNotFoundError
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import threading
+import weakref
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from functools import partial
+from collections import Counter, OrderedDict, deque
+from queue import Empty, SimpleQueue
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
 
 # 應用配置
 APP_TITLE = "🎨 AI 圖像生成器 (完整多模型版)"
@@ -25,10 +39,146 @@ APP_ICON = "🎨"
 VERSION = "v2.0.0"
 
 # 為免費方案設定限制
-MAX_HISTORY_ITEMS = 25
-MAX_FAVORITE_ITEMS = 50
 MAX_BATCH_SIZE = 6
+HISTORY_PAGE_SIZE = 10
+HISTORY_RETENTION = 20000
 REQUEST_TIMEOUT = 180
+MAX_SEED = 2**32 - 1
+
+# 種子模式
+SEED_MODES = {
+    "隨機": "🎲 隨機（記錄種子）",
+    "固定": "📌 固定種子",
+    "遞增": "🔢 從基礎種子遞增",
+}
+# 請求中實際接收種子的供應商（OpenAI 兼容的圖像接口不接收種子，無法重現也不按種子快取）
+SEEDED_PROVIDERS = {"Pollinations.ai", "Hugging Face"}
+
+# 並發扇出配置（可在 secrets 的 [concurrency] 區塊按供應商覆寫）
+PROVIDER_CONCURRENCY = {
+    "Pollinations.ai": 6,
+    "NavyAI": 4,
+    "Hugging Face": 2,
+    "OpenAI Compatible": 4,
+}
+DEFAULT_CONCURRENCY = 2
+MAX_FANOUT_WORKERS = 32
+
+# 速率限制（令牌桶，rate 為每秒請求數，burst 為突發容量；可在 secrets 的 [rate_limit] 區塊按供應商覆寫）
+RATE_LIMITS = {
+    "Pollinations.ai": {"rate": 1.0, "burst": 4},
+    "NavyAI": {"rate": 2.0, "burst": 4},
+    "Hugging Face": {"rate": 0.5, "burst": 2},
+    "OpenAI Compatible": {"rate": 2.0, "burst": 4},
+}
+DEFAULT_RATE_LIMIT = {"rate": 1.0, "burst": 2}
+RATE_LIMIT_MAX_WAIT = 120
+
+# 重試策略（可在 secrets 的 [retry] 區塊覆寫）
+RETRY_DEFAULTS = {
+    "max_attempts": 4,
+    "base_delay": 1.0,     # 指數退避的基礎延遲（秒）
+    "max_delay": 30.0,     # 單次退避上限（秒）
+    "deadline": 300.0,     # 單張圖片包括所有重試的總時間預算（秒）
+    "batch_deadline": 600.0,  # 整批圖片的總時間預算（秒）
+}
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+PROVIDER_RETRYABLE_STATUS = {
+    # Pollinations 經 Cloudflare 代理，源站超時會返回 52x
+    "Pollinations.ai": RETRYABLE_STATUS | {520, 522, 524},
+}
+
+# 自適應超時：按 (供應商, 模型) 的歷史耗時分位數乘以係數，限制在下限和上限之間（可在 secrets 的 [timeouts] 區塊覆寫）
+TIMEOUT_DEFAULTS = {
+    "percentile": 0.99,
+    "factor": 2.0,
+    "floor": 20.0,
+    "ceiling": float(REQUEST_TIMEOUT),
+    "min_samples": 10,
+}
+LATENCY_SAMPLES = 200
+LATENCY_SAVE_INTERVAL = 30
+
+# 對沖請求：請求耗時超過該模型的歷史分位數時，用相同種子發出一個副本，取先完成者（可在 secrets 的 [hedging] 區塊開啟）
+HEDGE_DEFAULTS = {
+    "enabled": False,
+    "percentile": 0.9,
+    "budget": 0.1,     # 副本請求數佔主請求數的比例上限
+}
+HEDGE_BURST = 5
+
+# 熔斷器：按端點統計最近請求的錯誤率和慢請求率，超過閾值時快速失敗，冷卻後放行單個試探請求
+CIRCUIT_DEFAULTS = {
+    "window": 20,               # 統計最近多少次請求
+    "min_calls": 5,             # 樣本不足時不熔斷
+    "error_rate": 0.5,
+    "slow_call_seconds": 60.0,  # 模型耗時樣本不足時的慢請求閾值，樣本足夠後按該模型的耗時分位數判斷
+    "slow_rate": 0.8,
+    "open_seconds": 30.0,
+}
+# 視為端點故障的狀態碼（429 由速率限制處理，不計入）
+CIRCUIT_FAILURE_STATUS = {408, 500, 502, 503, 504, 520, 522, 524}
+
+# 多存檔負載均衡：把一批圖片分給存檔池中的多個存檔，失敗時轉移到池中其他存檔
+ROUTING_STRATEGIES = ["加權輪詢", "最少未完成請求"]
+ROUTING_COOLDOWN = 60   # 整份分配都失敗的存檔在該秒數內不再分配新請求
+ROUTING_WORKERS = 8
+
+# Hugging Face 推理參數預設值和質量配置（快速預覽用較少步數和較小尺寸探索提示詞，再用同一種子完整重跑）
+HF_DEFAULT_STEPS = 25
+HF_DEFAULT_GUIDANCE = 7.5
+QUALITY_PROFILES = {
+    "完整": {"label": "🎯 完整質量"},
+    "快速預覽": {"label": "⚡ 快速預覽", "num_inference_steps": 8, "max_edge": 512},
+}
+
+# 漸進模式：先以小尺寸預覽全部種子，再只把選中的種子按目標尺寸精修（需要供應商支持種子）
+PREVIEW_MAX_EDGE = 512
+PROGRESSIVE_PROVIDERS = {"Pollinations.ai", "Hugging Face"}
+
+# Hugging Face 冷啟動：預熱後認為模型保持載入的時長，以及預熱請求的超時
+HF_WARM_TTL = 900
+HF_WARMUP_TIMEOUT = 30
+
+# HTTP 傳輸層配置（可在 secrets 的 [transport] 區塊覆寫）
+TRANSPORT_DEFAULTS = {
+    "http2": False,
+    "pool_maxsize": 16,
+    "keepalive_expiry": 60,
+    # OpenAI 兼容供應商的響應格式：b64_json 或 url（url 時並發下載圖片，供應商不支持時自動退回 b64_json）
+    "openai_response_format": "b64_json",
+    # 生成引擎：兩者都在同一個事件循環上以協程執行重試、限流、熔斷和對沖；
+    # asyncio 使用 httpx/AsyncOpenAI 異步客戶端（需要 httpx），threads 把阻塞的 HTTP 調用交給工作線程池
+    "engine": "asyncio",
+}
+STREAM_CHUNK_SIZE = 64 * 1024
+# url 響應的圖片下載共用每個供應商一個連接池（CDN 來源各不相同，不按來源建池）
+IMAGE_DOWNLOAD_POOL = "image-download"
+# 共享客戶端註冊表的容量：超出時移除最久未使用的客戶端，但不主動關閉（其他會話可能仍在使用，無引用後由垃圾回收釋放）
+MAX_SHARED_CLIENTS = 32
+
+# 數據目錄和結果快取配置
+DATA_DIR = os.environ.get("APP_DATA_DIR", "data")
+RESULT_CACHE_BYTES = 512 * 1024 * 1024
+
+# 內存預算（按字節計算，可在 secrets 的 [memory] 區塊覆寫）
+MEMORY_DEFAULTS = {
+    "favorites_bytes": 100 * 1024 * 1024,  # 每個用戶收藏圖片的容量上限
+    "process_bytes": 256 * 1024 * 1024,    # 進程內存中的圖片讀快取（圖片都存在磁碟上，按內容雜湊共享）
+}
+
+# 縮略圖配置
+THUMBNAIL_MAX_EDGE = 384
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_WAIT_SECONDS = 2
+
+# 後台生成任務配置
+JOB_WORKERS = 4
+JOB_POLL_INTERVAL = 1.0
+JOB_RETENTION_SECONDS = 600
+MAX_SESSION_JOBS = 3    # 每個會話同時進行中的任務上限（正在取消的任務不計入）
+CANCEL_POLL_INTERVAL = 0.2
 
 # 擴展的圖像尺寸預設
 IMAGE_SIZES = {
@@ -220,7 +370,7 @@ API_PROVIDERS = {
             "flux-schnell": {"name": "Flux Schnell", "icon": "⚡", "category": "FLUX", "description": "快速生成"},
             "stable-diffusion-xl": {"name": "SDXL", "icon": "💎", "category": "Stable Diffusion", "description": "高分辨率"},
             "midjourney-v6": {"name": "Midjourney v6", "icon": "🎭", "category": "Professional", "description": "最新Midjourney"},
-            "dalle-3": {"name": "DALL-E 3", "icon": "🤖", "category": "Professional", "description": "OpenAI模型"},
+            "dalle-3": {"name": "DALL-E 3", "icon": "🤖", "category": "Professional", "description": "OpenAI模型", "max_n": 1},
         }
     },
     
@@ -243,8 +393,8 @@ API_PROVIDERS = {
         "icon": "🤖",
         "description": "標準OpenAI兼容接口",
         "hardcoded_models": {
-            "dall-e-3": {"name": "DALL-E 3", "icon": "🤖", "category": "OpenAI", "description": "最新DALL-E"},
-            "dall-e-2": {"name": "DALL-E 2", "icon": "🔄", "category": "OpenAI", "description": "經典DALL-E"},
+            "dall-e-3": {"name": "DALL-E 3", "icon": "🤖", "category": "OpenAI", "description": "最新DALL-E", "max_n": 1},
+            "dall-e-2": {"name": "DALL-E 2", "icon": "🔄", "category": "OpenAI", "description": "經典DALL-E", "max_n": 10},
         }
     }
 }
@@ -292,7 +442,6 @@ def init_session_state():
     
     # 其他狀態初始化
     defaults = {
-        'generation_history': [],
         'favorite_images': [],
         'discovered_models': {},
         'selected_model': None,
@@ -301,11 +450,21 @@ def init_session_state():
         'ui_theme': 'light',
         'advanced_mode': False,
         'batch_processing': False,
+        'seed_mode': "隨機",
+        'base_seed': 42,
     }
     
     for key, value in defaults.items():
         if key not in st.session_state:
             st.session_state[key] = value
+    
+    # 從持久化存儲恢復收藏
+    if 'favorites_restored' not in st.session_state:
+        st.session_state.favorites_restored = True
+        try:
+            st.session_state.favorite_images = get_history_store().load_favorites(get_history_owner())
+        except sqlite3.Error as e:
+            st.warning(f"收藏恢復失敗: {str(e)[:100]}")
 
 def get_active_config() -> Dict:
     """獲取當前活動的API配置"""
@@ -322,7 +481,8 @@ def validate_api_key(api_key: str, base_url: str, provider: str) -> Tuple[bool,
                 return False, "Hugging Face 需要 API Token"
             
             headers = {"Authorization": f"Bearer {api_key}"}
-            response = requests.get(f"{base_url}/models", headers=headers, timeout=10)
+            http_client = get_http_client(provider, base_url)
+            response = http_client.get(f"{base_url}/models", headers=headers, timeout=10)
             
             if response.status_code == 200:
                 return True, "Hugging Face API Token 驗證成功"
@@ -330,9 +490,9 @@ def validate_api_key(api_key: str, base_url: str, provider: str) -> Tuple[bool,
                 return False, f"Hugging Face API 驗證失敗: {response.status_code}"
         
         else:
-            # OpenAI兼容API驗證
-            client = OpenAI(api_key=api_key, base_url=base_url)
-            client.models.list()
+            # OpenAI兼容API驗證（使用臨時客戶端，錯誤的憑證不會進入共享註冊表）
+            with OpenAI(api_key=api_key, base_url=base_url) as client:
+                client.models.list()
             return True, "API 密鑰驗證成功"
             
     except Exception as e:
@@ -344,8 +504,8 @@ def auto_discover_models(client, provider: str, base_url: str) -> Dict[str, Dict
     
     try:
         if provider == "Pollinations.ai":
-            response = requests.get(f"{base_url}/models", timeout=15)
-            if response.ok:
+            response = get_http_client(provider, base_url).get(f"{base_url}/models", timeout=15)
+            if is_success_response(response):
                 models = response.json()
                 for model_name in models:
                     # 智能分類
@@ -472,182 +632,2698 @@ def get_models_by_category(models: Dict[str, Dict]) -> Dict[str, Dict[str, Dict]
             categorized[category] = {}
         categorized[category][model_id] = model_info
     
-    # 排序類別
-    priority_order = ["FLUX", "Stable Diffusion", "Professional", "Anime", "Style", "Community", "Other"]
-    sorted_categorized = {}
+    # 排序類別
+    priority_order = ["FLUX", "Stable Diffusion", "Professional", "Anime", "Style", "Community", "Other"]
+    sorted_categorized = {}
+    
+    for category in priority_order:
+        if category in categorized:
+            sorted_categorized[category] = categorized[category]
+    
+    # 添加其他未知類別
+    for category, models in categorized.items():
+        if category not in sorted_categorized:
+            sorted_categorized[category] = models
+    
+    return sorted_categorized
+
+# === HTTP 傳輸層 ===
+
+def get_transport_settings() -> Dict:
+    """獲取傳輸層配置（secrets 優先於預設值）"""
+    try:
+        overrides = st.secrets.get("transport", {})
+    except StreamlitSecretNotFoundError:
+        overrides = {}
+    
+    return {**TRANSPORT_DEFAULTS, **overrides}
+
+def lru_client(registry: OrderedDict, key, factory: Callable):
+    """從共享的 LRU 客戶端註冊表獲取或創建客戶端（調用方持有鎖）；
+    超出容量時只移除最久未使用的客戶端，不關閉它：其他會話的請求可能仍持有它"""
+    if key in registry:
+        registry.move_to_end(key)
+    else:
+        registry[key] = factory()
+        while len(registry) > MAX_SHARED_CLIENTS:
+            registry.popitem(last=False)
+    return registry[key]
+
+def new_async_http_client(provider: str) -> "httpx.AsyncClient":
+    """按傳輸層配置創建異步連接池客戶端"""
+    settings = get_transport_settings()
+    pool_size = max(int(settings["pool_maxsize"]), get_provider_concurrency(provider))
+    limits = httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=float(settings["keepalive_expiry"])
+    )
+    try:
+        return httpx.AsyncClient(http2=bool(settings.get("http2")), follow_redirects=True, limits=limits)
+    except ImportError:
+        return httpx.AsyncClient(follow_redirects=True, limits=limits)
+
+@st.cache_resource(max_entries=MAX_SHARED_CLIENTS)
+def get_http_client(provider: str, base_url: str):
+    """獲取 (供應商, base_url) 的進程級連接池客戶端，跨重載和會話共享"""
+    settings = get_transport_settings()
+    pool_size = max(int(settings["pool_maxsize"]), get_provider_concurrency(provider))
+    
+    # 啟用 HTTP/2 時使用 httpx（需要安裝 httpx[http2]）
+    if settings.get("http2") and HTTPX_AVAILABLE:
+        try:
+            return httpx.Client(
+                http2=True,
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size,
+                    keepalive_expiry=float(settings["keepalive_expiry"])
+                )
+            )
+        except ImportError:
+            pass
+    
+    # 預設使用帶連接池的 requests 會話（HTTP/1.1 keep-alive）
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+class StreamedResponse:
+    """分塊讀取完成的響應，提供與 requests/httpx 響應一致的常用屬性"""
+    
+    def __init__(self, status_code: int, headers, content: bytes, url: str):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+    
+    def json(self):
+        return json.loads(self.content)
+
+def content_length(response) -> Optional[int]:
+    try:
+        return int(response.headers.get("Content-Length"))
+    except (TypeError, ValueError):
+        return None
+
+def read_stream(response, chunks: Iterator[bytes],
+                on_bytes: Optional[Callable[[int, Optional[int]], None]],
+                cancel_token=None) -> StreamedResponse:
+    """把響應體分塊讀入緩衝區，每塊回調 on_bytes(已接收字節, Content-Length 或 None)；取消時中止下載"""
+    total = content_length(response)
+    buffer = BytesIO()
+    received = 0
+    for chunk in chunks:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        buffer.write(chunk)
+        received += len(chunk)
+        if on_bytes is not None:
+            on_bytes(received, total)
+    
+    return StreamedResponse(response.status_code, response.headers, buffer.getvalue(), str(response.url))
+
+def stream_request(http_client, method: str, url: str,
+                   on_bytes: Optional[Callable[[int, Optional[int]], None]] = None,
+                   cancel_token=None, **kwargs) -> StreamedResponse:
+    """以流式方式發送請求並分塊接收響應體（支持 requests 會話和 httpx 客戶端）"""
+    if HTTPX_AVAILABLE and isinstance(http_client, httpx.Client):
+        with http_client.stream(method, url, **kwargs) as response:
+            return read_stream(response, response.iter_bytes(STREAM_CHUNK_SIZE), on_bytes, cancel_token)
+    
+    with http_client.request(method, url, stream=True, **kwargs) as response:
+        return read_stream(response, response.iter_content(STREAM_CHUNK_SIZE), on_bytes, cancel_token)
+
+async def async_stream_request(http_client, method: str, url: str,
+                               on_bytes: Optional[Callable[[int, Optional[int]], None]] = None,
+                               cancel_token: Optional["CancellationToken"] = None,
+                               **kwargs) -> StreamedResponse:
+    """在事件循環上流式發送請求：httpx.AsyncClient 直接異步讀取，同步客戶端（threads 引擎）在工作線程中執行 stream_request"""
+    if not (HTTPX_AVAILABLE and isinstance(http_client, httpx.AsyncClient)):
+        return await asyncio.to_thread(stream_request, http_client, method, url, on_bytes, cancel_token, **kwargs)
+    
+    async with http_client.stream(method, url, **kwargs) as response:
+        total = content_length(response)
+        buffer = BytesIO()
+        received = 0
+        async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            buffer.write(chunk)
+            received += len(chunk)
+            if on_bytes is not None:
+                on_bytes(received, total)
+        return StreamedResponse(response.status_code, response.headers, buffer.getvalue(), str(response.url))
+
+def is_success_response(response) -> bool:
+    """兼容 requests 和 httpx 的成功狀態判斷"""
+    return 200 <= response.status_code < 300
+
+# === 取消令牌 ===
+
+class GenerationCancelled(Exception):
+    """生成已被取消"""
+    pass
+
+class CancellationToken:
+    """協作式取消令牌：等待、重試和下載在檢查點上響應取消；子令牌隨父令牌一起取消"""
+    
+    def __init__(self, parent: Optional["CancellationToken"] = None):
+        self._event = threading.Event()
+        self._parent = parent
+    
+    def cancel(self):
+        self._event.set()
+    
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set() or (self._parent is not None and self._parent.cancelled)
+    
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise GenerationCancelled("生成已取消")
+    
+    def sleep(self, seconds: float):
+        """可被取消打斷的等待"""
+        deadline = time.monotonic() + max(seconds, 0)
+        while True:
+            remaining = deadline - time.monotonic()
+            if self._parent is None:
+                if self._event.wait(max(remaining, 0)):
+                    raise GenerationCancelled("生成已取消")
+                return
+            self.raise_if_cancelled()
+            if remaining <= 0:
+                return
+            self._event.wait(min(remaining, CANCEL_POLL_INTERVAL))
+
+# === 異步生成核心 ===
+
+class AsyncLoopRunner:
+    """在專用後台線程上運行的事件循環：生成請求的重試、限流、熔斷、對沖和扇出都以協程在這裡執行，
+    同步代碼（Streamlit 腳本和任務線程）通過 iterate 提交協程並按完成順序取回結果。
+    asyncio 引擎使用異步客戶端；threads 引擎（或未安裝 httpx）時，同一批協程把阻塞的 HTTP 調用交給工作線程池"""
+    
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(
+            ThreadPoolExecutor(max_workers=MAX_FANOUT_WORKERS, thread_name_prefix="fanout")
+        )
+        self._http_clients: OrderedDict = OrderedDict()
+        self._openai_clients: OrderedDict = OrderedDict()
+        self._semaphores: Dict[Tuple[str, int], asyncio.Semaphore] = {}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, name="async-core", daemon=True).start()
+    
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+    
+    @property
+    def native(self) -> bool:
+        """是否使用異步客戶端：配置為 asyncio 引擎且安裝了 httpx"""
+        return HTTPX_AVAILABLE and get_transport_settings().get("engine") == "asyncio"
+    
+    def semaphore(self, provider: str, limit: int) -> asyncio.Semaphore:
+        """每個供應商的並發信號量，只在事件循環上使用，等待名額不佔用任何線程"""
+        with self._lock:
+            key = (provider, limit)
+            if key not in self._semaphores:
+                self._semaphores[key] = asyncio.Semaphore(limit)
+            return self._semaphores[key]
+    
+    def submit(self, coro: Awaitable) -> Future:
+        """在事件循環上運行協程，不等待結果（如後台預熱）"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    def iterate(self, make_coro: Callable[[Callable], Awaitable],
+                cancel_token: Optional[CancellationToken] = None) -> Iterator:
+        """同步橋接：make_coro(emit) 在事件循環上運行並逐項 emit 結果，以 None 結束；
+        取消時撤銷協程並停止產出"""
+        results: SimpleQueue = SimpleQueue()
+        future = self.submit(make_coro(results.put))
+        try:
+            while True:
+                try:
+                    item = results.get(timeout=CANCEL_POLL_INTERVAL)
+                except Empty:
+                    if cancel_token is not None and cancel_token.cancelled:
+                        return
+                    continue
+                if item is None:
+                    future.result()
+                    return
+                yield item
+        finally:
+            # 提前結束（取消或調用方不再讀取）時撤銷仍在運行的協程
+            if not future.done():
+                future.cancel()
+    
+    def http_client(self, provider: str, base_url: str):
+        """(供應商, base_url) 的連接池客戶端：異步引擎返回只在事件循環線程上使用的 httpx.AsyncClient，
+        否則返回進程級同步客戶端（在工作線程中使用）"""
+        if not self.native:
+            return get_http_client(provider, base_url)
+        
+        with self._lock:
+            return lru_client(self._http_clients, (provider, base_url), partial(new_async_http_client, provider))
+    
+    def openai_client(self, api_key: str, base_url: str) -> AsyncOpenAI:
+        """異步 OpenAI 客戶端（鍵與同步註冊表一致）"""
+        with self._lock:
+            return lru_client(
+                self._openai_clients, openai_client_key(api_key, base_url),
+                partial(AsyncOpenAI, api_key=api_key, base_url=base_url)
+            )
+
+@st.cache_resource
+def get_async_runner() -> AsyncLoopRunner:
+    """進程級共享的事件循環"""
+    return AsyncLoopRunner()
+
+async def async_sleep(seconds: float, cancel_token: Optional[CancellationToken] = None):
+    """可被取消令牌打斷的異步等待"""
+    deadline = time.monotonic() + max(seconds, 0)
+    while True:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(remaining, CANCEL_POLL_INTERVAL))
+
+# === 速率限制 ===
+
+class RateLimitTimeout(Exception):
+    """等待令牌超時"""
+    pass
+
+class TokenBucket:
+    """線程安全的令牌桶；令牌不足時預約排隊（調用方按返回的秒數等待）而不是直接失敗"""
+    
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def reserve(self, max_wait: float = RATE_LIMIT_MAX_WAIT) -> float:
+        """預約一個令牌並返回需要等待的秒數（不阻塞，調用方自行等待）；超過 max_wait 拋出 RateLimitTimeout"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(self._blocked_until - now, (1 - self._tokens) / self.rate, 0.0)
+            if wait > max_wait:
+                raise RateLimitTimeout(f"速率限制排隊超過 {max_wait} 秒")
+            self._tokens -= 1
+            return wait
+    
+    def refund(self):
+        """退還一個已預約但未使用的令牌（等待期間被取消時）"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.burst, self._tokens + 1)
+    
+    def try_acquire(self) -> bool:
+        """有可用令牌時立即取得並返回 True，否則不等待直接返回 False"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self._blocked_until and self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+    
+    def throttle(self, seconds: float):
+        """收到 429 時清空令牌並暫停發放，讓後續請求排隊"""
+        with self._lock:
+            self._tokens = 0.0
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+def get_rate_limit_settings(provider: str) -> Dict[str, float]:
+    """獲取供應商的速率限制配置（secrets 優先於預設值）"""
+    try:
+        overrides = st.secrets.get("rate_limit", {}).get(provider, {})
+    except StreamlitSecretNotFoundError:
+        overrides = {}
+    
+    settings = {**RATE_LIMITS.get(provider, DEFAULT_RATE_LIMIT), **overrides}
+    try:
+        return {"rate": max(float(settings["rate"]), 0.01), "burst": max(int(settings["burst"]), 1)}
+    except (TypeError, ValueError):
+        return dict(DEFAULT_RATE_LIMIT)
+
+def rate_limit_key(cfg: Dict) -> str:
+    """速率限制按 (供應商, 憑證) 劃分；免費 Pollinations 按服務器 IP 限流，所有會話共用一個桶"""
+    provider = cfg.get('provider', '')
+    if provider == "Pollinations.ai":
+        credential = cfg.get('pollinations_token') if cfg.get('pollinations_auth_mode') == '令牌' else ''
+    else:
+        credential = cfg.get('api_key', '')
+    raw = f"{provider}|{cfg.get('base_url', '')}|{credential}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+@st.cache_resource
+def get_token_bucket(key: str, rate: float, burst: int) -> TokenBucket:
+    """每個 (供應商, 憑證) 的進程級令牌桶，跨會話共享"""
+    return TokenBucket(rate, burst)
+
+def get_rate_limiter(cfg: Dict) -> TokenBucket:
+    """獲取配置對應的令牌桶"""
+    settings = get_rate_limit_settings(cfg.get('provider', ''))
+    return get_token_bucket(rate_limit_key(cfg), settings["rate"], settings["burst"])
+
+async def async_take_token(limiter: TokenBucket, max_wait: float = RATE_LIMIT_MAX_WAIT,
+                           cancel_token: Optional[CancellationToken] = None):
+    """預約一個令牌並等待到可用時刻；等待期間被取消時退還令牌，不佔用後續請求的配額"""
+    wait = limiter.reserve(max_wait)
+    try:
+        await async_sleep(wait, cancel_token)
+    except (GenerationCancelled, asyncio.CancelledError):
+        limiter.refund()
+        raise
+
+def retry_after_seconds(response, default: float = 5.0) -> float:
+    """解析 Retry-After 響應頭（秒數形式）"""
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return max(float(headers.get("Retry-After", default)), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+# === 重試策略 ===
+
+def get_retry_policy() -> Dict[str, float]:
+    """獲取重試策略（secrets 優先於預設值）"""
+    try:
+        overrides = st.secrets.get("retry", {})
+    except StreamlitSecretNotFoundError:
+        overrides = {}
+    
+    policy = {**RETRY_DEFAULTS, **overrides}
+    try:
+        return {key: float(value) for key, value in policy.items()}
+    except (TypeError, ValueError):
+        return {key: float(value) for key, value in RETRY_DEFAULTS.items()}
+
+def is_retryable_error(error: Exception, retryable_status: set) -> bool:
+    """判斷異常是否為暫時性錯誤（連接失敗、超時、可重試的狀態碼）"""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout,
+                          requests.exceptions.ChunkedEncodingError, APIConnectionError)):
+        return True
+    if HTTPX_AVAILABLE and isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in retryable_status
+    return False
+
+def backoff_delay(attempt: int, policy: Dict[str, float]) -> float:
+    """指數退避加完全抖動：在 [0, min(上限, 基礎 × 2^(n-1))] 中隨機取值"""
+    return random.uniform(0, min(policy["max_delay"], policy["base_delay"] * 2 ** (attempt - 1)))
+
+def provider_retry_hint(provider: str, response) -> float:
+    """供應商特有的建議等待時間（秒），如 HF 模型載入中的 estimated_time"""
+    if provider == "Hugging Face":
+        return hf_loading_estimate(response) or 0.0
+    return 0.0
+
+def next_retry_delay(provider: str, attempt: int, policy: Dict[str, float], retryable_status: set,
+                     deadline: float, limiter: Optional[TokenBucket] = None,
+                     response=None, error: Optional[Exception] = None) -> Optional[float]:
+    """根據一次嘗試的響應或異常決定是否重試：返回退避秒數，不再重試時返回 None（收到 429 時順帶讓令牌桶暫停）"""
+    if error is not None:
+        if isinstance(error, RateLimitError) and limiter is not None:
+            limiter.throttle(retry_after_seconds(error.response))
+        if not is_retryable_error(error, retryable_status) or attempt >= policy["max_attempts"]:
+            return None
+        delay = backoff_delay(attempt, policy)
+        if isinstance(error, APIStatusError):
+            delay = max(delay, retry_after_seconds(error.response, 0))
+    else:
+        status = getattr(response, "status_code", None)
+        if status == 429 and limiter is not None:
+            limiter.throttle(retry_after_seconds(response))
+        if status not in retryable_status or attempt >= policy["max_attempts"]:
+            return None
+        delay = max(
+            backoff_delay(attempt, policy),
+            retry_after_seconds(response, 0),
+            provider_retry_hint(provider, response)
+        )
+    
+    if time.monotonic() + delay > deadline:
+        return None
+    return delay
+
+async def async_call_with_retry(provider: str, call: Callable[[], Awaitable],
+                                limiter: Optional[TokenBucket] = None,
+                                semaphore: Optional[asyncio.Semaphore] = None,
+                                cancel_token: Optional[CancellationToken] = None,
+                                deadline: Optional[float] = None,
+                                breaker: Optional["CircuitBreaker"] = None,
+                                slow_after: Optional[float] = None) -> Any:
+    """帶重試地執行一次供應商請求；每次嘗試都重新預約令牌和取得並發名額，退避等待時不佔用名額。
+    給出 breaker 時每次嘗試先經熔斷器放行（熔斷時拋出 CircuitOpenError，不消耗令牌），
+    並以取得名額後的耗時（超過 slow_after 記為慢請求）更新熔斷器。
+    重試耗盡或超出時間預算（單張預算與 deadline 取較早者）時返回最後的響應或拋出最後的異常；
+    取消時拋出 GenerationCancelled"""
+    policy = get_retry_policy()
+    retryable_status = PROVIDER_RETRYABLE_STATUS.get(provider, RETRYABLE_STATUS)
+    deadline = min(time.monotonic() + policy["deadline"], deadline or float("inf"))
+    attempt = 0
+    
+    while True:
+        attempt += 1
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        if breaker is not None and not breaker.allow():
+            raise circuit_open_error(breaker)
+        
+        try:
+            if limiter is not None:
+                await async_take_token(limiter, max(deadline - time.monotonic(), 0), cancel_token)
+            if semaphore is not None:
+                await semaphore.acquire()
+        except BaseException:
+            # 放行後未發出請求（取消、等待令牌超時）：歸還試探名額
+            if breaker is not None:
+                breaker.release()
+            raise
+        
+        started = time.monotonic()
+        try:
+            try:
+                response = await call()
+            finally:
+                if semaphore is not None:
+                    semaphore.release()
+        except (GenerationCancelled, asyncio.CancelledError):
+            if breaker is not None:
+                breaker.release()
+            raise
+        except Exception as e:
+            if breaker is not None:
+                breaker.record(not is_endpoint_failure(error=e), time.monotonic() - started, slow_after)
+            delay = next_retry_delay(provider, attempt, policy, retryable_status, deadline, limiter, error=e)
+            if delay is None:
+                raise
+        else:
+            if breaker is not None:
+                breaker.record(not is_endpoint_failure(response), time.monotonic() - started, slow_after)
+            delay = next_retry_delay(provider, attempt, policy, retryable_status, deadline, limiter, response)
+            if delay is None:
+                return response
+        
+        await async_sleep(delay, cancel_token)
+
+# === Hugging Face 冷啟動 ===
+
+def hf_loading_estimate(response) -> Optional[float]:
+    """解析 HF「模型載入中」的 503 響應，返回預計載入秒數；其他響應返回 None"""
+    if getattr(response, "status_code", None) != 503:
+        return None
+    try:
+        body = response.json()
+        return max(float(body["estimated_time"]), 0.0)
+    except (ValueError, KeyError, TypeError):
+        return None
+
+class ModelWarmupTracker:
+    """按模型 URL 記錄 HF 模型的冷熱狀態，跨會話共享，避免重複預熱"""
+    
+    def __init__(self, warm_ttl: float):
+        self.warm_ttl = warm_ttl
+        self._states: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+    
+    def record(self, url: str, response=None, error: Optional[Exception] = None):
+        """根據一次請求的結果更新模型狀態"""
+        now = time.time()
+        if error is not None:
+            state = {"state": "error", "at": now, "detail": str(error)[:100]}
+        elif is_success_response(response):
+            state = {"state": "ready", "at": now}
+        elif (estimate := hf_loading_estimate(response)) is not None:
+            state = {"state": "loading", "at": now, "ready_at": now + estimate}
+        else:
+            state = {"state": "error", "at": now, "detail": f"HTTP {response.status_code}"}
+        
+        with self._lock:
+            self._states[url] = state
+    
+    def get(self, url: str) -> Optional[Dict]:
+        with self._lock:
+            return self._states.get(url)
+    
+    def claim_warmup(self, url: str) -> bool:
+        """模型需要預熱時標記為預熱中並返回 True（已熱、載入中或正在預熱時返回 False）"""
+        now = time.time()
+        with self._lock:
+            state = self._states.get(url)
+            if state is not None:
+                if state["state"] == "warming":
+                    return False
+                if state["state"] == "ready" and now - state["at"] < self.warm_ttl:
+                    return False
+                if state["state"] == "loading" and now < state["ready_at"]:
+                    return False
+            self._states[url] = {"state": "warming", "at": now}
+            return True
+
+@st.cache_resource
+def get_warmup_tracker() -> ModelWarmupTracker:
+    """進程級共享的 HF 模型冷熱狀態"""
+    return ModelWarmupTracker(HF_WARM_TTL)
+
+def hf_model_url(base_url: str, model: str) -> str:
+    return f"{base_url}/models/{model}"
+
+async def async_hf_post(http_client, url: str, headers: Dict, payload: Dict,
+                        tracker: ModelWarmupTracker, timeout: float = REQUEST_TIMEOUT,
+                        on_bytes: Optional[Callable[[int, Optional[int]], None]] = None,
+                        cancel_token: Optional[CancellationToken] = None):
+    """發送 HF 推理請求（流式接收）並更新模型冷熱狀態"""
+    try:
+        response = await async_stream_request(http_client, "POST", url, on_bytes, cancel_token,
+                                              headers=headers, json=payload, timeout=timeout)
+    except GenerationCancelled:
+        raise
+    except Exception as e:
+        tracker.record(url, error=e)
+        raise
+    tracker.record(url, response)
+    return response
+
+def warm_up_hf_model(cfg: Dict, model: str) -> bool:
+    """在後台向尚未載入的 HF 模型發送最小推理請求以觸發載入（與生成請求共用速率令牌和並發名額），
+    返回是否發出了預熱請求"""
+    tracker = get_warmup_tracker()
+    url = hf_model_url(cfg['base_url'], model)
+    if not tracker.claim_warmup(url):
+        return False
+    
+    runner = get_async_runner()
+    http_client = runner.http_client("Hugging Face", cfg['base_url'])
+    limiter = get_rate_limiter(cfg)
+    semaphore = runner.semaphore("Hugging Face", get_provider_concurrency("Hugging Face"))
+    headers = {"Authorization": f"Bearer {cfg['api_key']}"}
+    payload = {
+        "inputs": "warm up",
+        "parameters": {"num_inference_steps": 1, "width": 256, "height": 256}
+    }
+    
+    async def ping():
+        try:
+            await async_take_token(limiter)
+            async with semaphore:
+                await async_hf_post(http_client, url, headers, payload, tracker, HF_WARMUP_TIMEOUT)
+        except Exception as e:
+            tracker.record(url, error=e)
+    
+    runner.submit(ping())
+    return True
+
+def warm_up_on_activation(cfg: Dict):
+    """HF 存檔被激活或切換模型時預熱當前選中的模型（同一會話內同一存檔的同一模型只觸發一次）"""
+    if cfg.get('provider') != "Hugging Face" or not cfg.get('validated') or not cfg.get('api_key'):
+        return
+    
+    model = st.session_state.get('selected_model')
+    if not model:
+        return
+    
+    warm_key = (rate_limit_key(cfg), model)
+    if st.session_state.get('warmed_profile') != warm_key:
+        st.session_state.warmed_profile = warm_key
+        warm_up_hf_model(cfg, model)
+
+def describe_model_warmth(state: Optional[Dict]) -> str:
+    """模型冷熱狀態的顯示文字"""
+    if state is None:
+        return "❄️ 未預熱"
+    if state["state"] == "warming":
+        return "⏳ 預熱中"
+    if state["state"] == "loading":
+        remaining = max(0, int(state["ready_at"] - time.time()))
+        return f"🔥 載入中（約 {remaining} 秒）" if remaining else "🔥 即將就緒"
+    if state["state"] == "ready":
+        return "✅ 已就緒"
+    return f"⚠️ {state.get('detail', '預熱失敗')}"
+
+# === 自適應超時 ===
+
+def get_timeout_settings() -> Dict[str, float]:
+    """獲取自適應超時配置（secrets 優先於預設值）"""
+    try:
+        overrides = st.secrets.get("timeouts", {})
+    except StreamlitSecretNotFoundError:
+        overrides = {}
+    
+    settings = {**TIMEOUT_DEFAULTS, **overrides}
+    try:
+        return {key: float(value) for key, value in settings.items()}
+    except (TypeError, ValueError):
+        return dict(TIMEOUT_DEFAULTS)
+
+def latency_workload(params: Dict) -> str:
+    """耗時統計的負載分組：質量配置和尺寸（同一模型不同步數、解析度的耗時可相差數倍）"""
+    return f"{params.get('quality', '完整')}|{params.get('size', '')}"
+
+class LatencyTracker:
+    """按 (供應商, 模型, 負載) 記錄成功請求的耗時，由高分位數推導超時；樣本定期寫入磁碟，重啟後沿用。
+    超時的請求不計入樣本（否則超時會把分位數推向超時本身）；連續超時時超時按倍數放寬，直到上限"""
+    
+    def __init__(self, path: str, max_samples: int = LATENCY_SAMPLES):
+        self.path = path
+        self.max_samples = max_samples
+        self._samples: Dict[str, deque] = {}
+        self._timeouts: Counter = Counter()
+        self._lock = threading.Lock()
+        self._last_save = time.monotonic()
+        self._dirty = False
+        
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for key, values in json.load(f).items():
+                    self._samples[key] = deque((float(v) for v in values), maxlen=max_samples)
+        except (OSError, ValueError, TypeError, AttributeError):
+            pass
+    
+    @staticmethod
+    def _key(provider: str, model: str, workload: str) -> str:
+        return f"{provider}|{model}|{workload}"
+    
+    def record(self, provider: str, model: str, seconds: float, workload: str = ""):
+        """記錄一次成功請求的耗時，並結束連續超時"""
+        with self._lock:
+            key = self._key(provider, model, workload)
+            self._samples.setdefault(key, deque(maxlen=self.max_samples)).append(round(seconds, 3))
+            self._timeouts.pop(key, None)
+            self._dirty = True
+            due = time.monotonic() - self._last_save >= LATENCY_SAVE_INTERVAL
+        if due:
+            self.save()
+    
+    def record_timeout(self, provider: str, model: str, workload: str = ""):
+        """記錄一次超時（不計入樣本），下一次請求的超時加倍"""
+        with self._lock:
+            self._timeouts[self._key(provider, model, workload)] += 1
+    
+    def save(self):
+        """原子寫入樣本文件"""
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = {key: list(values) for key, values in self._samples.items()}
+            self._dirty = False
+            self._last_save = time.monotonic()
+        
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+    
+    def quantile(self, provider: str, model: str, q: float, min_samples: int = 1,
+                 workload: str = "") -> Optional[float]:
+        """耗時的 q 分位數；樣本少於 min_samples 時返回 None"""
+        with self._lock:
+            values = sorted(self._samples.get(self._key(provider, model, workload), ()))
+        if not values or len(values) < min_samples:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+    
+    def stats(self, provider: str, model: str, workload: str = "") -> Dict:
+        """樣本數、分位數、連續超時次數和當前超時"""
+        settings = get_timeout_settings()
+        key = self._key(provider, model, workload)
+        with self._lock:
+            values = sorted(self._samples.get(key, ()))
+            timeouts = self._timeouts[key]
+        
+        quantile = self.quantile(provider, model, settings["percentile"], workload=workload)
+        
+        timeout = settings["ceiling"]
+        if quantile is not None and len(values) >= settings["min_samples"]:
+            timeout = min(settings["ceiling"], max(settings["floor"], quantile * settings["factor"]) * 2 ** timeouts)
+        
+        return {"samples": len(values), "quantile": quantile, "timeouts": timeouts, "timeout": timeout}
+    
+    def timeout(self, provider: str, model: str, workload: str = "") -> float:
+        """(供應商, 模型, 負載) 的請求超時；樣本不足時使用上限"""
+        return self.stats(provider, model, workload)["timeout"]
+
+@st.cache_resource
+def get_latency_tracker() -> LatencyTracker:
+    """進程級共享的請求耗時統計"""
+    return LatencyTracker(os.path.join(DATA_DIR, "latency.json"))
+
+def is_timeout_error(error: Exception) -> bool:
+    if HTTPX_AVAILABLE and isinstance(error, httpx.TimeoutException):
+        return True
+    return isinstance(error, (requests.Timeout, APITimeoutError))
+
+def describe_error(error: Exception) -> str:
+    """錯誤描述；httpx 超時等異常沒有消息時使用異常類型名"""
+    return (str(error) or type(error).__name__)[:100]
+
+async def async_timed_call(tracker: LatencyTracker, provider: str, model: str, workload: str,
+                           call: Callable[[], Awaitable]) -> Any:
+    """執行請求並記錄成功響應的耗時；超時只記錄次數（放寬下一次的超時），不計入樣本"""
+    started = time.monotonic()
+    try:
+        response = await call()
+    except Exception as e:
+        if is_timeout_error(e):
+            tracker.record_timeout(provider, model, workload)
+        raise
+    if is_success_response(response):
+        tracker.record(provider, model, time.monotonic() - started, workload)
+    return response
+
+# === 熔斷器 ===
+
+class CircuitOpenError(Exception):
+    """端點處於熔斷狀態，請求未發出"""
+    pass
+
+def get_circuit_settings() -> Dict[str, float]:
+    """獲取熔斷器配置（secrets 優先於預設值）"""
+    try:
+        overrides = st.secrets.get("circuit_breaker", {})
+    except StreamlitSecretNotFoundError:
+        overrides = {}
+    
+    settings = {**CIRCUIT_DEFAULTS, **overrides}
+    try:
+        return {key: float(value) for key, value in settings.items()}
+    except (TypeError, ValueError):
+        return {key: float(value) for key, value in CIRCUIT_DEFAULTS.items()}
+
+def endpoint_key(cfg: Dict) -> str:
+    """熔斷按端點（供應商 + 基礎 URL）劃分，同一端點的所有存檔和會話共享狀態"""
+    return f"{cfg.get('provider', '')}|{cfg.get('base_url', '')}"
+
+class CircuitBreaker:
+    """端點熔斷器：closed 正常放行；錯誤率或慢請求率超限時 open 快速失敗；
+    open_seconds 後進入 half_open，只放行一個試探請求，成功則恢復，失敗則重新熔斷"""
+    
+    def __init__(self, settings: Dict[str, float]):
+        self.settings = settings
+        self.state = "closed"
+        self._calls: deque = deque(maxlen=int(settings["window"]))
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        """是否放行一次請求；half_open 時同一時間只有一個試探請求"""
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.settings["open_seconds"]:
+                    return False
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+    
+    def is_open(self) -> bool:
+        """熔斷中且尚未到試探時間"""
+        with self._lock:
+            return (self.state == "open" and
+                    time.monotonic() - self._opened_at < self.settings["open_seconds"])
+    
+    def release(self):
+        """放行的請求被取消時歸還試探名額"""
+        with self._lock:
+            self._probing = False
+    
+    def record(self, ok: bool, latency: float, slow_after: Optional[float] = None):
+        """記錄一次請求結果；耗時超過 slow_after（默認 slow_call_seconds）記為慢請求"""
+        with self._lock:
+            slow = latency >= (slow_after if slow_after is not None else self.settings["slow_call_seconds"])
+            if self.state == "half_open":
+                self._probing = False
+                if ok and not slow:
+                    self.state = "closed"
+                    self._calls.clear()
+                else:
+                    self._trip()
+                return
+            
+            self._calls.append((ok, slow))
+            if self.state == "closed" and len(self._calls) >= self.settings["min_calls"]:
+                error_rate, slow_rate = self._rates()
+                if error_rate >= self.settings["error_rate"] or slow_rate >= self.settings["slow_rate"]:
+                    self._trip()
+    
+    def _trip(self):
+        self.state = "open"
+        self._opened_at = time.monotonic()
+    
+    def _rates(self) -> Tuple[float, float]:
+        if not self._calls:
+            return 0.0, 0.0
+        total = len(self._calls)
+        return (sum(1 for ok, _ in self._calls if not ok) / total,
+                sum(1 for _, slow in self._calls if slow) / total)
+    
+    def snapshot(self) -> Dict:
+        """狀態、健康度（0–1）、距下次試探的秒數和樣本數"""
+        with self._lock:
+            error_rate, slow_rate = self._rates()
+            retry_in = 0.0
+            if self.state == "open":
+                health = 0.0
+                retry_in = max(0.0, self.settings["open_seconds"] - (time.monotonic() - self._opened_at))
+            else:
+                health = (1 - error_rate) * (1 - slow_rate / 2)
+                if self.state == "half_open":
+                    health = min(health, 0.5)
+            return {"state": self.state, "health": health, "retry_in": retry_in, "calls": len(self._calls)}
+
+@st.cache_resource
+def get_circuit_breaker(endpoint: str) -> CircuitBreaker:
+    """每個端點的進程級熔斷器，跨會話共享"""
+    return CircuitBreaker(get_circuit_settings())
+
+def is_endpoint_failure(response=None, error: Optional[Exception] = None) -> bool:
+    """判斷一次請求是否說明端點不健康（連接失敗、超時、5xx）；HF 模型載入中不計入"""
+    if error is not None:
+        return is_retryable_error(error, CIRCUIT_FAILURE_STATUS)
+    status = getattr(response, "status_code", None)
+    return status in CIRCUIT_FAILURE_STATUS and hf_loading_estimate(response) is None
+
+def circuit_open_error(breaker: CircuitBreaker) -> CircuitOpenError:
+    return CircuitOpenError(f"端點熔斷中，{breaker.snapshot()['retry_in']:.0f} 秒後試探恢復")
+
+def slow_call_threshold(provider: str, model: str, workload: str = "") -> float:
+    """熔斷器的慢請求閾值：按該模型和負載的自適應超時計算（即耗時分位數，受超時上下限約束），
+    避免慢模型的正常耗時被記為慢請求；樣本不足時使用 slow_call_seconds"""
+    settings = get_timeout_settings()
+    stats = get_latency_tracker().stats(provider, model, workload)
+    if stats["samples"] < settings["min_samples"]:
+        return get_circuit_settings()["slow_call_seconds"]
+    return min(settings["ceiling"], max(settings["floor"], stats["quantile"] * settings["factor"])) / settings["factor"]
+
+# === 對沖請求 ===
+
+def get_hedge_settings() -> Dict:
+    """獲取對沖請求配置（secrets 優先於預設值）"""
+    try:
+        overrides = st.secrets.get("hedging", {})
+    except StreamlitSecretNotFoundError:
+        overrides = {}
+    
+    settings = {**HEDGE_DEFAULTS, **overrides}
+    try:
+        return {
+            "enabled": bool(settings["enabled"]),
+            "percentile": float(settings["percentile"]),
+            "budget": float(settings["budget"]),
+        }
+    except (TypeError, ValueError):
+        return dict(HEDGE_DEFAULTS)
+
+class HedgeBudget:
+    """限制副本請求的比例：每個主請求累積 ratio 點額度（上限 burst），每個副本消耗 1 點"""
+    
+    def __init__(self, ratio: float, burst: int = HEDGE_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self._credits = 0.0
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+    
+    def record_primary(self):
+        with self._lock:
+            self._counts["primary"] += 1
+            self._credits = min(self.burst, self._credits + self.ratio)
+    
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._credits < 1:
+                return False
+            self._credits -= 1
+            self._counts["hedged"] += 1
+            return True
+    
+    def refund(self):
+        """已取得額度但未能發出副本（例如速率令牌不足）時退回"""
+        with self._lock:
+            self._counts["hedged"] -= 1
+            self._credits = min(self.burst, self._credits + 1)
+    
+    def record_win(self):
+        with self._lock:
+            self._counts["hedge_wins"] += 1
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {key: self._counts[key] for key in ("primary", "hedged", "hedge_wins")}
+
+@st.cache_resource
+def get_hedge_budget(provider: str, ratio: float) -> HedgeBudget:
+    """每個供應商的進程級對沖額度"""
+    return HedgeBudget(ratio)
+
+async def async_hedged_call(make_request: Callable[[CancellationToken], Awaitable], hedge_after: float,
+                            budget: HedgeBudget, limiter: Optional[TokenBucket] = None,
+                            cancel_token: Optional[CancellationToken] = None,
+                            semaphore: Optional[asyncio.Semaphore] = None) -> Any:
+    """發出主請求；超過 hedge_after 秒仍未完成且有對沖額度、空閒並發名額和速率令牌時，再發出一個相同的副本。
+    副本佔用自己的並發名額（不等待，沒有空閒名額時不對沖），完成後歸還。
+    返回先成功的響應並撤銷另一個（連接立即關閉）；都失敗時返回最後的響應或拋出最後的異常"""
+    budget.record_primary()
+    attempts = [CancellationToken(cancel_token)]
+    tasks = {asyncio.ensure_future(make_request(attempts[0])): 0}
+    hedge_at = time.monotonic() + hedge_after
+    
+    pending = set(tasks)
+    last_response, last_error = None, None
+    try:
+        while pending:
+            if len(attempts) == 1 and time.monotonic() >= hedge_at and budget.try_acquire():
+                # 信號量未滿時 acquire 立即返回，不會在這裡等待名額
+                if semaphore is not None and semaphore.locked():
+                    budget.refund()
+                elif limiter is None or limiter.try_acquire():
+                    if semaphore is not None:
+                        await semaphore.acquire()
+                    attempts.append(CancellationToken(cancel_token))
+                    hedge = asyncio.ensure_future(make_request(attempts[1]))
+                    if semaphore is not None:
+                        # 副本結束（包括被撤銷）時歸還名額
+                        hedge.add_done_callback(lambda _: semaphore.release())
+                    tasks[hedge] = 1
+                    pending.add(hedge)
+                else:
+                    budget.refund()
+            
+            done, pending = await asyncio.wait(pending, timeout=CANCEL_POLL_INTERVAL,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    response = task.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                
+                if is_success_response(response):
+                    if tasks[task] == 1:
+                        budget.record_win()
+                    return response
+                last_response = response
+            
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+    finally:
+        for task in pending:
+            task.cancel()
+    
+    if last_response is not None:
+        return last_response
+    raise last_error
+
+# === 並發扇出引擎 ===
+
+def get_provider_concurrency(provider: str) -> int:
+    """獲取供應商的並發上限（secrets 優先於預設值）"""
+    try:
+        overrides = st.secrets.get("concurrency", {})
+    except StreamlitSecretNotFoundError:
+        overrides = {}
+    
+    try:
+        return max(1, int(overrides.get(provider, PROVIDER_CONCURRENCY.get(provider, DEFAULT_CONCURRENCY))))
+    except (TypeError, ValueError):
+        return DEFAULT_CONCURRENCY
+
+async def async_fan_out(provider: str, jobs: List[Callable[[], Awaitable]],
+                        limiter: Optional[TokenBucket], semaphore: asyncio.Semaphore,
+                        cancel_token: Optional[CancellationToken], deadline: Optional[float],
+                        breaker: Optional[CircuitBreaker], slow_after: Optional[float],
+                        emit: Callable[[Optional[Tuple[int, bool, Any]]], None]):
+    """每個任務一個協程（帶重試），按完成順序 emit (索引, 是否成功, 結果或異常)，最後 emit None"""
+    tasks = {
+        asyncio.ensure_future(async_call_with_retry(
+            provider, job, limiter, semaphore, cancel_token, deadline, breaker, slow_after
+        )): i
+        for i, job in enumerate(jobs)
+    }
+    pending = set(tasks)
+    try:
+        while pending:
+            if deadline is not None and time.monotonic() >= deadline:
+                for task in pending:
+                    emit((tasks[task], False, TimeoutError("超出整批生成的時間預算")))
+                return
+            
+            done, pending = await asyncio.wait(pending, timeout=CANCEL_POLL_INTERVAL,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    emit((tasks[task], True, task.result()))
+                except Exception as e:
+                    emit((tasks[task], False, e))
+            
+            if cancel_token is not None and cancel_token.cancelled:
+                return
+    finally:
+        for task in pending:
+            task.cancel()
+        emit(None)
+
+def fan_out(provider: str, jobs: List[Callable[[], Awaitable]],
+            limiter: Optional[TokenBucket] = None,
+            cancel_token: Optional[CancellationToken] = None,
+            deadline: Optional[float] = None,
+            breaker: Optional[CircuitBreaker] = None,
+            slow_after: Optional[float] = None) -> Iterator[Tuple[int, bool, Any]]:
+    """在共享事件循環上有界並發執行協程任務（可選令牌桶限速和熔斷器，暫時性錯誤自動重試），
+    按完成順序產出 (索引, 是否成功, 結果或異常)。
+    取消時撤銷尚未完成的任務並立即停止產出；超過 deadline 時未完成的任務以 TimeoutError 產出"""
+    runner = get_async_runner()
+    semaphore = runner.semaphore(provider, get_provider_concurrency(provider))
+    yield from runner.iterate(
+        partial(async_fan_out, provider, jobs, limiter, semaphore, cancel_token, deadline, breaker, slow_after),
+        cancel_token
+    )
+
+def batch_deadline() -> float:
+    """整批生成的截止時刻（包括重試和多存檔轉移）"""
+    return time.monotonic() + get_retry_policy()["batch_deadline"]
+
+def run_image_batch(provider: str, jobs: List[Callable[[], Any]], seeds: List[int],
+                    on_image: Optional[Callable[[int, Optional[bytes], Optional[str]], None]] = None,
+                    limiter: Optional[TokenBucket] = None,
+                    cancel_token: Optional[CancellationToken] = None,
+                    breaker: Optional[CircuitBreaker] = None,
+                    slow_after: Optional[float] = None,
+                    deadline: Optional[float] = None) -> Tuple[bool, any]:
+    """並發執行一批圖片請求（jobs 為協程函數，與 seeds 一一對應），每張圖片完成時回調 on_image(索引, 內容, 錯誤)；
+    給出 breaker 時每次嘗試都先經過熔斷器再預約令牌。deadline 為整批的截止時刻（未給出時從現在起算）"""
+    # 熔斷中直接失敗，不再排隊等待速率令牌
+    if breaker is not None and breaker.is_open():
+        return False, str(circuit_open_error(breaker))
+    n_images = len(jobs)
+    results: List[Optional[bytes]] = [None] * n_images
+    errors: List[str] = []
+    
+    deadline = deadline or batch_deadline()
+    for i, ok, response in fan_out(provider, jobs, limiter, cancel_token, deadline, breaker, slow_after):
+        if not ok and isinstance(response, GenerationCancelled):
+            continue
+        elif not ok:
+            error = f"第 {i+1} 張圖片生成錯誤: {describe_error(response)}"
+        elif not is_success_response(response):
+            error = f"第 {i+1} 張圖片生成失敗: HTTP {response.status_code}"
+        else:
+            error = None
+            results[i] = response.content
+        
+        if error:
+            errors.append(error)
+        if on_image is not None:
+            on_image(i, results[i], error)
+    
+    generated_images = [
+        type('Image', (object,), {'content': content, 'seed': seed, 'index': i})
+        for i, (content, seed) in enumerate(zip(results, seeds)) if content is not None
+    ]
+    
+    if generated_images:
+        response_obj = type('Response', (object,), {'data': generated_images})
+        return True, response_obj
+    elif cancel_token is not None and cancel_token.cancelled:
+        return False, "生成已取消"
+    else:
+        return False, errors[0] if errors else "所有圖片生成均失敗"
+
+# === 生成結果快取 ===
+
+RESULT_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_cache (
+    cache_key TEXT PRIMARY KEY,
+    blob_hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_result_cache_used ON result_cache(used_at);
+"""
+
+class ResultCache:
+    """生成結果快取：生成參數雜湊 → 圖片內容雜湊的 LRU 索引（SQLite 持久化），
+    圖片字節存在共享的內容尋址存儲中，快取條目持有引用；按引用圖片的字節數限額"""
+    
+    def __init__(self, db_path: str, blob_store: "BlobStore", budget: int):
+        self.blob_store = blob_store
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self._index: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(RESULT_CACHE_SCHEMA)
+        for row in self._conn.execute("SELECT * FROM result_cache ORDER BY used_at"):
+            self._index[row['cache_key']] = (row['blob_hash'], row['size'])
+            self._bytes += row['size']
+    
+    def _drop(self, key: str):
+        """刪除條目並釋放圖片引用（調用方持有鎖）"""
+        blob_hash, size = self._index.pop(key)
+        self._bytes -= size
+        with self._conn:
+            self._conn.execute("DELETE FROM result_cache WHERE cache_key = ?", (key,))
+        self.blob_store.unlink([blob_hash])
+    
+    def get(self, key: str) -> Optional[bytes]:
+        """讀取快取；圖片已失效的條目視為未命中並刪除"""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None:
+                data = self.blob_store.get(entry[0])
+                if data is not None:
+                    self._index.move_to_end(key)
+                    with self._conn:
+                        self._conn.execute(
+                            "UPDATE result_cache SET used_at = ? WHERE cache_key = ?", (time.time(), key)
+                        )
+                    self.hits += 1
+                    return data
+                self._drop(key)
+            
+            self.misses += 1
+            return None
+    
+    def put(self, key: str, data: bytes):
+        """寫入快取，超出限額時淘汰最久未使用的條目"""
+        if len(data) > self.budget:
+            return
+        
+        blob_hash = self.blob_store.put(data, persistent=True)
+        with self._lock:
+            if key in self._index:
+                self._drop(key)
+            self._index[key] = (blob_hash, len(data))
+            self._bytes += len(data)
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO result_cache (cache_key, blob_hash, size, used_at) VALUES (?, ?, ?, ?)",
+                    (key, blob_hash, len(data), time.time())
+                )
+            
+            while self._bytes > self.budget and self._index:
+                self._drop(next(iter(self._index)))
+    
+    def stats(self) -> Dict:
+        """命中統計和佔用"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._index),
+                "bytes": self._bytes,
+            }
+
+@st.cache_resource
+def get_result_cache() -> ResultCache:
+    """進程級共享的生成結果快取"""
+    return ResultCache(
+        os.path.join(DATA_DIR, "result_cache.db"),
+        get_blob_store(),
+        RESULT_CACHE_BYTES
+    )
+
+def generation_cache_key(provider: str, base_url: str, params: Dict, seed: int) -> str:
+    """對單張圖片的生成參數（含種子）做規範化雜湊"""
+    canonical = {k: v for k, v in params.items() if k not in ("n", "seeds")}
+    canonical.update({"provider": provider, "base_url": base_url, "seed": seed})
+    payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+# === 圖像存儲 ===
+
+BLOB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    blob_hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+def make_thumbnail(data: bytes) -> bytes:
+    """生成 JPEG 縮略圖（st.image 直接透傳 JPEG，WebP 每次渲染都會被重新編碼）"""
+    img = Image.open(BytesIO(data))
+    img.thumbnail((THUMBNAIL_MAX_EDGE, THUMBNAIL_MAX_EDGE))
+    
+    buffer = BytesIO()
+    img.convert("RGB").save(buffer, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+class BlobStore:
+    """進程唯一的內容尋址圖片存儲：按 SHA-256 存為文件（含縮略圖），內存只做 LRU 讀快取。
+    歷史、收藏和結果快取持有持久化引用（SQLite 計數），會話持有進程內引用；
+    兩者都歸零時刪除文件。啟動時只清理沒有持久化引用的文件（上次進程會話的殘留）"""
+    
+    def __init__(self, directory: str, memory_budget: int,
+                 thumbnail_executor: Optional[ThreadPoolExecutor] = None):
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self._thumbnail_executor = thumbnail_executor
+        self._thumbnails: Dict[str, Future] = {}
+        self._memory: OrderedDict = OrderedDict()
+        self._memory_bytes = 0
+        self._session_refs: Counter = Counter()
+        self._lock = threading.Lock()
+        
+        os.makedirs(self.directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "blobs.db"), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(BLOB_SCHEMA)
+        self._sweep()
+    
+    def _path(self, handle: str, suffix: str = ".bin") -> str:
+        return os.path.join(self.directory, handle[:2], f"{handle}{suffix}")
+    
+    def _write_file(self, path: str, data: bytes):
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    
+    def _read_file(self, path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+    
+    def _remove_files(self, handle: str):
+        for suffix in (".bin", ".thumb.jpg"):
+            try:
+                os.remove(self._path(handle, suffix))
+            except OSError:
+                pass
+    
+    def _sweep(self):
+        """刪除沒有持久化引用的圖片（只被上次進程的會話持有過）"""
+        with self._conn:
+            for row in self._conn.execute("SELECT blob_hash FROM blobs WHERE refs <= 0").fetchall():
+                self._remove_files(row['blob_hash'])
+            self._conn.execute("DELETE FROM blobs WHERE refs <= 0")
+    
+    def _cache(self, handle: str, data: bytes):
+        """放入內存 LRU 讀快取（調用方持有鎖）"""
+        if handle in self._memory or len(data) > self.memory_budget:
+            return
+        self._memory[handle] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+    
+    def _collect(self, handles):
+        """刪除持久化引用和會話引用都已歸零的圖片（調用方持有鎖）"""
+        for handle in set(handles):
+            if self._session_refs[handle] > 0:
+                continue
+            del self._session_refs[handle]
+            row = self._conn.execute("SELECT refs FROM blobs WHERE blob_hash = ?", (handle,)).fetchone()
+            if row is not None and row['refs'] > 0:
+                continue
+            with self._conn:
+                self._conn.execute("DELETE FROM blobs WHERE blob_hash = ?", (handle,))
+            self._thumbnails.pop(handle, None)
+            if handle in self._memory:
+                self._memory_bytes -= len(self._memory.pop(handle))
+            self._remove_files(handle)
+    
+    def _make_thumbnail(self, handle: str, data: bytes) -> bytes:
+        """在縮略圖線程中生成並落盤；生成期間圖片已被刪除時丟棄文件。
+        無論成功與否都移除進行中的記錄，失敗的圖片不會一直顯示為生成中"""
+        try:
+            thumbnail = make_thumbnail(data)
+            self._write_file(self._path(handle, ".thumb.jpg"), thumbnail)
+        finally:
+            with self._lock:
+                self._thumbnails.pop(handle, None)
+                if self._conn.execute("SELECT 1 FROM blobs WHERE blob_hash = ?", (handle,)).fetchone() is None:
+                    self._remove_files(handle)
+        return thumbnail
+    
+    def put(self, data: bytes, persistent: bool = False) -> str:
+        """存入圖片並持有一個引用（persistent 時為持久化引用，否則為會話引用），返回內容雜湊句柄"""
+        handle = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._write_file(self._path(handle), data)
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO blobs (blob_hash, size) VALUES (?, ?)", (handle, len(data))
+                )
+                if persistent:
+                    self._conn.execute("UPDATE blobs SET refs = refs + 1 WHERE blob_hash = ?", (handle,))
+            if not persistent:
+                self._session_refs[handle] += 1
+            self._cache(handle, data)
+            
+            # 入庫時在後台生成縮略圖
+            if (self._thumbnail_executor is not None and handle not in self._thumbnails
+                    and not os.path.exists(self._path(handle, ".thumb.jpg"))):
+                self._thumbnails[handle] = self._thumbnail_executor.submit(self._make_thumbnail, handle, data)
+        return handle
+    
+    def link(self, handles: List[str]):
+        """為已存在的圖片各增加一個持久化引用（重複的句柄計多次）；未登記的句柄忽略"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE blobs SET refs = refs + 1 WHERE blob_hash = ?", [(handle,) for handle in handles]
+            )
+    
+    def unlink(self, handles: List[str]):
+        """各釋放一個持久化引用，歸零且沒有會話引用時刪除"""
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE blobs SET refs = refs - 1 WHERE blob_hash = ?", [(handle,) for handle in handles]
+                )
+            self._collect(handles)
+    
+    def retain(self, handle: str):
+        """為已存在的圖片增加一個會話引用"""
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM blobs WHERE blob_hash = ?", (handle,)).fetchone():
+                self._session_refs[handle] += 1
+    
+    def release(self, handle: str, count: int = 1):
+        """釋放會話引用，歸零且沒有持久化引用時刪除"""
+        with self._lock:
+            self._session_refs[handle] -= count
+            self._collect([handle])
+    
+    def size(self, handle: str) -> int:
+        """圖片字節數，不存在時為 0"""
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM blobs WHERE blob_hash = ?", (handle,)).fetchone()
+        return row['size'] if row else 0
+    
+    def get(self, handle: str) -> Optional[bytes]:
+        """讀取圖片字節，內存未命中時從文件讀回並放入讀快取"""
+        with self._lock:
+            if handle in self._memory:
+                self._memory.move_to_end(handle)
+                return self._memory[handle]
+        
+        data = self._read_file(self._path(handle))
+        if data is not None:
+            with self._lock:
+                self._cache(handle, data)
+        return data
+    
+    def thumbnail(self, handle: str, timeout: float = THUMBNAIL_WAIT_SECONDS) -> Optional[bytes]:
+        """獲取縮略圖：仍在生成時等待最多 timeout 秒，未就緒返回 None；生成失敗（如無法解碼）時退回原圖"""
+        with self._lock:
+            future = self._thumbnails.get(handle)
+        if future is not None:
+            try:
+                return future.result(timeout=timeout)
+            except TimeoutError:
+                return None
+            except Exception:
+                pass
+        
+        thumbnail = self._read_file(self._path(handle, ".thumb.jpg"))
+        return thumbnail if thumbnail is not None else self.get(handle)
+    
+    def stats(self) -> Dict:
+        """存儲佔用統計"""
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) AS blobs, COALESCE(SUM(size), 0) AS bytes FROM blobs").fetchone()
+            return {
+                "blobs": row['blobs'],
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": row['bytes'],
+            }
+
+def get_memory_settings() -> Dict:
+    """獲取內存預算配置（secrets 優先於預設值）"""
+    try:
+        overrides = st.secrets.get("memory", {})
+    except StreamlitSecretNotFoundError:
+        overrides = {}
+    
+    return {**MEMORY_DEFAULTS, **overrides}
+
+@st.cache_resource
+def get_thumbnail_executor() -> ThreadPoolExecutor:
+    """縮略圖專用線程池，不佔用網絡請求的工作線程"""
+    return ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnail")
+
+@st.cache_resource
+def get_blob_store() -> BlobStore:
+    """進程級共享的圖片存儲"""
+    return BlobStore(
+        os.path.join(DATA_DIR, "images"),
+        int(get_memory_settings()["process_bytes"]),
+        get_thumbnail_executor()
+    )
+
+def release_blob_refs(store: BlobStore, refs: Counter):
+    """釋放會話持有的全部引用"""
+    for handle, count in refs.items():
+        if count > 0:
+            store.release(handle, count)
+    refs.clear()
+
+class SessionBlobRefs:
+    """會話持有的圖片引用；會話狀態被回收時自動釋放"""
+    
+    def __init__(self, store: BlobStore):
+        self.counts: Counter = Counter()
+        weakref.finalize(self, release_blob_refs, store, self.counts)
+
+def get_session_blob_refs() -> SessionBlobRefs:
+    """獲取當前會話的引用記錄"""
+    if 'blob_refs' not in st.session_state:
+        st.session_state.blob_refs = SessionBlobRefs(get_blob_store())
+    return st.session_state.blob_refs
+
+def store_image(data: bytes) -> str:
+    """存入圖片並由當前會話持有引用"""
+    handle = get_blob_store().put(data)
+    get_session_blob_refs().counts[handle] += 1
+    return handle
+
+def retain_image(handle: str):
+    """當前會話對圖片增加一個引用（如加入收藏）"""
+    get_blob_store().retain(handle)
+    get_session_blob_refs().counts[handle] += 1
+
+def release_images(handles: List[str]):
+    """當前會話釋放圖片引用"""
+    store = get_blob_store()
+    refs = get_session_blob_refs().counts
+    for handle in handles:
+        if refs[handle] > 0:
+            refs[handle] -= 1
+            store.release(handle)
+
+def load_image(handle: str) -> Optional[bytes]:
+    """按句柄讀取圖片字節"""
+    return get_blob_store().get(handle)
+
+def load_thumbnail(handle: str) -> Optional[bytes]:
+    """按句柄讀取縮略圖，尚未生成完成時不等待，返回 None"""
+    return get_blob_store().thumbnail(handle, timeout=0)
+
+def images_bytes(handles: List[str]) -> int:
+    """一組圖片去重後的字節數"""
+    store = get_blob_store()
+    return sum(store.size(handle) for handle in set(handles))
+
+def get_favorites_bytes(extra: Optional[List[str]] = None) -> int:
+    """當前用戶收藏（加上 extra 中待加入的圖片）的字節佔用，共享的圖片只計一次"""
+    handles = [fav['image_handle'] for fav in st.session_state.favorite_images]
+    return images_bytes(handles + (extra or []))
+
+def format_bytes(num_bytes: int) -> str:
+    """格式化字節數顯示"""
+    if num_bytes < 1024 * 1024:
+        return f"{num_bytes / 1024:.0f} KB"
+    return f"{num_bytes / (1024 * 1024):.1f} MB"
+
+# === 持久化歷史 ===
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    entry_id TEXT NOT NULL UNIQUE,
+    owner TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    prompt TEXT NOT NULL,
+    negative_prompt TEXT NOT NULL DEFAULT '',
+    model TEXT NOT NULL,
+    style TEXT NOT NULL DEFAULT '',
+    metadata TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_history_owner_time ON history(owner, created_at DESC, seq DESC);
+
+CREATE TABLE IF NOT EXISTS history_images (
+    entry_seq INTEGER NOT NULL REFERENCES history(seq) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    blob_hash TEXT NOT NULL,
+    PRIMARY KEY (entry_seq, position)
+);
+CREATE INDEX IF NOT EXISTS idx_history_images_hash ON history_images(blob_hash);
+
+CREATE TABLE IF NOT EXISTS favorites (
+    owner TEXT NOT NULL,
+    image_id TEXT NOT NULL,
+    blob_hash TEXT NOT NULL,
+    seed INTEGER,
+    created_at REAL NOT NULL,
+    history_item TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (owner, image_id)
+);
+CREATE INDEX IF NOT EXISTS idx_favorites_hash ON favorites(blob_hash);
+"""
+
+# trigram 分詞按三字元子串索引，中日韓提示詞無需分詞也能命中詞中間的內容；少於三個字元的詞改用 LIKE
+HISTORY_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+    prompt, negative_prompt, model, style,
+    content='history', content_rowid='seq', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts(rowid, prompt, negative_prompt, model, style)
+    VALUES (new.seq, new.prompt, new.negative_prompt, new.model, new.style);
+END;
+CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history BEGIN
+    INSERT INTO history_fts(history_fts, rowid, prompt, negative_prompt, model, style)
+    VALUES ('delete', old.seq, old.prompt, old.negative_prompt, old.model, old.style);
+END;
+"""
+
+class HistoryStore:
+    """SQLite 持久化的歷史和收藏（WAL 模式 + FTS 全文索引）；
+    圖片存在共享的內容尋址存儲中，每條歷史圖片和收藏持有一個持久化引用"""
+    
+    def __init__(self, db_path: str, blob_store: BlobStore, retention: int):
+        self.blob_store = blob_store
+        self.retention = retention
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(HISTORY_SCHEMA)
+        
+        # 部分 SQLite 編譯版本沒有 FTS5 或 trigram 分詞（3.34 之前），退回 LIKE 搜索
+        try:
+            self._conn.executescript(HISTORY_FTS_SCHEMA)
+            self.fts_enabled = True
+        except sqlite3.OperationalError:
+            self.fts_enabled = False
+    
+    # --- 歷史記錄 ---
+    
+    def add_entry(self, owner: str, entry: Dict):
+        """寫入一條歷史記錄，超出保留上限時刪除最舊的記錄"""
+        metadata = entry.get('metadata', {})
+        # 先登記引用再寫記錄：中途失敗只會多留一個引用，不會出現指向已刪除圖片的記錄
+        self.blob_store.link(entry['images'])
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute(
+                    "INSERT INTO history (entry_id, owner, created_at, prompt, negative_prompt, model, style, metadata) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        entry['id'], owner, entry['timestamp'].timestamp(),
+                        entry['prompt'], entry.get('negative_prompt') or '',
+                        entry['model'], metadata.get('style') or '',
+                        json.dumps(metadata, ensure_ascii=False, default=str)
+                    )
+                )
+                self._conn.executemany(
+                    "INSERT INTO history_images (entry_seq, position, blob_hash) VALUES (?, ?, ?)",
+                    [(cursor.lastrowid, i, blob_hash) for i, blob_hash in enumerate(entry['images'])]
+                )
+            self._prune(owner)
+    
+    def _prune(self, owner: str):
+        """刪除超出保留上限的最舊記錄（調用方持有鎖）"""
+        stale = [row['seq'] for row in self._conn.execute(
+            "SELECT seq FROM history WHERE owner = ? "
+            "ORDER BY created_at DESC, seq DESC LIMIT -1 OFFSET ?",
+            (owner, self.retention)
+        )]
+        if stale:
+            self._delete_entries(stale)
+    
+    def _delete_entries(self, seqs: List[int]):
+        """刪除記錄並釋放圖片引用（調用方持有鎖）"""
+        placeholders = ",".join("?" * len(seqs))
+        blob_hashes = [row['blob_hash'] for row in self._conn.execute(
+            f"SELECT blob_hash FROM history_images WHERE entry_seq IN ({placeholders})", seqs
+        )]
+        with self._conn:
+            self._conn.execute(f"DELETE FROM history WHERE seq IN ({placeholders})", seqs)
+        self.blob_store.unlink(blob_hashes)
+    
+    def clear_history(self, owner: str):
+        with self._lock:
+            seqs = [row['seq'] for row in self._conn.execute(
+                "SELECT seq FROM history WHERE owner = ?", (owner,)
+            )]
+            if seqs:
+                self._delete_entries(seqs)
+    
+    def _search_clause(self, query: str) -> Tuple[str, List]:
+        """構建搜索條件：每個詞都須在提示詞、負向提示詞、模型或風格中以子串出現。
+        三個字元以上的詞走 trigram 全文索引，更短的詞（如單個漢字）和無 FTS 時使用 LIKE"""
+        tokens = re.findall(r"\w+", query)
+        if not tokens:
+            return "", []
+        
+        indexed = [token for token in tokens if self.fts_enabled and len(token) >= 3]
+        scanned = [token for token in tokens if token not in indexed]
+        
+        clause, args = "", []
+        if indexed:
+            clause += " AND h.seq IN (SELECT rowid FROM history_fts WHERE history_fts MATCH ?)"
+            args.append(" ".join(f'"{token}"' for token in indexed))
+        for token in scanned:
+            clause += " AND (" + " OR ".join(
+                f"h.{column} LIKE ? ESCAPE '\\'" for column in ("prompt", "negative_prompt", "model", "style")
+            ) + ")"
+            args.extend(["%" + token.replace("_", "\\_") + "%"] * 4)
+        return clause, args
+    
+    def count(self, owner: str, query: str = "") -> int:
+        clause, args = self._search_clause(query)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM history h WHERE h.owner = ?{clause}", [owner, *args]
+            ).fetchone()[0]
+    
+    def page(self, owner: str, query: str = "", cursor: Optional[Tuple[float, int]] = None,
+             limit: int = HISTORY_PAGE_SIZE) -> Tuple[List[Dict], Optional[Tuple[float, int]]]:
+        """按 (created_at, seq) 鍵集分頁查詢，返回本頁記錄和下一頁游標"""
+        clause, args = self._search_clause(query)
+        sql = f"SELECT h.* FROM history h WHERE h.owner = ?{clause}"
+        params = [owner, *args]
+        if cursor is not None:
+            sql += " AND (h.created_at, h.seq) < (?, ?)"
+            params.extend(cursor)
+        sql += " ORDER BY h.created_at DESC, h.seq DESC LIMIT ?"
+        params.append(limit + 1)
+        
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            
+            images: Dict[int, List[str]] = {row['seq']: [] for row in rows}
+            if rows:
+                placeholders = ",".join("?" * len(rows))
+                for image_row in self._conn.execute(
+                    f"SELECT entry_seq, blob_hash FROM history_images "
+                    f"WHERE entry_seq IN ({placeholders}) ORDER BY entry_seq, position",
+                    list(images)
+                ):
+                    images[image_row['entry_seq']].append(image_row['blob_hash'])
+        
+        items = [{
+            "id": row['entry_id'],
+            "timestamp": datetime.datetime.fromtimestamp(row['created_at']),
+            "prompt": row['prompt'],
+            "negative_prompt": row['negative_prompt'],
+            "model": row['model'],
+            "images": images[row['seq']],
+            "metadata": json.loads(row['metadata'])
+        } for row in rows]
+        
+        next_cursor = (rows[-1]['created_at'], rows[-1]['seq']) if has_more else None
+        return items, next_cursor
+    
+    # --- 收藏 ---
+    
+    def add_favorite(self, owner: str, favorite: Dict):
+        self.blob_store.link([favorite['image_handle']])
+        with self._lock:
+            replaced = self._conn.execute(
+                "SELECT blob_hash FROM favorites WHERE owner = ? AND image_id = ?", (owner, favorite['id'])
+            ).fetchone()
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO favorites (owner, image_id, blob_hash, seed, created_at, history_item) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        owner, favorite['id'], favorite['image_handle'], favorite.get('seed'),
+                        favorite['timestamp'].timestamp(),
+                        json.dumps(favorite.get('history_item', {}), ensure_ascii=False, default=str)
+                    )
+                )
+            if replaced:
+                self.blob_store.unlink([replaced['blob_hash']])
+    
+    def remove_favorite(self, owner: str, image_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT blob_hash FROM favorites WHERE owner = ? AND image_id = ?", (owner, image_id)
+            ).fetchone()
+            with self._conn:
+                self._conn.execute("DELETE FROM favorites WHERE owner = ? AND image_id = ?", (owner, image_id))
+            if row:
+                self.blob_store.unlink([row['blob_hash']])
+    
+    def clear_favorites(self, owner: str):
+        with self._lock:
+            blob_hashes = [row['blob_hash'] for row in self._conn.execute(
+                "SELECT blob_hash FROM favorites WHERE owner = ?", (owner,)
+            )]
+            with self._conn:
+                self._conn.execute("DELETE FROM favorites WHERE owner = ?", (owner,))
+            self.blob_store.unlink(blob_hashes)
+    
+    def load_favorites(self, owner: str) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM favorites WHERE owner = ? ORDER BY created_at DESC", (owner,)
+            ).fetchall()
+        
+        return [{
+            "id": row['image_id'],
+            "image_handle": row['blob_hash'],
+            "seed": row['seed'],
+            "bytes": self.blob_store.size(row['blob_hash']),
+            "timestamp": datetime.datetime.fromtimestamp(row['created_at']),
+            "history_item": json.loads(row['history_item'])
+        } for row in rows]
+
+@st.cache_resource
+def get_history_store() -> HistoryStore:
+    """進程級共享的持久化歷史存儲"""
+    return HistoryStore(
+        os.path.join(DATA_DIR, "history.db"),
+        get_blob_store(),
+        HISTORY_RETENTION
+    )
+
+def get_history_owner() -> str:
+    """當前瀏覽器的歷史歸屬標識，保存在 URL 參數中以便重連後恢復"""
+    if 'history_owner' not in st.session_state:
+        owner = uuid.uuid4().hex
+        try:
+            sid = st.query_params.get("sid", "")
+            if re.fullmatch(r"[0-9a-f]{32}", sid):
+                owner = sid
+            else:
+                st.query_params["sid"] = owner
+        except AttributeError:
+            pass
+        st.session_state.history_owner = owner
+    return st.session_state.history_owner
+
+def persist_history_entry(entry: Dict) -> bool:
+    """把歷史記錄寫入持久化存儲（圖片已在共享存儲中，記錄只持有引用），失敗時不影響本次生成"""
+    try:
+        get_history_store().add_entry(get_history_owner(), entry)
+        return True
+    except (sqlite3.Error, OSError) as e:
+        st.warning(f"歷史記錄保存失敗: {str(e)[:100]}")
+        return False
+
+# === 後台生成任務 ===
+
+class GenerationJob:
+    """一次生成請求的狀態；工作線程寫入進度，腳本線程按任務 ID 輪詢讀取"""
+    
+    def __init__(self, owner: str, total: int, meta: Dict):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.total = total
+        self.meta = meta
+        self.status = "queued"
+        self.result: Optional[Tuple[bool, any]] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._previews: Dict[int, bytes] = {}
+        self._errors: Dict[int, str] = {}
+        self._bytes: Dict[int, Tuple[int, Optional[int]]] = {}
+        self._lock = threading.Lock()
+        self.cancel_token = CancellationToken()
+    
+    def report_bytes(self, index: int, received: int, total: Optional[int]):
+        """記錄單張圖片的下載進度"""
+        with self._lock:
+            if index not in self._previews:
+                self._bytes[index] = (received, total)
+    
+    def report(self, index: int, content: Optional[bytes] = None, error: Optional[str] = None):
+        """記錄單張圖片完成（重複報告同一索引是安全的）"""
+        with self._lock:
+            self._bytes.pop(index, None)
+            if content is not None:
+                self._previews[index] = content
+                self._errors.pop(index, None)
+            elif error and index not in self._previews:
+                self._errors[index] = error
+    
+    def start(self):
+        with self._lock:
+            self.status = "running"
+    
+    def cancel(self):
+        """請求取消；已完成的圖片仍會保留"""
+        self.cancel_token.cancel()
+    
+    def finish(self, result: Tuple[bool, any]):
+        with self._lock:
+            self.result = result
+            if self.cancel_token.cancelled:
+                self.status = "cancelled"
+            else:
+                self.status = "done" if result[0] else "failed"
+            self.finished_at = time.time()
+    
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+    
+    def snapshot(self) -> Dict:
+        """當前進度的一致性快照"""
+        with self._lock:
+            return {
+                "status": self.status,
+                "total": self.total,
+                "completed": len(self._previews) + len(self._errors),
+                "previews": dict(self._previews),
+                "errors": [self._errors[i] for i in sorted(self._errors)],
+                "downloading": dict(self._bytes),
+            }
+
+class JobQueue:
+    """進程級生成任務隊列：工作線程執行任務，與 Streamlit 腳本運行解耦"""
+    
+    def __init__(self, workers: int, retention: float):
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="genjob")
+        self._jobs: Dict[str, GenerationJob] = {}
+        self._lock = threading.Lock()
+    
+    def submit(self, job: GenerationJob, fn: Callable[[GenerationJob], Tuple[bool, any]],
+               context=None) -> str:
+        """提交任務，fn(job) 在工作線程中執行並返回 (是否成功, 結果)；
+        context 為提交時的 ScriptRunContext，讓任務內的 st.cache_resource 查詢可用"""
+        self._prune()
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, context)
+        return job.id
+    
+    def _run(self, job: GenerationJob, fn: Callable, context):
+        # 排隊期間已取消的任務直接結束
+        if job.cancel_token.cancelled:
+            job.finish((False, "生成已取消"))
+            return
+        
+        if context is not None:
+            add_script_run_ctx(threading.current_thread(), context)
+        job.start()
+        try:
+            result = fn(job)
+        except GenerationCancelled as e:
+            result = (False, str(e))
+        except Exception as e:
+            result = (False, str(e)[:200])
+        job.finish(result)
+    
+    def get(self, job_id: str, owner: str) -> Optional[GenerationJob]:
+        """按 ID 獲取任務，只返回屬於該會話的任務"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None and job.owner == owner else None
+    
+    def discard(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+    
+    def _prune(self):
+        """清理結果長時間無人領取的已完成任務（如會話已關閉）"""
+        cutoff = time.time() - self.retention
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished_at < cutoff]:
+                del self._jobs[job_id]
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            statuses = Counter(job.status for job in self._jobs.values())
+        return {"queued": statuses["queued"], "running": statuses["running"]}
+
+@st.cache_resource
+def get_job_queue() -> JobQueue:
+    """進程級共享的生成任務隊列"""
+    return JobQueue(JOB_WORKERS, JOB_RETENTION_SECONDS)
+
+def get_session_jobs() -> List[GenerationJob]:
+    """當前會話仍可查詢的任務（提交順序）；已被清理的任務 ID 會被丟棄"""
+    queue = get_job_queue()
+    owner = get_history_owner()
+    jobs = [queue.get(job_id, owner) for job_id in st.session_state.get('active_jobs', [])]
+    jobs = [job for job in jobs if job is not None]
+    st.session_state.active_jobs = [job.id for job in jobs]
+    return jobs
+
+def count_running_jobs(jobs: List[GenerationJob]) -> int:
+    """計入會話上限的任務數：未完成且未被取消"""
+    return sum(1 for job in jobs if not job.finished and not job.cancel_token.cancelled)
+
+def cancel_session_jobs():
+    """取消當前會話所有未完成的任務"""
+    for job in get_session_jobs():
+        if not job.finished:
+            job.cancel()
+
+def submit_generation_job(client, cfg: Dict, params: Dict, meta: Dict, supersede: bool = False) -> Optional[str]:
+    """提交後台生成任務並記錄到當前會話；supersede 時先取消本會話進行中的任務。
+    會話進行中的任務已達 MAX_SESSION_JOBS 時不提交，返回 None"""
+    if supersede:
+        cancel_session_jobs()
+    elif count_running_jobs(get_session_jobs()) >= MAX_SESSION_JOBS:
+        return None
+    
+    routing = build_routing_config()
+    if routing is not None:
+        cfg = {**cfg, "routing": routing}
+    
+    st.session_state.last_latency_workload = latency_workload(params)
+    job = GenerationJob(get_history_owner(), params.get("n", 1), meta)
+    job_id = get_job_queue().submit(
+        job,
+        lambda job: generate_images_with_retry(client, dict(cfg), job, **params),
+        get_script_run_ctx()
+    )
+    st.session_state.setdefault('active_jobs', []).append(job_id)
+    return job_id
+
+def collect_finished_jobs() -> int:
+    """在腳本線程中領取已完成任務：存入圖片和歷史記錄；返回領取的任務數"""
+    queue = get_job_queue()
+    collected = 0
+    for job in get_session_jobs():
+        if not job.finished:
+            continue
+        
+        collected += 1
+        queue.discard(job.id)
+        st.session_state.active_jobs.remove(job.id)
+        st.session_state.last_generation_time = datetime.datetime.fromtimestamp(job.finished_at)
+        
+        success, result = job.result
+        meta = job.meta
+        if success and hasattr(result, 'data') and result.data:
+            img_handles = [store_image(img.content) for img in result.data]
+            img_seeds = [getattr(img, 'seed', None) for img in result.data]
+            
+            entry = add_to_history(
+                meta['prompt'],
+                meta['negative_prompt'],
+                meta['model'],
+                img_handles,
+                {**meta['metadata'], "seeds": img_seeds}
+            )
+            st.session_state.latest_generation = {
+                "entry": entry,
+                "errors": job.snapshot()["errors"],
+                "cancelled": job.status == "cancelled",
+            }
+            gc.collect()
+        elif job.status == "cancelled":
+            st.session_state.latest_generation = {"entry": None, "errors": [], "cancelled": True}
+        else:
+            st.session_state.latest_generation = {"entry": None, "errors": [str(result)]}
+    
+    st.session_state.generation_in_progress = bool(st.session_state.get('active_jobs'))
+    return collected
+
+def show_active_jobs():
+    """顯示進行中任務的進度和已完成的預覽"""
+    for job in get_session_jobs():
+        if job.finished:
+            continue
+        
+        snapshot = job.snapshot()
+        with st.container():
+            if job.cancel_token.cancelled:
+                st.caption(f"⏹️ 正在取消: {job.meta['model_name']} × {snapshot['total']}")
+                continue
+            
+            if st.button("⏹️ 取消", key=f"cancel_{job.id}", help="取消此任務，已完成的圖片會保留"):
+                job.cancel()
+                rerun_app()
+            
+            if snapshot["status"] == "queued":
+                st.info(f"⏳ 排隊中: {job.meta['model_name']} × {snapshot['total']}")
+                continue
+            
+            # 進度按已接收字節計入下載中的圖片（有 Content-Length 時）
+            downloading = snapshot["downloading"]
+            partial_progress = sum(
+                min(received / total, 1.0) for received, total in downloading.values() if total
+            )
+            st.progress(min((snapshot["completed"] + partial_progress) / max(snapshot["total"], 1), 1.0))
+            
+            status = (
+                f"🎨 正在使用 {job.meta['model_name']} 生成... "
+                f"已完成 {snapshot['completed']}/{snapshot['total']} 張圖片"
+            )
+            if downloading:
+                received_bytes = sum(received for received, _ in downloading.values())
+                status += f"，{len(downloading)} 張接收中 ({format_bytes(received_bytes)})"
+            st.caption(status)
+            if snapshot["previews"]:
+                preview_cols = st.columns(min(snapshot["total"], 3))
+                for i, content in sorted(snapshot["previews"].items()):
+                    with preview_cols[i % len(preview_cols)]:
+                        st.image(content, caption=f"#{i+1}", use_container_width=True)
+
+def job_panel():
+    """任務面板：只重跑本片段輪詢進度；有任務完成時整頁重載，更新歷史、標籤計數和生成按鈕"""
+    if collect_finished_jobs():
+        rerun_app()
+    show_active_jobs()
+    show_latest_generation()
+
+def show_job_panel():
+    """顯示任務面板；有進行中的任務時以片段每 JOB_POLL_INTERVAL 秒刷新，不重跑整個頁面
+    （不支持片段的舊版 Streamlit 由 main 結尾整頁輪詢）"""
+    if not hasattr(st, 'fragment'):
+        job_panel()
+        return
+    run_every = JOB_POLL_INTERVAL if st.session_state.get('active_jobs') else None
+    st.fragment(job_panel, run_every=run_every)()
+
+def show_latest_generation():
+    """顯示最近一次完成的生成結果"""
+    latest = st.session_state.get('latest_generation')
+    if not latest:
+        return
+    
+    if latest.get("cancelled"):
+        st.info("⏹️ 生成已取消" + ("，已保留完成的圖片" if latest["entry"] else ""))
+    
+    for error in latest["errors"]:
+        if latest["entry"] is None:
+            st.error(f"❌ 生成失敗: {error}")
+        else:
+            st.warning(error)
+    
+    entry = latest["entry"]
+    if entry is None:
+        return
+    
+    seeds = entry['metadata'].get('seeds') or [None] * len(entry['images'])
+    st.success(f"✨ 成功生成 {len(entry['images'])} 張圖像！")
+    
+    if len(entry['images']) == 1:
+        display_image_with_actions(entry['images'][0], f"{entry['id']}_0", entry, seeds[0])
+    else:
+        cols = st.columns(2)
+        for i, image_handle in enumerate(entry['images']):
+            with cols[i % 2]:
+                display_image_with_actions(image_handle, f"{entry['id']}_{i}", entry, seeds[i])
+
+# === 多存檔負載均衡 ===
+
+class ProfileBalancer:
+    """進程級存檔負載狀態：未完成請求數、平滑加權輪詢的當前權重和失敗冷卻；存檔以 rate_limit_key 標識"""
+    
+    def __init__(self):
+        self._outstanding: Counter = Counter()
+        self._current: Dict[str, float] = {}
+        self._cooldown_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+    
+    def acquire(self, members: List[Tuple[str, float]], strategy: str) -> str:
+        """從 (存檔鍵, 權重) 中選出一個存檔並計入一個未完成請求；冷卻中的存檔僅在沒有其他選擇時使用"""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [m for m in members if self._cooldown_until.get(m[0], 0) <= now] or members
+            
+            if strategy == "最少未完成請求":
+                key = min(candidates, key=lambda m: (self._outstanding[m[0]] + 1) / m[1])[0]
+            else:
+                # 平滑加權輪詢：每輪各自加上權重，選當前值最大者並減去總權重
+                total = sum(weight for _, weight in candidates)
+                for member, weight in candidates:
+                    self._current[member] = self._current.get(member, 0.0) + weight
+                key = max(candidates, key=lambda m: self._current[m[0]])[0]
+                self._current[key] -= total
+            
+            self._outstanding[key] += 1
+            return key
+    
+    def release(self, key: str, count: int = 1):
+        with self._lock:
+            self._outstanding[key] = max(0, self._outstanding[key] - count)
+    
+    def penalize(self, key: str, seconds: float = ROUTING_COOLDOWN):
+        """存檔出錯或被限流時暫停分配"""
+        with self._lock:
+            self._cooldown_until[key] = time.monotonic() + seconds
+    
+    def state(self, key: str) -> Dict:
+        with self._lock:
+            return {
+                "outstanding": self._outstanding[key],
+                "cooldown": max(0.0, self._cooldown_until.get(key, 0) - time.monotonic()),
+            }
+
+@st.cache_resource
+def get_profile_balancer() -> ProfileBalancer:
+    return ProfileBalancer()
+
+@st.cache_resource
+def get_routing_executor() -> ThreadPoolExecutor:
+    """執行各存檔子批次的線程池（與扇出線程池分開，避免互相等待造成死鎖）"""
+    return ThreadPoolExecutor(max_workers=ROUTING_WORKERS, thread_name_prefix="route")
+
+def build_routing_config() -> Optional[Dict]:
+    """由會話中的存檔池設置構建路由配置；未啟用或可用存檔少於兩個時返回 None"""
+    if not st.session_state.get('routing_enabled'):
+        return None
+    
+    profiles = st.session_state.api_profiles
+    weights = st.session_state.get('routing_weights', {})
+    members = [
+        {
+            "name": name,
+            "cfg": dict(profiles[name]),
+            "weight": float(weights.get(name, profiles[name].get('weight', 1.0))),
+        }
+        for name in st.session_state.get('routing_pool', [])
+        if profiles.get(name, {}).get('validated')
+    ]
+    members = [m for m in members if m["weight"] > 0]
+    if len(members) < 2:
+        return None
+    return {"strategy": st.session_state.get('routing_strategy', ROUTING_STRATEGIES[0]), "members": members}
+
+def dispatch_profile(member_cfg: Dict, params: Dict, indices: List[int],
+                     on_image: Callable, on_bytes: Optional[Callable],
+                     cancel_token: Optional[CancellationToken], deadline: float,
+                     context) -> Tuple[bool, any]:
+    """在路由線程中用單個存檔生成一部分圖片（共用整批的截止時刻）；回調索引換算回整批索引"""
+    if context is not None:
+        add_script_run_ctx(threading.current_thread(), context)
+    
+    provider = member_cfg.get('provider')
+    client = None
+    if provider not in ["Pollinations.ai", "Hugging Face"]:
+        client = get_openai_client(member_cfg.get('api_key', ''), member_cfg.get('base_url', ''))
+    
+    return dispatch_generation(
+        provider, client, member_cfg,
+        {**params, "n": len(indices), "seeds": [params["seeds"][i] for i in indices]},
+        len(indices),
+        lambda i, data, error: on_image(indices[i], data, error),
+        (lambda i, received, total: on_bytes(indices[i], received, total)) if on_bytes else None,
+        cancel_token, deadline
+    )
+
+def dispatch_routed(routing: Dict, params: Dict, n_images: int,
+                    on_image: Optional[Callable] = None,
+                    on_bytes: Optional[Callable] = None,
+                    cancel_token: Optional[CancellationToken] = None,
+                    deadline: Optional[float] = None) -> Tuple[bool, any]:
+    """把一批圖片按策略分給存檔池並行生成；失敗的圖片轉移到尚未嘗試過的存檔，直到成功、存檔用盡或超出整批截止時刻。
+    截止時刻只計算一次，每輪轉移共用剩餘的時間預算"""
+    deadline = deadline or batch_deadline()
+    balancer = get_profile_balancer()
+    members = {rate_limit_key(m["cfg"]): m for m in routing["members"]}
+    seeds = list(params["seeds"])
+    sources: Dict[int, Tuple[str, str]] = {}
+    results: Dict[int, bytes] = {}
+    errors: Dict[int, str] = {}
+    tried: Dict[int, set] = {i: set() for i in range(n_images)}
+    lock = threading.Lock()
+    context = get_script_run_ctx()
+    
+    def record(i: int, data: Optional[bytes], error: Optional[str]):
+        # 失敗先暫存，轉移後仍失敗才報告
+        with lock:
+            if data is not None:
+                results[i] = data
+            elif error:
+                errors[i] = error
+        if data is not None and on_image is not None:
+            on_image(i, data, None)
+    
+    remaining = list(range(n_images))
+    while remaining and not (cancel_token is not None and cancel_token.cancelled):
+        if time.monotonic() >= deadline:
+            for i in remaining:
+                errors.setdefault(i, "超出整批生成的時間預算")
+            break
+        # 按端點健康度縮放權重，熔斷中的端點不分配（除非沒有其他選擇）
+        health = {
+            key: get_circuit_breaker(endpoint_key(m["cfg"])).snapshot() for key, m in members.items()
+        }
+        groups: Dict[str, List[int]] = {}
+        for i in remaining:
+            untried = [key for key in members if key not in tried[i]]
+            options = [
+                (key, members[key]["weight"] * max(health[key]["health"], 0.1))
+                for key in untried if health[key]["state"] != "open" or health[key]["retry_in"] <= 0
+            ] or [(key, members[key]["weight"]) for key in untried]
+            key = balancer.acquire(options, routing["strategy"])
+            tried[i].add(key)
+            groups.setdefault(key, []).append(i)
+        
+        executor = get_routing_executor()
+        futures = {
+            executor.submit(
+                dispatch_profile, members[key]["cfg"], params, indices,
+                record, on_bytes, cancel_token, deadline, context
+            ): key
+            for key, indices in groups.items()
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            balancer.release(key, len(groups[key]))
+            try:
+                success, result = future.result()
+            except Exception as e:
+                success, result = False, e
+            
+            if success:
+                # 子批次結果帶回實際使用的種子（不接收種子的存檔為 None）和生成它的端點
+                member_cfg = members[key]["cfg"]
+                for image in result.data:
+                    seeds[groups[key][image.index]] = image.seed
+                    sources[groups[key][image.index]] = (member_cfg.get('provider'), member_cfg.get('base_url', ''))
+            else:
+                balancer.penalize(key)
+                for i in groups[key]:
+                    errors.setdefault(i, f"{members[key]['name']}: {describe_error(result) if isinstance(result, Exception) else str(result)[:100]}")
+        
+        remaining = [
+            i for i in remaining
+            if i not in results and len(tried[i]) < len(members)
+        ]
+    
+    for i in range(n_images):
+        if i not in results and i in errors and on_image is not None:
+            on_image(i, None, errors[i])
+    
+    generated_images = [
+        type('Image', (object,), {'content': results[i], 'seed': seeds[i], 'index': i, 'source': sources.get(i)})
+        for i in sorted(results)
+    ]
+    
+    if generated_images:
+        response_obj = type('Response', (object,), {'data': generated_images})
+        return True, response_obj
+    elif cancel_token is not None and cancel_token.cancelled:
+        return False, "生成已取消"
+    else:
+        return False, errors[min(errors)] if errors else "所有圖片生成均失敗"
+
+# === 圖像生成功能 ===
+
+def generate_images_with_retry(client, cfg: Dict, job: Optional["GenerationJob"] = None,
+                               **params) -> Tuple[bool, any]:
+    """統一的圖像生成入口（先查結果快取，只請求未命中的圖片）；可在工作線程中運行，進度寫入 job"""
+    provider = cfg.get('provider')
+    n_images = params.get("n", 1)
+    seeds = params.get("seeds") or [None] * n_images
+    
+    # 只有帶種子的圖片可重現，才按種子查快取
+    cache = get_result_cache()
+    cache_keys = [
+        generation_cache_key(provider, cfg.get('base_url', ''), params, seed) if seed is not None else None
+        for seed in seeds
+    ]
+    images = [cache.get(key) if key is not None else None for key in cache_keys]
+    image_seeds = list(seeds)
+    missing = [i for i, data in enumerate(images) if data is None]
+    
+    on_image = None
+    if job is not None:
+        for i, data in enumerate(images):
+            if data is not None:
+                job.report(i, data)
+        
+        def on_image(i: int, data: Optional[bytes], error: Optional[str]):
+            job.report(missing[i], data, error)
+        
+        def on_bytes(i: int, received: int, total: Optional[int]):
+            job.report_bytes(missing[i], received, total)
+    else:
+        on_bytes = None
+    
+    if missing:
+        batch_params = {**params, "n": len(missing), "seeds": [seeds[i] for i in missing]}
+        cancel_token = job.cancel_token if job is not None else None
+        deadline = batch_deadline()
+        if cfg.get("routing"):
+            success, result = dispatch_routed(
+                cfg["routing"], batch_params, len(missing), on_image, on_bytes, cancel_token, deadline
+            )
+        else:
+            success, result = dispatch_generation(
+                provider, client, cfg, batch_params, len(missing), on_image, on_bytes, cancel_token, deadline
+            )
+        if success:
+            # 按批次索引把結果對回原位置（部分失敗時結果少於請求數）；
+            # 種子為 None 的結果（供應商未使用種子）不寫入快取；
+            # 路由結果按實際生成它的存檔寫入快取，不同供應商的圖片不共用快取鍵
+            for image in result.data:
+                i = missing[image.index]
+                images[i] = image.content
+                image_seeds[i] = image.seed
+                cache_key = cache_keys[i]
+                if cfg.get("routing"):
+                    source = getattr(image, 'source', None)
+                    cache_key = generation_cache_key(*source, params, image.seed) if source else None
+                if image.seed is not None and cache_key is not None:
+                    cache.put(cache_key, image.content)
+                if job is not None:
+                    job.report(i, image.content)
+        elif len(missing) == n_images:
+            return False, result
+    
+    generated_images = [
+        type('Image', (object,), {'content': data, 'seed': seed, 'index': i})
+        for i, (data, seed) in enumerate(zip(images, image_seeds)) if data is not None
+    ]
+    response_obj = type('Response', (object,), {'data': generated_images})
+    return True, response_obj
+
+def provider_supports_seeds(provider: Optional[str]) -> bool:
+    """供應商是否在請求中使用種子（決定是否提供種子模式和按種子快取）"""
+    return provider in SEEDED_PROVIDERS
+
+def fill_seeds(seeds: Optional[List[Optional[int]]], n_images: int) -> List[int]:
+    """為未指定種子的圖片分配隨機種子（帶種子的供應商總是記錄實際使用的種子）"""
+    seeds = seeds or [None] * n_images
+    return [seed if seed is not None else random.randint(0, MAX_SEED) for seed in seeds]
+
+def resolve_seeds(seed_mode: str, base_seed: int, n_images: int) -> List[int]:
+    """按種子模式為每張圖片分配種子"""
+    if seed_mode == "固定":
+        return [base_seed] * n_images
+    elif seed_mode == "遞增":
+        return [(base_seed + i) % (MAX_SEED + 1) for i in range(n_images)]
+    else:
+        return [random.randint(0, MAX_SEED) for _ in range(n_images)]
+
+def dispatch_generation(provider: str, client, cfg: Dict, params: Dict, n_images: int,
+                        on_image: Optional[Callable] = None,
+                        on_bytes: Optional[Callable] = None,
+                        cancel_token: Optional[CancellationToken] = None,
+                        deadline: Optional[float] = None) -> Tuple[bool, any]:
+    """按供應商分派生成請求；on_bytes(索引, 已接收字節, 總字節) 報告下載進度"""
+    if provider == "Pollinations.ai":
+        return generate_pollinations_images(cfg, params, n_images, on_image, on_bytes, cancel_token, deadline)
+    elif provider == "Hugging Face":
+        return generate_huggingface_images(cfg, params, n_images, on_image, on_bytes, cancel_token, deadline)
+    else:
+        return generate_openai_compatible_images(
+            client, cfg, params, n_images, on_image, on_bytes, cancel_token, deadline
+        )
+
+def build_pollinations_request(params: Dict, cfg: Dict) -> Tuple[str, Dict]:
+    """構建 Pollinations.ai 請求的 URL 和認證頭"""
+    # 構建提示詞
+    prompt = params.get("prompt", "")
+    if neg_prompt := params.get("negative_prompt"):
+        prompt += f" --no {neg_prompt}"
+    
+    # 解析尺寸
+    width, height = str(params.get("size", "1024x1024")).split('x')
     
-    for category in priority_order:
-        if category in categorized:
-            sorted_categorized[category] = categorized[category]
+    # API參數
+    api_params = {}
+    for key, value in {
+        "model": params.get("model"),
+        "width": width,
+        "height": height,
+        "seed": params.get("seed"),
+        "nologo": params.get("nologo"),
+        "private": params.get("private"),
+        "enhance": params.get("enhance"),
+        "safe": params.get("safe")
+    }.items():
+        if value is not None:
+            api_params[key] = value
     
-    # 添加其他未知類別
-    for category, models in categorized.items():
-        if category not in sorted_categorized:
-            sorted_categorized[category] = models
+    # 認證頭
+    headers = {}
+    auth_mode = cfg.get('pollinations_auth_mode', '免費')
     
-    return sorted_categorized
-
-# === 圖像生成功能 ===
+    if auth_mode == '令牌' and cfg.get('pollinations_token'):
+        headers['Authorization'] = f"Bearer {cfg['pollinations_token']}"
+    elif auth_mode == '域名' and cfg.get('pollinations_referrer'):
+        headers['Referer'] = cfg['pollinations_referrer']
+    
+    url = f"{cfg['base_url']}/prompt/{quote(prompt)}?{urlencode(api_params)}"
+    return url, headers
 
-def generate_images_with_retry(client, **params) -> Tuple[bool, any]:
-    """統一的圖像生成入口"""
-    provider = get_active_config().get('provider')
-    n_images = params.get("n", 1)
+def generate_pollinations_images(cfg: Dict, params: Dict, n_images: int,
+                                 on_image: Optional[Callable] = None,
+                                 on_bytes: Optional[Callable] = None,
+                                 cancel_token: Optional[CancellationToken] = None,
+                                 deadline: Optional[float] = None) -> Tuple[bool, any]:
+    """Pollinations.ai 圖像生成（每張圖片一個種子，並行請求，流式接收）"""
+    http_client = get_async_runner().http_client("Pollinations.ai", cfg['base_url'])
+    seeds = fill_seeds(params.get("seeds"), n_images)
     
-    st.session_state.generation_in_progress = True
+    # 每次嘗試按該模型在此尺寸下的歷史耗時設置超時，卡住的連接盡早失敗並重試
+    tracker = get_latency_tracker()
+    model = params.get("model", "")
+    workload = latency_workload(params)
     
-    try:
-        if provider == "Pollinations.ai":
-            return generate_pollinations_images(params, n_images)
-        elif provider == "Hugging Face":
-            return generate_huggingface_images(params, n_images)
+    # 對沖模式：超過該模型歷史分位數仍未返回時以相同種子發出副本
+    limiter = get_rate_limiter(cfg)
+    hedge_settings = get_hedge_settings()
+    hedge_after = None
+    if hedge_settings["enabled"]:
+        hedge_after = tracker.quantile(
+            "Pollinations.ai", model, hedge_settings["percentile"],
+            int(get_timeout_settings()["min_samples"]), workload
+        )
+        hedge_budget = get_hedge_budget("Pollinations.ai", hedge_settings["budget"])
+        # 副本與主請求共用供應商的並發上限
+        hedge_semaphore = get_async_runner().semaphore(
+            "Pollinations.ai", get_provider_concurrency("Pollinations.ai")
+        )
+    
+    async def make_request(i: int, url: str, headers: Dict, token: Optional[CancellationToken]):
+        request = partial(
+            async_stream_request, http_client, "GET", url,
+            partial(on_bytes, i) if on_bytes else None, token,
+            headers=headers, timeout=tracker.timeout("Pollinations.ai", model, workload)
+        )
+        return await async_timed_call(tracker, "Pollinations.ai", model, workload, request)
+    
+    jobs = []
+    for i, seed in enumerate(seeds):
+        current_params = params.copy()
+        current_params["seed"] = seed
+        url, headers = build_pollinations_request(current_params, cfg)
+        if hedge_after is not None:
+            jobs.append(partial(
+                async_hedged_call, partial(make_request, i, url, headers), hedge_after,
+                hedge_budget, limiter, cancel_token, hedge_semaphore
+            ))
         else:
-            return generate_openai_compatible_images(client, params, n_images)
-    finally:
-        st.session_state.generation_in_progress = False
-        st.session_state.last_generation_time = datetime.datetime.now()
+            jobs.append(partial(make_request, i, url, headers, cancel_token))
+    
+    return run_image_batch(
+        "Pollinations.ai", jobs, seeds, on_image, limiter, cancel_token,
+        get_circuit_breaker(endpoint_key(cfg)), slow_call_threshold("Pollinations.ai", model, workload), deadline
+    )
 
-def generate_pollinations_images(params: Dict, n_images: int) -> Tuple[bool, any]:
-    """Pollinations.ai 圖像生成"""
-    generated_images = []
-    cfg = get_active_config()
+def generate_huggingface_images(cfg: Dict, params: Dict, n_images: int,
+                                on_image: Optional[Callable] = None,
+                                on_bytes: Optional[Callable] = None,
+                                cancel_token: Optional[CancellationToken] = None,
+                                deadline: Optional[float] = None) -> Tuple[bool, any]:
+    """Hugging Face 圖像生成（理解模型載入中的 503 響應）"""
     
-    # 創建進度條
-    progress_bar = st.progress(0)
-    status_text = st.empty()
+    headers = {"Authorization": f"Bearer {cfg['api_key']}"}
+    model = params.get("model")
+    prompt = params.get("prompt", "")
     
-    for i in range(n_images):
-        try:
-            status_text.text(f"正在生成第 {i+1}/{n_images} 張圖片...")
-            progress_bar.progress((i) / n_images)
-            
-            current_params = params.copy()
-            current_params["seed"] = random.randint(0, 2**32 - 1)
-            
-            # 構建提示詞
-            prompt = current_params.get("prompt", "")
-            if neg_prompt := current_params.get("negative_prompt"):
-                prompt += f" --no {neg_prompt}"
-            
-            # 解析尺寸
-            width, height = str(current_params.get("size", "1024x1024")).split('x')
-            
-            # API參數
-            api_params = {}
-            for key, value in {
-                "model": current_params.get("model"),
-                "width": width,
-                "height": height,
-                "seed": current_params.get("seed"),
-                "nologo": current_params.get("nologo"),
-                "private": current_params.get("private"),
-                "enhance": current_params.get("enhance"),
-                "safe": current_params.get("safe")
-            }.items():
-                if value is not None:
-                    api_params[key] = value
-            
-            # 認證頭
-            headers = {}
-            auth_mode = cfg.get('pollinations_auth_mode', '免費')
-            
-            if auth_mode == '令牌' and cfg.get('pollinations_token'):
-                headers['Authorization'] = f"Bearer {cfg['pollinations_token']}"
-            elif auth_mode == '域名' and cfg.get('pollinations_referrer'):
-                headers['Referer'] = cfg['pollinations_referrer']
-            
-            # 發送請求
-            url = f"{cfg['base_url']}/prompt/{quote(prompt)}?{urlencode(api_params)}"
-            response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
-            
-            if response.ok:
-                b64_json = base64.b64encode(response.content).decode()
-                image_obj = type('Image', (object,), {'b64_json': b64_json})
-                generated_images.append(image_obj)
-            else:
-                st.warning(f"第 {i+1} 張圖片生成失敗: HTTP {response.status_code}")
-                
-        except Exception as e:
-            st.warning(f"第 {i+1} 張圖片生成錯誤: {str(e)[:100]}")
-            continue
+    # 快速預覽配置覆蓋步數和尺寸
+    profile = QUALITY_PROFILES.get(params.get("quality", "完整"), {})
+    size = str(params.get("size", "512x512"))
+    if "max_edge" in profile:
+        size = scale_size(size, profile["max_edge"])
+    width, height = (int(v) for v in size.split('x'))
     
-    # 清理UI
-    progress_bar.progress(1.0)
-    status_text.text(f"完成生成 {len(generated_images)}/{n_images} 張圖片")
-    time.sleep(1)
-    progress_bar.empty()
-    status_text.empty()
+    # HF API payload
+    payload = {
+        "inputs": prompt,
+        "parameters": {
+            "negative_prompt": params.get("negative_prompt", ""),
+            "num_inference_steps": int(profile.get(
+                "num_inference_steps", params.get("num_inference_steps", HF_DEFAULT_STEPS)
+            )),
+            "guidance_scale": float(params.get("guidance_scale", HF_DEFAULT_GUIDANCE)),
+            "width": width,
+            "height": height,
+        }
+    }
+    if params.get("scheduler"):
+        payload["parameters"]["scheduler"] = params["scheduler"]
     
-    if generated_images:
-        response_obj = type('Response', (object,), {'data': generated_images})
-        return True, response_obj
-    else:
-        return False, "所有圖片生成均失敗"
+    url = hf_model_url(cfg['base_url'], model)
+    http_client = get_async_runner().http_client("Hugging Face", cfg['base_url'])
+    tracker = get_warmup_tracker()
+    latency_tracker = get_latency_tracker()
+    workload = latency_workload(params)
+    seeds = fill_seeds(params.get("seeds"), n_images)
+    
+    async def make_request(i: int, seeded_payload: Dict):
+        # 每次嘗試按該模型在此負載下的歷史耗時設置超時（連續超時後會放寬）
+        return await async_hf_post(
+            http_client, url, headers, seeded_payload, tracker,
+            latency_tracker.timeout("Hugging Face", model, workload),
+            partial(on_bytes, i) if on_bytes else None, cancel_token
+        )
+    
+    # 模型冷啟動時返回 503 和 estimated_time，由重試層按預計時間等待後重試
+    jobs = []
+    for i, seed in enumerate(seeds):
+        seeded_payload = {**payload, "parameters": {**payload["parameters"], "seed": seed}}
+        jobs.append(partial(
+            async_timed_call, latency_tracker, "Hugging Face", model, workload,
+            partial(make_request, i, seeded_payload)
+        ))
+    
+    return run_image_batch(
+        "Hugging Face", jobs, seeds, on_image, get_rate_limiter(cfg), cancel_token,
+        get_circuit_breaker(endpoint_key(cfg)), slow_call_threshold("Hugging Face", model, workload), deadline
+    )
 
-def generate_huggingface_images(params: Dict, n_images: int) -> Tuple[bool, any]:
-    """Hugging Face 圖像生成"""
-    generated_images = []
-    cfg = get_active_config()
+class ModelCapabilities:
+    """進程級的模型能力記錄（從錯誤中學習），按 端點|模型 索引：單次請求張數上限、是否支持 url 響應"""
     
-    progress_bar = st.progress(0)
-    status_text = st.empty()
+    def __init__(self):
+        self._limits: Dict[str, int] = {}
+        self._no_url: set = set()
+        self._lock = threading.Lock()
     
-    for i in range(n_images):
-        try:
-            status_text.text(f"正在通過HF生成第 {i+1}/{n_images} 張圖片...")
-            progress_bar.progress(i / n_images)
-            
-            headers = {"Authorization": f"Bearer {cfg['api_key']}"}
-            model = params.get("model")
-            prompt = params.get("prompt", "")
-            
-            # HF API payload
-            payload = {
-                "inputs": prompt,
-                "parameters": {
-                    "negative_prompt": params.get("negative_prompt", ""),
-                    "num_inference_steps": 25,
-                    "guidance_scale": 7.5,
-                    "width": int(str(params.get("size", "512x512")).split('x')[0]),
-                    "height": int(str(params.get("size", "512x512")).split('x')[1]),
-                }
-            }
-            
-            url = f"{cfg['base_url']}/models/{model}"
-            response = requests.post(url, headers=headers, json=payload, timeout=REQUEST_TIMEOUT)
-            
-            if response.ok:
-                b64_json = base64.b64encode(response.content).decode()
-                image_obj = type('Image', (object,), {'b64_json': b64_json})
-                generated_images.append(image_obj)
-            else:
-                st.warning(f"第 {i+1} 張圖片生成失敗: HTTP {response.status_code}")
-                
-        except Exception as e:
-            st.warning(f"第 {i+1} 張圖片生成錯誤: {str(e)[:100]}")
-            continue
+    def max_n(self, key: str) -> Optional[int]:
+        with self._lock:
+            return self._limits.get(key)
     
-    progress_bar.progress(1.0)
-    status_text.text(f"完成生成 {len(generated_images)}/{n_images} 張圖片")
-    time.sleep(1)
-    progress_bar.empty()
-    status_text.empty()
+    def learn_max_n(self, key: str, limit: int):
+        with self._lock:
+            self._limits[key] = min(limit, self._limits.get(key, limit))
     
-    if generated_images:
-        response_obj = type('Response', (object,), {'data': generated_images})
-        return True, response_obj
-    else:
-        return False, "所有圖片生成均失敗"
+    def url_supported(self, key: str) -> bool:
+        with self._lock:
+            return key not in self._no_url
+    
+    def mark_url_unsupported(self, key: str):
+        with self._lock:
+            self._no_url.add(key)
+
+@st.cache_resource
+def get_model_capabilities() -> ModelCapabilities:
+    return ModelCapabilities()
+
+# 錯誤消息中明確聲明 n 上限的寫法（按順序嘗試）
+N_LIMIT_PATTERNS = [
+    r"between\s+1\s+and\s+(\d+)",
+    r"(?:at most|up to|no more than|not exceed|less than or equal to|<=|maximum(?:\s+of|\s+is)?|max(?:imum)?\s+is)\s*(\d+)",
+    r"(?:must provide|must be|only supports?|supports only)\s+(?:['\"`]?n['\"`]?\s*=\s*)?(\d+)\b",
+]
+
+def parse_n_limit(error: Exception) -> Optional[int]:
+    """從「n 超出範圍」類錯誤中解析明確聲明的最大張數；不是此類錯誤或消息中沒有上限時返回 None"""
+    if not isinstance(error, APIStatusError) or error.status_code not in (400, 422):
+        return None
+    message = str(error)
+    if not re.search(r"(?<![\w-])['\"`]?n['\"`]?(?![\w-])", message):
+        return None
+    for pattern in N_LIMIT_PATTERNS:
+        match = re.search(pattern, message, re.I)
+        if match:
+            return max(1, int(match.group(1)))
+    return None
+
+def is_url_format_error(error: Exception) -> bool:
+    """供應商拒絕 response_format=url 的錯誤"""
+    return (isinstance(error, APIStatusError) and error.status_code in (400, 422)
+            and ("response_format" in str(error) or "'url'" in str(error).lower()))
+
+async def async_fetch_image(runner: AsyncLoopRunner, provider: str, url: str,
+                            on_bytes: Optional[Callable] = None,
+                            cancel_token: Optional[CancellationToken] = None) -> Optional[bytes]:
+    """流式下載供應商返回的圖片 URL（共用該供應商的下載連接池，暫時性錯誤自動重試）；失敗返回 None"""
+    http_client = runner.http_client(provider, IMAGE_DOWNLOAD_POOL)
+    try:
+        response = await async_call_with_retry(
+            provider,
+            partial(async_stream_request, http_client, "GET", url, on_bytes, cancel_token, timeout=REQUEST_TIMEOUT),
+            cancel_token=cancel_token
+        )
+    except GenerationCancelled:
+        raise
+    except Exception:
+        return None
+    return response.content if is_success_response(response) else None
+
+async def openai_generate(client, **kwargs):
+    """調用圖像生成接口：AsyncOpenAI 客戶端直接等待，同步客戶端（threads 引擎）在工作線程中執行"""
+    if isinstance(client, AsyncOpenAI):
+        return await client.images.generate(**kwargs)
+    return await asyncio.to_thread(client.images.generate, **kwargs)
+
+def get_model_max_n(cfg: Dict, model: str) -> Optional[int]:
+    """模型單次請求的張數上限：已學習的值優先，其次是 hardcoded_models 中聲明的 max_n；未知返回 None"""
+    learned = get_model_capabilities().max_n(f"{endpoint_key(cfg)}|{model}")
+    declared = API_PROVIDERS.get(cfg.get('provider'), {}).get('hardcoded_models', {}).get(model, {}).get('max_n')
+    limits = [limit for limit in (learned, declared) if limit]
+    return min(limits) if limits else None
+
+def split_batch(n_images: int, max_n: Optional[int]) -> List[int]:
+    """把 n 張拆成每份不超過 max_n 的子請求張數"""
+    if not max_n or max_n >= n_images:
+        return [n_images]
+    return [max_n] * (n_images // max_n) + ([n_images % max_n] if n_images % max_n else [])
 
-def generate_openai_compatible_images(client, params: Dict, n_images: int) -> Tuple[bool, any]:
-    """OpenAI兼容API圖像生成"""
+def scale_size(size: str, max_edge: int) -> str:
+    """按比例縮小尺寸使長邊不超過 max_edge（寬高取 8 的倍數）"""
+    width, height = (int(v) for v in size.split('x'))
+    scale = min(1.0, max_edge / max(width, height))
+    return f"{max(64, int(width * scale) // 8 * 8)}x{max(64, int(height * scale) // 8 * 8)}"
+
+def generate_openai_compatible_images(client, cfg: Dict, params: Dict, n_images: int,
+                                      on_image: Optional[Callable] = None,
+                                      on_bytes: Optional[Callable] = None,
+                                      cancel_token: Optional[CancellationToken] = None,
+                                      deadline: Optional[float] = None) -> Tuple[bool, any]:
+    """OpenAI兼容API圖像生成；超過模型單次張數上限時拆成並行的子請求，按順序合併結果。
+    傳輸層配置為 url 響應時並發下載圖片，避免大體積的 base64 JSON"""
     try:
         sdk_params = {
             "model": params.get("model"),
             "prompt": params.get("prompt"),
             "size": str(params.get("size")),
-            "n": n_images,
-            "response_format": "b64_json"
         }
         
         # 添加負向提示詞支持（如果API支持）
@@ -658,7 +3334,128 @@ def generate_openai_compatible_images(client, params: Dict, n_images: int) -> Tu
         sdk_params = {k: v for k, v in sdk_params.items() 
                      if v is not None and v != ""}
         
-        return True, client.images.generate(**sdk_params)
+        # 重試由 async_call_with_retry 統一處理，關閉 SDK 內建重試避免疊加；超時按該模型的歷史耗時設置
+        provider = cfg.get('provider', '')
+        model = sdk_params.get("model", "")
+        tracker = get_latency_tracker()
+        workload = latency_workload(params)
+        runner = get_async_runner()
+        if runner.native:
+            client = runner.openai_client(cfg.get('api_key', ''), cfg.get('base_url', ''))
+        sdk_client = client.with_options(max_retries=0)
+        breaker = get_circuit_breaker(endpoint_key(cfg))
+        if breaker.is_open():
+            raise circuit_open_error(breaker)
+        
+        limit_key = f"{endpoint_key(cfg)}|{model}"
+        capabilities = get_model_capabilities()
+        url_mode = get_transport_settings().get("openai_response_format") == "url"
+        
+        def accept_url_response(response) -> bool:
+            """url 響應中缺少圖片鏈接時記錄該模型不支持 url 模式"""
+            if all(image.url or image.b64_json for image in response.data):
+                return True
+            capabilities.mark_url_unsupported(limit_key)
+            return False
+        
+        async def timed_generate(**kwargs):
+            """按該模型的歷史耗時設置本次超時，調用生成接口並記錄耗時（超時只記錄次數）"""
+            started = time.monotonic()
+            try:
+                response = await openai_generate(
+                    sdk_client.with_options(timeout=tracker.timeout(provider, model, workload)),
+                    **sdk_params, **kwargs
+                )
+            except APITimeoutError:
+                tracker.record_timeout(provider, model, workload)
+                raise
+            tracker.record(provider, model, time.monotonic() - started, workload)
+            return response
+        
+        async def generate_chunk(start: int, n: int) -> List[Optional[bytes]]:
+            """生成一份子請求，按順序返回恰好 n 項；url 響應的圖片並發下載，
+            下載失敗、缺少內容或供應商少返回的位置為 None"""
+            response = None
+            if url_mode and capabilities.url_supported(limit_key):
+                try:
+                    response = await timed_generate(response_format="url", n=n)
+                except APIStatusError as e:
+                    if not is_url_format_error(e):
+                        raise
+                    capabilities.mark_url_unsupported(limit_key)
+                else:
+                    if not accept_url_response(response):
+                        response = None
+            
+            if response is None:
+                response = await timed_generate(response_format="b64_json", n=n)
+            
+            async def decode(j: int, image) -> Optional[bytes]:
+                if image.b64_json:
+                    return base64.b64decode(image.b64_json)
+                if not image.url:
+                    return None
+                return await async_fetch_image(
+                    runner, provider, image.url,
+                    partial(on_bytes, start + j) if on_bytes else None, cancel_token
+                )
+            
+            images = list(await asyncio.gather(*(
+                decode(j, image) for j, image in enumerate(response.data[:n])
+            )))
+            return images + [None] * (n - len(images))
+        
+        deadline = deadline or batch_deadline()
+        # 每份子請求: [起始索引, 張數, 結果]；n 超限的子請求按學到的上限重新拆分後再發一輪
+        chunks, offset = [], 0
+        for size in split_batch(n_images, get_model_max_n(cfg, model)):
+            chunks.append([offset, size, None])
+            offset += size
+        errors: List[str] = []
+        
+        pending = list(chunks)
+        while pending:
+            jobs = [partial(generate_chunk, start, size) for start, size, _ in pending]
+            resplit = []
+            for i, ok, result in fan_out(provider, jobs, get_rate_limiter(cfg), cancel_token, deadline,
+                                         breaker, slow_call_threshold(provider, model, workload)):
+                start, size, _ = pending[i]
+                limit = None if ok else parse_n_limit(result)
+                if limit is not None and limit < size:
+                    get_model_capabilities().learn_max_n(limit_key, limit)
+                    for sub in split_batch(size, limit):
+                        resplit.append([start, sub, None])
+                        start += sub
+                    continue
+                
+                if ok:
+                    pending[i][2] = result
+                    for j, content in enumerate(result):
+                        error = None if content is not None else f"第 {start+j+1} 張圖片下載失敗"
+                        if error:
+                            errors.append(error)
+                        if on_image is not None:
+                            on_image(start + j, content, error)
+                elif not isinstance(result, GenerationCancelled):
+                    error = f"第 {start+1}–{start+size} 張圖片生成錯誤: {describe_error(result)}"
+                    errors.append(error)
+                    if on_image is not None:
+                        for j in range(size):
+                            on_image(start + j, None, error)
+            
+            chunks.extend(resplit)
+            pending = resplit
+        
+        generated_images = [
+            type('Image', (object,), {'content': content, 'seed': None, 'index': start + j})
+            for start, _, result in sorted(chunks, key=lambda chunk: chunk[0]) if result
+            for j, content in enumerate(result) if content is not None
+        ]
+        if generated_images:
+            return True, type('Response', (object,), {'data': generated_images})
+        elif cancel_token is not None and cancel_token.cancelled:
+            return False, "生成已取消"
+        return False, errors[0] if errors else "所有圖片生成均失敗"
         
     except Exception as e:
         return False, str(e)[:200]
@@ -666,10 +3463,9 @@ def generate_openai_compatible_images(client, params: Dict, n_images: int) -> Tu
 # === 歷史和收藏管理 ===
 
 def add_to_history(prompt: str, negative_prompt: str, model: str, 
-                  images: List[str], metadata: Dict):
-    """添加到歷史記錄"""
-    history = st.session_state.generation_history
-    
+                  images: List[str], metadata: Dict) -> Dict:
+    """添加到持久化歷史記錄（images 為圖片存儲句柄）並返回記錄；
+    寫入成功後圖片由歷史記錄持有引用，釋放會話引用（會話不保留自己的歷史副本）"""
     new_entry = {
         "id": str(uuid.uuid4()),
         "timestamp": datetime.datetime.now(),
@@ -677,42 +3473,92 @@ def add_to_history(prompt: str, negative_prompt: str, model: str,
         "negative_prompt": negative_prompt,
         "model": model,
         "images": images,
+        "bytes": images_bytes(images),
         "metadata": metadata
     }
     
-    history.insert(0, new_entry)
-    st.session_state.generation_history = history[:MAX_HISTORY_ITEMS]
+    if persist_history_entry(new_entry):
+        release_images(images)
+    return new_entry
+
+def clear_history():
+    """清空歷史（釋放歷史記錄持有的圖片引用）"""
+    get_history_store().clear_history(get_history_owner())
+    st.session_state.latest_generation = None
 
-def display_image_with_actions(b64_json: str, image_id: str, history_item: Dict):
-    """顯示圖片及操作按鈕"""
+def clear_favorites():
+    """清空收藏並釋放圖片引用"""
+    release_images([fav['image_handle'] for fav in st.session_state.favorite_images])
+    st.session_state.favorite_images = []
+    get_history_store().clear_favorites(get_history_owner())
+
+def display_image_with_actions(image_handle: str, image_id: str, history_item: Dict,
+                               seed: Optional[int] = None, thumbnail: bool = False):
+    """顯示圖片及操作按鈕。thumbnail=True 時只渲染縮略圖（未就緒時顯示佔位），
+    原圖字節只在查看原圖或準備下載時才加載"""
     try:
-        img_data = base64.b64decode(b64_json)
-        img = Image.open(BytesIO(img_data))
+        image_size = get_blob_store().size(image_handle)
+        if not image_size:
+            st.warning("圖片已失效")
+            return
+        
+        zoom_key = f"zoom_{image_id}"
+        download_key = f"dl_ready_{image_id}"
+        zoomed = st.session_state.get(zoom_key, False)
+        img_data = None
+        if not thumbnail or zoomed or st.session_state.get(download_key, False):
+            img_data = load_image(image_handle)
+            if img_data is None:
+                st.warning("圖片已失效")
+                return
         
         # 顯示圖片
-        st.image(img, use_container_width=True)
+        if thumbnail and not zoomed:
+            preview = load_thumbnail(image_handle)
+            if preview is not None:
+                st.image(preview, use_container_width=True)
+            else:
+                st.info("🖼️ 縮略圖生成中，可點擊查看原圖")
+        else:
+            st.image(img_data, use_container_width=True)
+        
+        if thumbnail:
+            if st.button(
+                "🔍 縮小" if zoomed else "🔍 查看原圖",
+                key=f"zoom_btn_{image_id}",
+                use_container_width=True
+            ):
+                st.session_state[zoom_key] = not zoomed
+                rerun_app()
         
-        # 圖片信息
+        # 圖片信息（尺寸需要解碼原圖，只在原圖已加載時顯示）
         if st.session_state.get('advanced_mode', False):
+            info = {"文件大小": f"{image_size} bytes", "種子": seed}
+            if img_data is not None:
+                img = Image.open(BytesIO(img_data))
+                info = {"尺寸": f"{img.size[0]}x{img.size[1]}", "模式": img.mode, **info}
             with st.expander("🔍 圖片信息"):
-                st.json({
-                    "尺寸": f"{img.size[0]}x{img.size[1]}",
-                    "模式": img.mode,
-                    "文件大小": f"{len(img_data)} bytes"
-                })
+                st.json(info)
+        elif seed is not None:
+            st.caption(f"🎲 種子: {seed}")
         
         # 操作按鈕
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            st.download_button(
-                "📥 下載",
-                img_data,
-                f"ai_generated_{image_id}.png",
-                "image/png",
-                key=f"dl_{image_id}",
-                use_container_width=True
-            )
+            if img_data is not None:
+                st.download_button(
+                    "📥 下載",
+                    img_data,
+                    f"ai_generated_{image_id}.png",
+                    "image/png",
+                    key=f"dl_{image_id}",
+                    use_container_width=True
+                )
+            elif st.button("📥 準備下載", key=f"dl_prepare_{image_id}", use_container_width=True,
+                           help="加載原圖後下載"):
+                st.session_state[download_key] = True
+                rerun_app()
         
         with col2:
             is_fav = any(fav['id'] == image_id 
@@ -724,20 +3570,31 @@ def display_image_with_actions(b64_json: str, image_id: str, history_item: Dict)
                 help="收藏/取消收藏"
             ):
                 if is_fav:
+                    release_images([
+                        f['image_handle'] for f in st.session_state.favorite_images
+                        if f['id'] == image_id
+                    ])
                     st.session_state.favorite_images = [
                         f for f in st.session_state.favorite_images
                         if f['id'] != image_id
                     ]
+                    get_history_store().remove_favorite(get_history_owner(), image_id)
                 else:
-                    if len(st.session_state.favorite_images) < MAX_FAVORITE_ITEMS:
-                        st.session_state.favorite_images.append({
+                    favorites_budget = int(get_memory_settings()["favorites_bytes"])
+                    if get_favorites_bytes([image_handle]) <= favorites_budget:
+                        retain_image(image_handle)
+                        favorite = {
                             "id": image_id,
-                            "image_b64": b64_json,
+                            "image_handle": image_handle,
+                            "seed": seed,
+                            "bytes": image_size,
                             "timestamp": datetime.datetime.now(),
                             "history_item": history_item
-                        })
+                        }
+                        st.session_state.favorite_images.append(favorite)
+                        get_history_store().add_favorite(get_history_owner(), favorite)
                     else:
-                        st.warning(f"收藏已達上限 ({MAX_FAVORITE_ITEMS})")
+                        st.warning(f"收藏已達容量上限 ({format_bytes(favorites_budget)})")
                 rerun_app()
         
         with col3:
@@ -750,22 +3607,63 @@ def display_image_with_actions(b64_json: str, image_id: str, history_item: Dict)
                 st.session_state.update({
                     'vary_prompt': history_item['prompt'],
                     'vary_negative_prompt': history_item.get('negative_prompt', ''),
-                    'vary_model': history_item['model']
+                    'selected_model': history_item['model']
                 })
                 rerun_app()
+        
+        if can_reproduce(history_item, seed):
+            if st.button(
+                "🔁 重新生成",
+                key=f"again_{image_id}",
+                use_container_width=True,
+                help="以記錄的模型、風格、尺寸、高級選項和種子重新提交，相同參數會直接命中快取"
+            ):
+                if resubmit_history_item(history_item, seed) is None:
+                    st.warning(f"⚠️ 進行中的任務已達上限 ({MAX_SESSION_JOBS})，請等待完成或取消後再提交")
+                else:
+                    rerun_app()
+        
+        if can_rerun_full_quality(history_item, seed):
+            if st.button(
+                "🎯 完整質量重跑",
+                key=f"full_{image_id}",
+                use_container_width=True,
+                help=f"使用相同種子以完整步數和目標尺寸 ({history_item['metadata'].get('target_size', history_item['metadata'].get('size'))}) 重新生成"
+            ):
+                if submit_full_quality_rerun(history_item, seed) is None:
+                    st.warning(f"⚠️ 進行中的任務已達上限 ({MAX_SESSION_JOBS})，請等待完成或取消後再提交")
+                else:
+                    rerun_app()
                 
     except Exception as e:
         st.error(f"圖像顯示錯誤: {str(e)[:100]}")
 
 # === API客戶端管理 ===
 
+@st.cache_resource
+def get_openai_client_registry() -> Tuple[OrderedDict, threading.Lock]:
+    """進程級 OpenAI 客戶端註冊表（LRU），跨重載和會話共享"""
+    return OrderedDict(), threading.Lock()
+
+def openai_client_key(api_key: str, base_url: str) -> str:
+    """以雜湊後的密鑰和端點作為註冊表鍵，避免明文密鑰常駐內存索引"""
+    return hashlib.sha256(f"{api_key}\0{base_url}".encode()).hexdigest()
+
+def get_openai_client(api_key: str, base_url: str) -> OpenAI:
+    """獲取或創建共享的 OpenAI 客戶端"""
+    clients, lock = get_openai_client_registry()
+    with lock:
+        return lru_client(
+            clients, openai_client_key(api_key, base_url), partial(OpenAI, api_key=api_key, base_url=base_url)
+        )
+
 def init_api_client():
-    """初始化API客戶端"""
+    """獲取當前存檔的API客戶端（從註冊表復用）"""
     cfg = get_active_config()
     if (cfg and cfg.get('api_key') and 
         cfg.get('provider') not in ["Pollinations.ai", "Hugging Face"]):
         try:
-            return OpenAI(api_key=cfg['api_key'], base_url=cfg['base_url'])
+            return get_openai_client(cfg['api_key'], cfg['base_url'])
         except Exception:
             return None
     return None
@@ -1133,6 +4031,15 @@ def show_generation_interface():
         else:
             final_size_str = size_preset
         
+        # 漸進模式（供應商支持種子時可用）
+        progressive = False
+        if get_active_config().get('provider') in PROGRESSIVE_PROVIDERS:
+            progressive = st.toggle(
+                "🪜 漸進模式",
+                key="progressive_mode",
+                help=f"先以 {PREVIEW_MAX_EDGE}px 快速預覽全部圖片，再只把選中的圖片按目標尺寸精修"
+            )
+        
         # 高級選項切換
         st.session_state.advanced_mode = st.toggle(
             "🔧 高級選項",
@@ -1144,7 +4051,8 @@ def show_generation_interface():
         'negative_prompt': negative_prompt_val,
         'style': selected_style,
         'size': final_size_str,
-        'n_images': n_images
+        'n_images': n_images,
+        'progressive': progressive
     }
 
 def show_advanced_options(provider: str) -> Dict:
@@ -1203,6 +4111,40 @@ def show_advanced_options(provider: str) -> Dict:
                     ["DPMSolverMultistep", "EulerDiscrete", "DDIM", "PNDMScheduler"],
                     help="選擇採樣調度器"
                 )
+                options['quality'] = st.radio(
+                    "質量",
+                    list(QUALITY_PROFILES.keys()),
+                    format_func=lambda x: QUALITY_PROFILES[x]["label"],
+                    horizontal=True,
+                    help="快速預覽使用 8 步和較小尺寸，滿意後可用同一種子以完整質量重跑"
+                )
+        
+        # 種子控制（只對請求中使用種子的供應商顯示）
+        if not provider_supports_seeds(provider):
+            st.caption("🎲 此供應商的接口不接收種子，每張圖片都是獨立的隨機結果")
+            return options
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            options['seed_mode'] = st.selectbox(
+                "🎲 種子模式",
+                list(SEED_MODES.keys()),
+                format_func=lambda x: SEED_MODES[x],
+                key="seed_mode",
+                help="固定或遞增種子可重現結果並命中快取；隨機模式也會記錄每張圖片的種子"
+            )
+        
+        with col2:
+            options['base_seed'] = int(st.number_input(
+                "基礎種子",
+                min_value=0,
+                max_value=MAX_SEED,
+                step=1,
+                key="base_seed",
+                disabled=options['seed_mode'] == "隨機",
+                help="固定模式下每張圖片使用此種子；遞增模式下依次加一"
+            ))
     
     return options
 
@@ -1212,9 +4154,11 @@ def main():
     """主應用函數"""
     # 初始化
     init_session_state()
+    collect_finished_jobs()
     client = init_api_client()
     cfg = get_active_config()
     api_configured = cfg and cfg.get('validated', False)
+    warm_up_on_activation(cfg)
     
     # 側邊欄
     with st.sidebar:
@@ -1227,7 +4171,7 @@ def main():
     # 主界面標籤頁
     tab1, tab2, tab3, tab4 = st.tabs([
         "🚀 生成圖像",
-        f"📚 歷史 ({len(st.session_state.generation_history)})",
+        f"📚 歷史 ({get_history_store().count(get_history_owner())})",
         f"⭐ 收藏 ({len(st.session_state.favorite_images)})",
         "ℹ️ 關於"
     ])
@@ -1246,6 +4190,11 @@ def main():
     
     # 頁腳
     show_footer()
+    
+    # 舊版 Streamlit 沒有片段，有進行中的任務時整頁重載以輪詢進度
+    if not hasattr(st, 'fragment') and st.session_state.get('active_jobs'):
+        time.sleep(JOB_POLL_INTERVAL)
+        rerun_app()
 
 def show_sidebar(api_configured: bool, client, cfg: Dict):
     """顯示側邊欄"""
@@ -1256,7 +4205,14 @@ def show_sidebar(api_configured: bool, client, cfg: Dict):
     # API狀態顯示
     if api_configured:
         provider_info = API_PROVIDERS.get(cfg['provider'], {})
-        st.success(f"🟢 已連接: {st.session_state.active_profile_name}")
+        circuit = get_circuit_breaker(endpoint_key(cfg)).snapshot()
+        if circuit['state'] == "open":
+            st.error(f"🔴 端點熔斷: {st.session_state.active_profile_name}（{circuit['retry_in']:.0f} 秒後試探）")
+        elif circuit['state'] == "half_open":
+            st.warning(f"🟡 試探恢復中: {st.session_state.active_profile_name}")
+        else:
+            icon = "🟢" if circuit['health'] >= 0.8 else "🟡"
+            st.success(f"{icon} 已連接: {st.session_state.active_profile_name} · 健康度 {circuit['health']:.0%}")
         st.info(f"{provider_info.get('icon', '🤖')} {provider_info.get('name', cfg['provider'])}")
         
         # 模型發現
@@ -1274,6 +4230,12 @@ def show_sidebar(api_configured: bool, client, cfg: Dict):
                 
                 time.sleep(1)
                 rerun_app()
+        
+        # HF 模型預熱
+        if cfg.get('provider') == "Hugging Face":
+            show_hf_warmup_panel(cfg)
+        
+        show_routing_settings()
     
     elif st.session_state.api_profiles:
         st.error(f"🔴 配置錯誤: '{st.session_state.active_profile_name}' 未驗證")
@@ -1283,26 +4245,182 @@ def show_sidebar(api_configured: bool, client, cfg: Dict):
     st.markdown("---")
     
     # 統計信息
+    cache_stats = get_result_cache().stats()
+    job_stats = get_job_queue().stats()
+    latency_stats = get_latency_tracker().stats(
+        cfg.get('provider', ''), st.session_state.get('selected_model') or '',
+        st.session_state.get('last_latency_workload', '')
+    )
+    hedge_settings = get_hedge_settings()
+    hedge_line = ""
+    if hedge_settings["enabled"] and cfg.get('provider') == "Pollinations.ai":
+        hedge_stats = get_hedge_budget("Pollinations.ai", hedge_settings["budget"]).stats()
+        hedge_line = f"\n    - 對沖請求: {hedge_stats['hedged']}/{hedge_stats['primary']}（副本勝出 {hedge_stats['hedge_wins']}）"
+    memory_settings = get_memory_settings()
     st.info(f"""
     **📊 使用統計**
-    - 歷史記錄: {len(st.session_state.generation_history)}/{MAX_HISTORY_ITEMS}
-    - 收藏圖片: {len(st.session_state.favorite_images)}/{MAX_FAVORITE_ITEMS}
+    - 歷史記錄: {get_history_store().count(get_history_owner())} 條
+    - 收藏圖片: {len(st.session_state.favorite_images)} 張 ({format_bytes(get_favorites_bytes())}/{format_bytes(int(memory_settings['favorites_bytes']))})
+    - 圖片內存快取: {format_bytes(get_blob_store().stats()['memory_bytes'])}/{format_bytes(int(memory_settings['process_bytes']))}
     - 批次上限: {MAX_BATCH_SIZE}
+    - 後台任務: {job_stats['running']} 執行中 / {job_stats['queued']} 排隊中
+    - 請求超時: {latency_stats['timeout']:.0f} 秒（{latency_stats['samples']} 個樣本）{hedge_line}
+    - 快取命中: {cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']} ({cache_stats['hit_rate']:.0%})
     """)
     
     # 快捷操作
     if st.button("🗑️ 清空歷史", use_container_width=True):
-        st.session_state.generation_history = []
+        clear_history()
         st.success("歷史記錄已清空")
         time.sleep(1)
         rerun_app()
     
     if st.button("🗑️ 清空收藏", use_container_width=True):
-        st.session_state.favorite_images = []
+        clear_favorites()
         st.success("收藏已清空")
         time.sleep(1)
         rerun_app()
 
+def build_generation_params(model: str, gen_params: Dict, advanced_options: Dict,
+                            seeds: List[int]) -> Dict:
+    """由界面參數構建供應商請求參數"""
+    # 構建最終提示詞
+    final_prompt = gen_params['prompt']
+    if gen_params['style'] != "無" and STYLE_PRESETS.get(gen_params['style']):
+        final_prompt = f"{final_prompt}, {STYLE_PRESETS[gen_params['style']]}"
+    
+    # 種子模式不作為供應商參數傳遞
+    provider_options = {
+        k: v for k, v in advanced_options.items()
+        if k not in ("seed_mode", "base_seed")
+    }
+    
+    return {
+        "model": model,
+        "prompt": final_prompt,
+        "negative_prompt": gen_params['negative_prompt'],
+        "size": gen_params['size'],
+        "n": len(seeds),
+        "seeds": seeds,
+        **provider_options
+    }
+
+def build_job_meta(model: str, model_name: str, gen_params: Dict,
+                   advanced_options: Dict, provider: str) -> Dict:
+    """生成任務完成後寫入歷史記錄所需的信息"""
+    return {
+        "prompt": gen_params['prompt'],
+        "negative_prompt": gen_params['negative_prompt'],
+        "model": model,
+        "model_name": model_name,
+        "metadata": {
+            "size": gen_params['size'],
+            "provider": provider,
+            "style": gen_params['style'],
+            "n": gen_params['n_images'],
+            "model_name": model_name,
+            "advanced_options": advanced_options,
+        }
+    }
+
+def can_reproduce(history_item: Dict, seed: Optional[int]) -> bool:
+    """記錄了種子的圖片在同一供應商下可用原參數重新提交"""
+    return seed is not None and history_item.get('metadata', {}).get('provider') == get_active_config().get('provider')
+
+def can_rerun_full_quality(history_item: Dict, seed: Optional[int]) -> bool:
+    """快速預覽的圖片在同一供應商下可用原種子以完整質量重跑"""
+    metadata = history_item.get('metadata', {})
+    return (
+        can_reproduce(history_item, seed) and
+        metadata.get('advanced_options', {}).get('quality') == "快速預覽"
+    )
+
+def resubmit_history_item(history_item: Dict, seed: int, size: Optional[str] = None,
+                          advanced_overrides: Optional[Dict] = None) -> Optional[str]:
+    """以歷史記錄中的模型、風格、尺寸、高級選項和指定種子重新提交一張圖片；任務數已達上限時不提交，返回 None"""
+    metadata = history_item['metadata']
+    advanced_options = {**metadata.get('advanced_options', {}), **(advanced_overrides or {})}
+    gen_params = {
+        'prompt': history_item['prompt'],
+        'negative_prompt': history_item.get('negative_prompt', ''),
+        'style': metadata.get('style', "無"),
+        'size': size or metadata['size'],
+        'n_images': 1,
+    }
+    model_name = metadata.get('model_name', history_item['model'])
+    
+    job_id = submit_generation_job(
+        init_api_client(), get_active_config(),
+        build_generation_params(history_item['model'], gen_params, advanced_options, [seed]),
+        build_job_meta(history_item['model'], model_name, gen_params, advanced_options, metadata['provider'])
+    )
+    if job_id is not None:
+        st.session_state.latest_generation = None
+    return job_id
+
+def submit_full_quality_rerun(history_item: Dict, seed: int) -> Optional[str]:
+    """以完整質量、目標尺寸和相同種子重新生成一張預覽圖片"""
+    metadata = history_item['metadata']
+    return resubmit_history_item(history_item, seed, metadata.get('target_size', metadata['size']),
+                                 {'quality': "完整"})
+
+def show_hf_warmup_panel(cfg: Dict):
+    """顯示當前 HF 模型的冷熱狀態和預熱按鈕"""
+    model = st.session_state.get('selected_model')
+    if not model:
+        return
+    
+    if st.button("🔥 預熱模型", use_container_width=True, help="在後台觸發模型載入，減少首次生成的等待"):
+        warmed = warm_up_hf_model(cfg, model)
+        st.success("已在後台預熱當前模型" if warmed else "模型已就緒或正在載入")
+    
+    state = get_warmup_tracker().get(hf_model_url(cfg['base_url'], model))
+    st.caption(f"🤗 {model}: {describe_model_warmth(state)}")
+
+def show_routing_settings():
+    """顯示多存檔負載均衡設置：存檔池、分配策略、權重和各存檔負載"""
+    validated = [name for name, config in st.session_state.api_profiles.items() if config.get('validated')]
+    
+    with st.expander("⚖️ 負載均衡"):
+        if len(validated) < 2:
+            st.caption("至少需要兩個已驗證的存檔才能組成存檔池")
+            return
+        
+        enabled = st.toggle(
+            "啟用存檔池", key="routing_enabled",
+            help="把每批圖片分給多個存檔並行生成，某個存檔出錯或被限流時轉移到其他存檔"
+        )
+        # 控件狀態由 key 保存；創建前剔除已刪除或未驗證的存檔
+        st.session_state.routing_pool = [
+            name for name in st.session_state.get('routing_pool', validated) if name in validated
+        ]
+        pool = st.multiselect(
+            "存檔池", validated, key="routing_pool",
+            disabled=not enabled,
+            help="池中的存檔應能提供相同的模型"
+        )
+        st.radio(
+            "分配策略", ROUTING_STRATEGIES, key="routing_strategy",
+            horizontal=True, disabled=not enabled
+        )
+        
+        weights = st.session_state.setdefault('routing_weights', {})
+        balancer = get_profile_balancer()
+        for name in pool:
+            config = st.session_state.api_profiles[name]
+            weights[name] = st.number_input(
+                f"{name} 權重", min_value=0.0, max_value=100.0, step=1.0,
+                value=float(weights.get(name, config.get('weight', 1.0))),
+                disabled=not enabled, key=f"routing_weight_{name}",
+                help="加權輪詢按權重比例分配；最少未完成請求按 未完成數/權重 選擇"
+            )
+            state = balancer.state(rate_limit_key(config))
+            circuit = get_circuit_breaker(endpoint_key(config)).snapshot()
+            status = f"冷卻中（{state['cooldown']:.0f} 秒）" if state['cooldown'] else "可用"
+            if circuit['state'] == "open":
+                status = f"熔斷中（{circuit['retry_in']:.0f} 秒）"
+            st.caption(f"{name}: 未完成 {state['outstanding']} · 健康度 {circuit['health']:.0%} · {status}")
+
 def show_generation_tab(api_configured: bool, client):
     """顯示生成標籤頁"""
     if not api_configured:
@@ -1329,13 +4447,25 @@ def show_generation_tab(api_configured: bool, client):
     cfg = get_active_config()
     advanced_options = show_advanced_options(cfg.get('provider', ''))
     
-    # 生成按鈕和邏輯
-    generation_disabled = (
-        not gen_params['prompt'].strip() or
-        st.session_state.get('generation_in_progress', False)
-    )
+    # HF 模型尚未載入時提示首次生成需要等待
+    if cfg.get('provider') == "Hugging Face":
+        warmth = get_warmup_tracker().get(hf_model_url(cfg['base_url'], selected_model))
+        if warmth and warmth["state"] in ("warming", "loading"):
+            st.info(f"🤗 當前模型狀態: {describe_model_warmth(warmth)}，首次生成可能需要等待模型載入")
     
-    button_text = "🎨 正在生成..." if st.session_state.get('generation_in_progress') else "🚀 生成圖像"
+    # 生成按鈕和邏輯（任務在後台執行，未達會話上限時生成中仍可繼續提交）
+    active_count = count_running_jobs(get_session_jobs())
+    button_text = f"🚀 生成圖像 (進行中 {active_count})" if active_count else "🚀 生成圖像"
+    supersede = active_count > 0 and st.checkbox(
+        "🔁 新請求取代進行中的任務",
+        value=True,
+        key="supersede_jobs",
+        help="提交新生成時取消本會話尚未完成的任務，釋放並發名額和速率配額"
+    )
+    at_capacity = active_count >= MAX_SESSION_JOBS and not supersede
+    generation_disabled = not gen_params['prompt'].strip() or at_capacity
+    if at_capacity:
+        st.caption(f"⏳ 已有 {active_count} 個任務進行中（上限 {MAX_SESSION_JOBS}），完成或取消後可再提交")
     
     if st.button(
         button_text,
@@ -1343,130 +4473,166 @@ def show_generation_tab(api_configured: bool, client):
         use_container_width=True,
         disabled=generation_disabled
     ):
-        # 構建最終提示詞
-        final_prompt = gen_params['prompt']
-        if gen_params['style'] != "無" and STYLE_PRESETS[gen_params['style']]:
-            final_prompt = f"{final_prompt}, {STYLE_PRESETS[gen_params['style']]}"
+        # 不接收種子的供應商不分配種子（歷史中不顯示，也不按種子快取）
+        if provider_supports_seeds(cfg['provider']):
+            seeds = resolve_seeds(
+                advanced_options.get('seed_mode', "隨機"),
+                advanced_options.get('base_seed', 0),
+                gen_params['n_images']
+            )
+        else:
+            seeds = [None] * gen_params['n_images']
         
-        # 生成參數
-        params = {
-            "model": selected_model,
-            "prompt": final_prompt,
-            "negative_prompt": gen_params['negative_prompt'],
-            "size": gen_params['size'],
-            "n": gen_params['n_images'],
-            **advanced_options
-        }
+        # 漸進模式先生成小尺寸預覽，記錄目標尺寸供精修使用
+        job_gen_params, job_options = gen_params, advanced_options
+        if gen_params.get('progressive'):
+            job_gen_params = {**gen_params, 'size': scale_size(gen_params['size'], PREVIEW_MAX_EDGE)}
+            job_options = {**advanced_options, 'quality': "快速預覽"}
         
-        # 顯示生成信息
+        # 提交後台任務，結果在後續重載中領取
         model_name = all_models[selected_model]['name']
-        with st.spinner(f"🎨 正在使用 {model_name} 生成 {gen_params['n_images']} 張圖像..."):
-            success, result = generate_images_with_retry(client, **params)
-        
-        # 處理結果
-        if success and hasattr(result, 'data') and result.data:
-            img_b64s = [img.b64_json for img in result.data]
-            
-            # 添加到歷史
-            add_to_history(
-                gen_params['prompt'],
-                gen_params['negative_prompt'],
-                selected_model,
-                img_b64s,
-                {
-                    "size": gen_params['size'],
-                    "provider": cfg['provider'],
-                    "style": gen_params['style'],
-                    "n": gen_params['n_images'],
-                    "model_name": model_name,
-                    "advanced_options": advanced_options
-                }
-            )
-            
-            st.success(f"✨ 成功生成 {len(img_b64s)} 張圖像！")
-            
-            # 顯示生成的圖像
-            if len(img_b64s) == 1:
-                display_image_with_actions(
-                    img_b64s[0],
-                    f"{st.session_state.generation_history[0]['id']}_0",
-                    st.session_state.generation_history[0]
-                )
-            else:
-                cols = st.columns(2)
-                for i, b64_json in enumerate(img_b64s):
-                    with cols[i % 2]:
-                        display_image_with_actions(
-                            b64_json,
-                            f"{st.session_state.generation_history[0]['id']}_{i}",
-                            st.session_state.generation_history[0]
-                        )
-            
-            # 清理內存
-            gc.collect()
-        
+        meta = build_job_meta(selected_model, model_name, job_gen_params, job_options, cfg['provider'])
+        meta['metadata']['target_size'] = gen_params['size']
+        job_id = submit_generation_job(
+            client, cfg,
+            build_generation_params(selected_model, job_gen_params, job_options, seeds),
+            meta,
+            supersede
+        )
+        if job_id is None:
+            st.warning(f"⚠️ 進行中的任務已達上限 ({MAX_SESSION_JOBS})，請等待完成或取消後再提交")
         else:
-            st.error(f"❌ 生成失敗: {result}")
+            st.session_state.latest_generation = None
+    
+    # 進行中的任務和最近一次結果
+    show_job_panel()
 
 def show_history_tab():
-    """顯示歷史標籤頁"""
-    if not st.session_state.generation_history:
+    """顯示歷史標籤頁（持久化存檔，支持全文搜索和分頁，僅渲染已展開記錄的圖片）"""
+    store = get_history_store()
+    owner = get_history_owner()
+    
+    if store.count(owner) == 0:
         st.info("📭 還沒有生成歷史。快去生成一些圖片吧！")
         return
     
-    st.subheader(f"📚 生成歷史 ({len(st.session_state.generation_history)} 條記錄)")
-    
     # 歷史記錄操作
     col1, col2 = st.columns([3, 1])
+    with col1:
+        query = st.text_input(
+            "🔍 搜索歷史",
+            key="history_query",
+            placeholder="按提示詞、模型或風格搜索..."
+        )
     with col2:
         if st.button("🗑️ 清空歷史"):
-            st.session_state.generation_history = []
+            clear_history()
+            rerun_app()
+    
+    # 搜索條件變化時回到第一頁
+    if st.session_state.get('history_cursor_query') != query:
+        st.session_state.history_cursor_query = query
+        st.session_state.history_cursors = [None]
+    
+    total = store.count(owner, query)
+    st.subheader(f"📚 生成歷史 ({total} 條記錄)")
+    if total == 0:
+        st.info("沒有匹配的歷史記錄")
+        return
+    
+    cursors = st.session_state.history_cursors
+    items, next_cursor = store.page(owner, query, cursors[-1], HISTORY_PAGE_SIZE)
+    total_pages = max(1, (total + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE)
+    show_cursor_pagination("history_cursors", total_pages, next_cursor)
+    
+    # 模型信息每次渲染只合併一次
+    all_models = merge_models()
+    
+    # 顯示當前頁的歷史記錄
+    for item in items:
+        show_history_item(item, all_models)
+
+def show_cursor_pagination(state_key: str, total_pages: int, next_cursor: Optional[Tuple[float, int]]):
+    """顯示游標分頁控件；state_key 下保存已訪問頁的起始游標棧"""
+    cursors = st.session_state[state_key]
+    page = len(cursors)
+    
+    if total_pages <= 1:
+        return
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    
+    with col1:
+        if st.button("◀ 上一頁", key=f"{state_key}_prev", disabled=page <= 1, use_container_width=True):
+            cursors.pop()
+            rerun_app()
+    
+    with col2:
+        st.markdown(
+            f"<div style='text-align: center;'>第 {page} / {total_pages} 頁</div>",
+            unsafe_allow_html=True
+        )
+    
+    with col3:
+        if st.button("下一頁 ▶", key=f"{state_key}_next", disabled=next_cursor is None, use_container_width=True):
+            cursors.append(next_cursor)
             rerun_app()
+
+def show_history_item(item: Dict, all_models: Dict[str, Dict]):
+    """顯示單條歷史記錄，收起時不加載圖片"""
+    timestamp_str = item['timestamp'].strftime('%m-%d %H:%M')
+    model_name = all_models.get(item['model'], {}).get('name', item['model'])
+    
+    expanded = st.toggle(
+        f"🎨 {item['prompt'][:60]}{'...' if len(item['prompt']) > 60 else ''} "
+        f"| {model_name} | {timestamp_str}",
+        key=f"hist_open_{item['id']}"
+    )
+    if not expanded:
+        return
     
-    # 顯示歷史記錄
-    for item in st.session_state.generation_history:
-        timestamp_str = item['timestamp'].strftime('%m-%d %H:%M')
+    with st.container():
+        # 顯示詳細信息
+        col1, col2 = st.columns([2, 1])
         
-        # 獲取模型信息
-        all_models = merge_models()
-        model_info = all_models.get(item['model'], {})
-        model_name = model_info.get('name', item['model'])
+        with col1:
+            st.markdown(f"**✍️ 提示詞:** {item['prompt']}")
+            if item.get('negative_prompt'):
+                st.markdown(f"**🚫 負向提示詞:** {item['negative_prompt']}")
         
-        with st.expander(
-            f"🎨 {item['prompt'][:60]}{'...' if len(item['prompt']) > 60 else ''} "
-            f"| {model_name} | {timestamp_str}"
-        ):
-            # 顯示詳細信息
-            col1, col2 = st.columns([2, 1])
-            
-            with col1:
-                st.markdown(f"**✍️ 提示詞:** {item['prompt']}")
-                if item.get('negative_prompt'):
-                    st.markdown(f"**🚫 負向提示詞:** {item['negative_prompt']}")
-            
-            with col2:
-                st.markdown(f"**🤖 模型:** {model_name}")
-                if item.get('metadata', {}).get('style'):
-                    st.markdown(f"**🎨 風格:** {item['metadata']['style']}")
-                if item.get('metadata', {}).get('size'):
-                    st.markdown(f"**📐 尺寸:** {item['metadata']['size']}")
-            
-            # 顯示圖像
-            if len(item['images']) == 1:
-                display_image_with_actions(
-                    item['images'][0],
-                    f"hist_{item['id']}_0",
-                    item
-                )
-            else:
-                cols = st.columns(2)
-                for i, b64_json in enumerate(item['images']):
-                    with cols[i % 2]:
-                        display_image_with_actions(
-                            b64_json,
-                            f"hist_{item['id']}_{i}",
-                            item
-                        )
+        with col2:
+            st.markdown(f"**🤖 模型:** {model_name}")
+            if item.get('metadata', {}).get('style'):
+                st.markdown(f"**🎨 風格:** {item['metadata']['style']}")
+            if item.get('metadata', {}).get('size'):
+                st.markdown(f"**📐 尺寸:** {item['metadata']['size']}")
+            quality = item.get('metadata', {}).get('advanced_options', {}).get('quality')
+            if quality in QUALITY_PROFILES:
+                st.markdown(f"**質量:** {QUALITY_PROFILES[quality]['label']}")
+        
+        # 顯示圖像
+        seeds = item.get('metadata', {}).get('seeds') or [None] * len(item['images'])
+        if len(item['images']) == 1:
+            display_image_with_actions(
+                item['images'][0],
+                f"hist_{item['id']}_0",
+                item,
+                seeds[0],
+                thumbnail=True
+            )
+        else:
+            cols = st.columns(2)
+            for i, image_handle in enumerate(item['images']):
+                with cols[i % 2]:
+                    display_image_with_actions(
+                        image_handle,
+                        f"hist_{item['id']}_{i}",
+                        item,
+                        seeds[i],
+                        thumbnail=True
+                    )
+        
+        st.markdown("---")
 
 def show_favorites_tab():
     """顯示收藏標籤頁"""
@@ -1480,7 +4646,7 @@ def show_favorites_tab():
     col1, col2 = st.columns([3, 1])
     with col2:
         if st.button("🗑️ 清空收藏"):
-            st.session_state.favorite_images = []
+            clear_favorites()
             rerun_app()
     
     # 顯示收藏的圖像
@@ -1494,9 +4660,11 @@ def show_favorites_tab():
     for i, fav in enumerate(sorted_favorites):
         with cols[i % 3]:
             display_image_with_actions(
-                fav['image_b64'],
+                fav['image_handle'],
                 fav['id'],
-                fav.get('history_item', {})
+                fav.get('history_item', {}),
+                fav.get('seed'),
+                thumbnail=True
             )
             
             # 收藏時間
@@ -7,12 +7,11 @@ import datetime
 import base64
 from typing import Dict, List, Tuple, Optional
 import time
-import random
 import uuid
 import os
-from urllib.parse import urlencode, quote
 import gc
 from streamlit.errors import StreamlitAPIException
+from pollinations_fanout import fan_out_pollinations
 
 # 應用配置
 APP_TITLE = "🎨 AI 圖像生成器 (改進選擇器版)"
@@ -753,67 +752,43 @@ def generate_images_with_retry(client, **params) -> Tuple[bool, any]:
         return generate_openai_compatible_images(client, params, n_images)
 
 def generate_pollinations_images(params: Dict, n_images: int) -> Tuple[bool, any]:
-    generated_images = []
+    results = [None] * n_images
     cfg = get_active_config()
     
     progress_bar = st.progress(0)
     status_text = st.empty()
+    status_text.text(f"正在並行生成 {n_images} 張圖片...")
+    preview_area = st.empty()
+    with preview_area.container():
+        preview_cols = st.columns(min(n_images, 3))
+    
+    # 所有種子同時發出，完成一張顯示一張
+    completed = 0
+    for i, response in fan_out_pollinations(params, cfg, n_images, timeout=REQUEST_TIMEOUT):
+        completed += 1
+        progress_bar.progress(completed / n_images)
+        status_text.text(f"已完成 {completed}/{n_images} 張圖片...")
+        
+        if isinstance(response, Exception):
+            st.warning(f"第 {i+1} 張圖片生成錯誤: {str(response)[:100]}")
+        elif response.ok:
+            results[i] = base64.b64encode(response.content).decode()
+            with preview_cols[i % len(preview_cols)]:
+                st.image(response.content, caption=f"#{i+1}", use_container_width=True)
+        else:
+            st.warning(f"第 {i+1} 張圖片生成失敗: HTTP {response.status_code}")
     
-    for i in range(n_images):
-        try:
-            status_text.text(f"正在生成第 {i+1}/{n_images} 張圖片...")
-            progress_bar.progress(i / n_images)
-            
-            current_params = params.copy()
-            current_params["seed"] = random.randint(0, 2**32 - 1)
-            
-            prompt = current_params.get("prompt", "")
-            if neg_prompt := current_params.get("negative_prompt"):
-                prompt += f" --no {neg_prompt}"
-            
-            width, height = str(current_params.get("size", "1024x1024")).split('x')
-            
-            api_params = {}
-            for key, value in {
-                "model": current_params.get("model"),
-                "width": width,
-                "height": height,
-                "seed": current_params.get("seed"),
-                "nologo": current_params.get("nologo"),
-                "private": current_params.get("private"),
-                "enhance": current_params.get("enhance"),
-                "safe": current_params.get("safe")
-            }.items():
-                if value is not None:
-                    api_params[key] = value
-            
-            headers = {}
-            auth_mode = cfg.get('pollinations_auth_mode', '免費')
-            
-            if auth_mode == '令牌' and cfg.get('pollinations_token'):
-                headers['Authorization'] = f"Bearer {cfg['pollinations_token']}"
-            elif auth_mode == '域名' and cfg.get('pollinations_referrer'):
-                headers['Referer'] = cfg['pollinations_referrer']
-            
-            url = f"{cfg['base_url']}/prompt/{quote(prompt)}?{urlencode(api_params)}"
-            response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
-            
-            if response.ok:
-                b64_json = base64.b64encode(response.content).decode()
-                image_obj = type('Image', (object,), {'b64_json': b64_json})
-                generated_images.append(image_obj)
-            else:
-                st.warning(f"第 {i+1} 張圖片生成失敗: HTTP {response.status_code}")
-                
-        except Exception as e:
-            st.warning(f"第 {i+1} 張圖片生成錯誤: {str(e)[:100]}")
-            continue
+    generated_images = [
+        type('Image', (object,), {'b64_json': b64_json})
+        for b64_json in results if b64_json is not None
+    ]
     
     progress_bar.progress(1.0)
     status_text.text(f"完成生成 {len(generated_images)}/{n_images} 張圖片")
     time.sleep(1)
     progress_bar.empty()
     status_text.empty()
+    preview_area.empty()
     
     if generated_images:
         response_obj = type('Response', (object,), {'data': generated_images})
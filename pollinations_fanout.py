@@ -0,0 +1,59 @@
+"""Pollinations.ai 多圖並行請求（app.py、app_simple.py、app_enhanced.py、app_improved_selector.py 共用）"""
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, Tuple, Union
+from urllib.parse import urlencode, quote
+
+import requests
+
+MAX_CONCURRENT_REQUESTS = 4
+REQUEST_TIMEOUT = 120
+
+def fetch_pollinations_image(params: Dict, cfg: Dict, seed: int,
+                             timeout: float = REQUEST_TIMEOUT) -> requests.Response:
+    """以指定種子請求一張 Pollinations 圖片"""
+    prompt = params.get("prompt", "")
+    if neg_prompt := params.get("negative_prompt"):
+        prompt += f" --no {neg_prompt}"
+
+    width, height = str(params.get("size", "1024x1024")).split('x')
+
+    api_params = {
+        k: v for k, v in {
+            "model": params.get("model"),
+            "width": width,
+            "height": height,
+            "seed": seed,
+            "nologo": params.get("nologo"),
+            "private": params.get("private"),
+            "enhance": params.get("enhance"),
+            "safe": params.get("safe")
+        }.items() if v is not None
+    }
+
+    headers = {}
+    auth_mode = cfg.get('pollinations_auth_mode', '免費')
+
+    if auth_mode == '令牌' and cfg.get('pollinations_token'):
+        headers['Authorization'] = f"Bearer {cfg['pollinations_token']}"
+    elif auth_mode == '域名' and cfg.get('pollinations_referrer'):
+        headers['Referer'] = cfg['pollinations_referrer']
+
+    url = f"{cfg['base_url']}/prompt/{quote(prompt)}?{urlencode(api_params)}"
+    return requests.get(url, headers=headers, timeout=timeout)
+
+def fan_out_pollinations(params: Dict, cfg: Dict, n_images: int, max_seed: int = 2**32 - 1,
+                         timeout: float = REQUEST_TIMEOUT,
+                         max_workers: int = MAX_CONCURRENT_REQUESTS
+                         ) -> Iterator[Tuple[int, Union[requests.Response, Exception]]]:
+    """每張圖片一個隨機種子並行請求（最多 max_workers 個同時進行），按完成順序產出 (索引, 響應或異常)"""
+    with ThreadPoolExecutor(max_workers=max(1, min(n_images, max_workers))) as executor:
+        futures = {
+            executor.submit(fetch_pollinations_image, params, cfg, random.randint(0, max_seed), timeout): i
+            for i in range(n_images)
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# 導入應用前把數據目錄指向臨時目錄，避免測試讀寫 data/
+os.environ.setdefault("APP_DATA_DIR", tempfile.mkdtemp(prefix="flux-ai-pro-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeResponse:
+    """requests / httpx 響應的最小替身"""
+    
+    def __init__(self, status_code=200, headers=None, content=b"", body=None, url=""):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = headers or {}
+        self.content = content
+        self.url = url
+        self._body = body
+    
+    def json(self):
+        if self._body is None:
+            raise ValueError("no body")
+        return self._body
+
+
+class SessionState(dict):
+    """st.session_state 的最小替身（支持屬性訪問）"""
+    __getattr__ = dict.__getitem__
+    __setattr__ = dict.__setitem__
+
+
+@pytest.fixture
+def fake_response():
+    return FakeResponse
+
+
+@pytest.fixture
+def make_cfg():
+    """每次返回新 base_url 的供應商配置，避免進程級的端點狀態在測試間串擾"""
+    def make_cfg(provider="Hugging Face"):
+        return {
+            "provider": provider,
+            "base_url": f"https://{uuid.uuid4().hex}.test",
+            "api_key": "test",
+            "validated": True,
+        }
+    return make_cfg
+
+
+@pytest.fixture
+def session_state(monkeypatch):
+    """以空的 SessionState 替換 st.session_state"""
+    import app_complete as app
+    
+    state = SessionState()
+    monkeypatch.setattr(app.st, "session_state", state)
+    return state
+
+
+@pytest.fixture
+def run():
+    """在應用的後台事件循環上執行協程並返回結果"""
+    import app_complete as app
+    
+    def run(coro):
+        return asyncio.run_coroutine_threadsafe(coro, app.get_async_runner().loop).result(timeout=10)
+    return run
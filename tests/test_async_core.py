@@ -0,0 +1,195 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pytest
+
+import app_complete as app
+
+
+class FakeSyncResponse:
+    status_code = 200
+    url = "http://example.test/image"
+    
+    def __init__(self, body: bytes):
+        self.headers = {"Content-Length": str(len(body))}
+        self._body = body
+    
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self._body), chunk_size):
+            yield self._body[i:i + chunk_size]
+
+
+class FakeSyncSession:
+    """requests 會話的最小替身，記錄執行請求的線程"""
+    
+    def __init__(self, body: bytes):
+        self.body = body
+        self.threads = []
+    
+    @contextmanager
+    def request(self, method, url, stream=False, **kwargs):
+        self.threads.append(threading.current_thread().name)
+        yield FakeSyncResponse(self.body)
+
+
+@pytest.fixture
+def threads_engine(monkeypatch):
+    monkeypatch.setitem(app.TRANSPORT_DEFAULTS, "engine", "threads")
+
+
+def test_threads_engine_uses_sync_clients(threads_engine):
+    runner = app.get_async_runner()
+    
+    assert not runner.native
+    assert runner.http_client("Pollinations.ai", "http://example.test") is app.get_http_client(
+        "Pollinations.ai", "http://example.test"
+    )
+
+
+def test_sync_client_is_streamed_on_a_worker_thread(run):
+    session = FakeSyncSession(b"x" * (app.STREAM_CHUNK_SIZE + 10))
+    progress = []
+    
+    response = run(app.async_stream_request(
+        session, "GET", "http://example.test/image", lambda received, total: progress.append((received, total))
+    ))
+    
+    assert response.content == session.body
+    assert session.threads[0].startswith("fanout")
+    assert progress[-1] == (len(session.body), len(session.body))
+
+
+def test_fan_out_yields_in_completion_order():
+    async def job(delay: float, value: str):
+        await asyncio.sleep(delay)
+        return value
+    
+    jobs = [lambda: job(0.2, "slow"), lambda: job(0.0, "fast")]
+    results = list(app.fan_out("test-fan-out-order", jobs))
+    
+    assert results == [(1, True, "fast"), (0, True, "slow")]
+
+
+def test_fan_out_reports_deadline_for_unfinished_jobs():
+    async def hang():
+        await asyncio.sleep(10)
+    
+    results = list(app.fan_out("test-fan-out-deadline", [hang], deadline=time.monotonic() + 0.3))
+    
+    assert len(results) == 1
+    index, ok, error = results[0]
+    assert (index, ok) == (0, False)
+    assert isinstance(error, TimeoutError)
+
+
+def test_fan_out_stops_when_cancelled():
+    token = app.CancellationToken()
+    started = threading.Event()
+    
+    async def hang():
+        started.set()
+        await asyncio.sleep(10)
+    
+    threading.Timer(0.2, token.cancel).start()
+    began = time.monotonic()
+    results = list(app.fan_out("test-fan-out-cancel", [hang], cancel_token=token))
+    
+    assert started.is_set()
+    assert results == []
+    assert time.monotonic() - began < 2
+
+
+def test_async_sleep_is_interrupted_by_cancellation(run):
+    token = app.CancellationToken()
+    token.cancel()
+    
+    with pytest.raises(app.GenerationCancelled):
+        run(app.async_sleep(5, token))
+
+
+def test_fan_out_respects_provider_concurrency():
+    active, peak = 0, 0
+    
+    async def job():
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.05)
+        active -= 1
+        return True
+    
+    results = list(app.fan_out("test-fan-out-bound", [job] * 6))
+    
+    assert len(results) == 6
+    assert peak == app.DEFAULT_CONCURRENCY
+
+
+def test_cancelled_token_reservation_is_refunded():
+    limiter = app.TokenBucket(rate=0.01, burst=1)
+    assert limiter.try_acquire()
+    
+    future = asyncio.run_coroutine_threadsafe(
+        app.async_take_token(limiter, max_wait=1000), app.get_async_runner().loop
+    )
+    time.sleep(0.1)
+    future.cancel()
+    time.sleep(0.1)
+    
+    # 被撤銷的預約已退還：下一個令牌只需等一個補充週期，而不是兩個
+    assert limiter.reserve(max_wait=1000) == pytest.approx(100, abs=1)
+
+
+def test_cancellation_token_refunds_reservation(run):
+    limiter = app.TokenBucket(rate=0.01, burst=1)
+    assert limiter.try_acquire()
+    token = app.CancellationToken()
+    threading.Timer(0.1, token.cancel).start()
+    
+    with pytest.raises(app.GenerationCancelled):
+        run(app.async_take_token(limiter, max_wait=1000, cancel_token=token))
+    
+    assert limiter.reserve(max_wait=1000) == pytest.approx(100, abs=1)
+
+
+def test_loop_clients_are_dropped_least_recently_used_without_closing(monkeypatch):
+    runner = app.get_async_runner()
+    if not runner.native:
+        pytest.skip("需要 httpx 和 asyncio 引擎")
+    monkeypatch.setattr(runner, "_http_clients", OrderedDict())
+    monkeypatch.setattr(app, "MAX_SHARED_CLIENTS", 1)
+    oldest = runner.http_client("LRU", "http://lru-old.test")
+    
+    runner.http_client("LRU", "http://lru-new.test")
+    time.sleep(0.1)
+    
+    # 其他會話的批次可能仍持有被擠出的客戶端
+    assert not oldest.is_closed
+    assert runner.http_client("LRU", "http://lru-old.test") is not oldest
+
+
+def test_rate_limited_backlog_does_not_starve_other_providers():
+    limiter = app.TokenBucket(rate=0.01, burst=1)
+    assert limiter.try_acquire()
+    token = app.CancellationToken()
+    
+    async def blocking_call():
+        return await asyncio.to_thread(time.sleep, 0.01)
+    
+    # 排隊等令牌的任務遠多於工作線程，但等待只發生在事件循環上
+    backlog = threading.Thread(target=lambda: list(app.fan_out(
+        "test-fan-out-backlog", [blocking_call] * (app.MAX_FANOUT_WORKERS * 2), limiter, token
+    )))
+    backlog.start()
+    try:
+        time.sleep(0.2)
+        began = time.monotonic()
+        results = list(app.fan_out("test-fan-out-other", [blocking_call] * 4))
+        
+        assert [ok for _, ok, _ in results] == [True] * 4
+        assert time.monotonic() - began < 2
+    finally:
+        token.cancel()
+        backlog.join(timeout=5)
@@ -0,0 +1,117 @@
+import datetime
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+import app_complete as app
+
+
+def png(color: str) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", (32, 32), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def make_blob_store(tmp_path, executor=None):
+    return app.BlobStore(str(tmp_path / "images"), 1 << 20, executor)
+
+
+def files(tmp_path):
+    return sorted(
+        name for _, _, names in os.walk(tmp_path / "images") for name in names if name.endswith(".bin")
+    )
+
+
+def entry(images, entry_id="e1"):
+    return {
+        "id": entry_id,
+        "timestamp": datetime.datetime(2025, 1, 1),
+        "prompt": "p",
+        "negative_prompt": "",
+        "model": "flux",
+        "images": list(images),
+        "metadata": {},
+    }
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = make_blob_store(tmp_path)
+    
+    first = store.put(png("red"))
+    second = store.put(png("red"))
+    
+    assert first == second
+    assert len(files(tmp_path)) == 1
+
+
+def test_restart_keeps_referenced_blobs_and_sweeps_session_only_ones(tmp_path):
+    store = make_blob_store(tmp_path)
+    kept = store.put(png("red"), persistent=True)
+    dropped = store.put(png("blue"))
+    
+    restarted = make_blob_store(tmp_path)
+    
+    assert restarted.get(kept) == png("red")
+    assert restarted.get(dropped) is None
+    assert files(tmp_path) == [f"{kept}.bin"]
+
+
+def test_blob_is_deleted_only_after_every_reference_is_released(tmp_path):
+    store = make_blob_store(tmp_path)
+    handle = store.put(png("red"))
+    store.link([handle, handle])
+    
+    store.unlink([handle])
+    store.release(handle)
+    assert store.get(handle) == png("red")
+    
+    store.unlink([handle])
+    assert store.get(handle) is None
+    assert files(tmp_path) == []
+
+
+def test_history_and_favorites_share_one_copy(tmp_path):
+    blob_store = make_blob_store(tmp_path)
+    history = app.HistoryStore(str(tmp_path / "history.db"), blob_store, retention=100)
+    handle = blob_store.put(png("red"))
+    history.add_entry("owner", entry([handle]))
+    history.add_favorite("owner", {
+        "id": "fav", "image_handle": handle, "seed": 1, "timestamp": datetime.datetime(2025, 1, 1)
+    })
+    blob_store.release(handle)
+    
+    history.clear_history("owner")
+    assert blob_store.get(handle) == png("red")
+    
+    history.clear_favorites("owner")
+    assert blob_store.get(handle) is None
+
+
+def test_result_cache_holds_references_into_the_store(tmp_path):
+    blob_store = make_blob_store(tmp_path)
+    cache = app.ResultCache(str(tmp_path / "cache.db"), blob_store, budget=len(png("red")) + 10)
+    handle = blob_store.put(png("red"))
+    
+    cache.put("k1", png("red"))
+    blob_store.release(handle)
+    assert len(files(tmp_path)) == 1
+    
+    restarted = app.ResultCache(str(tmp_path / "cache.db"), make_blob_store(tmp_path), budget=1 << 20)
+    assert restarted.get("k1") == png("red")
+    
+    # 超出限額時淘汰最舊條目並釋放其引用
+    cache.put("k2", png("blue"))
+    assert cache.get("k1") is None
+    assert files(tmp_path) == [f"{hashlib.sha256(png('blue')).hexdigest()}.bin"]
+
+
+def test_thumbnail_is_persisted_when_generated(tmp_path):
+    executor = ThreadPoolExecutor(max_workers=1)
+    store = make_blob_store(tmp_path, executor)
+    handle = store.put(png("red"), persistent=True)
+    
+    assert store.thumbnail(handle, timeout=5) is not None
+    assert make_blob_store(tmp_path).thumbnail(handle) is not None
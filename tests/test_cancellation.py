@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import app_complete as app
+
+
+def wait(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.finished
+
+
+def test_child_token_follows_its_parent():
+    parent = app.CancellationToken()
+    child = app.CancellationToken(parent)
+    
+    child.cancel()
+    assert child.cancelled and not parent.cancelled
+    
+    other = app.CancellationToken(parent)
+    parent.cancel()
+    assert other.cancelled
+
+
+def test_sleep_is_interrupted_by_cancellation():
+    token = app.CancellationToken()
+    threading.Timer(0.1, token.cancel).start()
+    began = time.monotonic()
+    
+    with pytest.raises(app.GenerationCancelled):
+        token.sleep(10)
+    assert time.monotonic() - began < 2
+
+
+def test_child_sleep_is_interrupted_by_parent_cancellation():
+    parent = app.CancellationToken()
+    child = app.CancellationToken(parent)
+    threading.Timer(0.1, parent.cancel).start()
+    began = time.monotonic()
+    
+    with pytest.raises(app.GenerationCancelled):
+        child.sleep(10)
+    assert time.monotonic() - began < 2
+
+
+def test_uncancelled_sleep_returns():
+    app.CancellationToken().sleep(0.01)
+
+
+def test_running_job_is_cancelled_cooperatively():
+    queue = app.JobQueue(1, 600)
+    job = app.GenerationJob("owner", 1, {})
+    started = threading.Event()
+    
+    def run(job):
+        started.set()
+        job.cancel_token.sleep(10)
+        return True, None
+    
+    queue.submit(job, run)
+    assert started.wait(5)
+    job.cancel()
+    wait(job)
+    
+    assert job.status == "cancelled"
+    assert job.result == (False, "生成已取消")
+
+
+def test_images_finished_before_cancellation_are_kept(fake_response):
+    token = app.CancellationToken()
+    
+    async def fast():
+        return fake_response(content=b"done")
+    
+    async def hang():
+        await asyncio.sleep(10)
+    
+    def on_image(i, content, error):
+        if content is not None:
+            token.cancel()
+    
+    ok, response = app.run_image_batch("test-cancel-batch", [fast, hang], [1, 2], on_image, cancel_token=token)
+    
+    assert ok
+    assert [(image.index, image.content) for image in response.data] == [(0, b"done")]
+
+
+def test_batch_cancelled_before_any_image_reports_cancellation():
+    token = app.CancellationToken()
+    token.cancel()
+    
+    async def hang():
+        await asyncio.sleep(10)
+    
+    assert app.run_image_batch("test-cancel-empty", [hang], [1], cancel_token=token) == (False, "生成已取消")
@@ -0,0 +1,92 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+
+import app_complete as app
+
+
+SETTINGS = {
+    "window": 10, "min_calls": 4, "error_rate": 0.5,
+    "slow_call_seconds": 60.0, "slow_rate": 0.8, "open_seconds": 0.2,
+}
+
+
+def test_breaker_opens_on_errors_and_recovers_through_one_probe():
+    breaker = app.CircuitBreaker(SETTINGS)
+    for _ in range(4):
+        assert breaker.allow()
+        breaker.record(False, 0.1)
+    
+    assert breaker.is_open()
+    assert not breaker.allow()
+    
+    time.sleep(0.25)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.snapshot()["state"] == "closed"
+
+
+def test_slow_threshold_is_per_call():
+    breaker = app.CircuitBreaker(SETTINGS)
+    for _ in range(4):
+        breaker.record(True, 90.0, slow_after=120.0)
+    assert breaker.snapshot()["state"] == "closed"
+    
+    breaker = app.CircuitBreaker(SETTINGS)
+    for _ in range(4):
+        breaker.record(True, 90.0)
+    assert breaker.is_open()
+
+
+def test_slow_threshold_follows_the_model_latency():
+    tracker = app.get_latency_tracker()
+    model = f"slow-{uuid.uuid4().hex}"
+    settings = app.get_timeout_settings()
+    for _ in range(int(settings["min_samples"])):
+        tracker.record("Hugging Face", model, 75.0)
+    
+    assert app.slow_call_threshold("Hugging Face", model) == pytest.approx(75.0)
+    assert app.slow_call_threshold("Hugging Face", f"new-{uuid.uuid4().hex}") == SETTINGS["slow_call_seconds"]
+
+
+def test_open_breaker_fails_before_taking_a_rate_token(run):
+    breaker = app.CircuitBreaker(SETTINGS)
+    for _ in range(4):
+        breaker.record(False, 0.1)
+    limiter = app.TokenBucket(rate=0.001, burst=1)
+    calls = []
+    
+    async def call():
+        calls.append(1)
+    
+    with pytest.raises(app.CircuitOpenError):
+        run(app.async_call_with_retry("Pollinations.ai", call, limiter, breaker=breaker))
+    
+    assert calls == []
+    assert limiter.try_acquire()
+
+
+def test_probe_slot_is_returned_when_token_wait_is_cancelled():
+    breaker = app.CircuitBreaker({**SETTINGS, "open_seconds": 0.0})
+    for _ in range(4):
+        breaker.record(False, 0.1)
+    limiter = app.TokenBucket(rate=0.2, burst=1)
+    assert limiter.try_acquire()
+    token = app.CancellationToken()
+    
+    async def call():
+        return None
+    
+    future = asyncio.run_coroutine_threadsafe(
+        app.async_call_with_retry("Pollinations.ai", call, limiter, cancel_token=token, breaker=breaker),
+        app.get_async_runner().loop
+    )
+    time.sleep(0.1)
+    token.cancel()
+    with pytest.raises(app.GenerationCancelled):
+        future.result(timeout=5)
+    
+    assert breaker.allow()
@@ -0,0 +1,86 @@
+import uuid
+
+import app_complete as app
+
+
+def make_image(content: bytes, index: int, seed=None):
+    return type('Image', (object,), {'content': content, 'seed': seed, 'index': index})
+
+
+def fake_dispatch(monkeypatch, images, calls=None):
+    def dispatch(provider, client, cfg, params, n_images, on_image=None, on_bytes=None, cancel_token=None,
+                 deadline=None):
+        if calls is not None:
+            calls.append(params)
+        return True, type('Response', (object,), {'data': images})
+    monkeypatch.setattr(app, "dispatch_generation", dispatch)
+
+
+CFG = {"provider": "OpenAI Compatible", "base_url": "http://merge.test/v1"}
+SEEDED_CFG = {"provider": "Pollinations.ai", "base_url": "http://merge.test"}
+
+
+def unique_params(n: int):
+    return {"model": "m", "prompt": f"merge {uuid.uuid4().hex}", "size": "64x64", "n": n, "seeds": [11, 22, 33][:n]}
+
+
+def test_results_are_placed_by_batch_index_not_seed(monkeypatch):
+    # 供應商不回傳種子，且第 2 張失敗、結果亂序
+    fake_dispatch(monkeypatch, [make_image(b"third", 2), make_image(b"first", 0)])
+    params = unique_params(3)
+    job = app.GenerationJob("owner", 3, {})
+    
+    ok, response = app.generate_images_with_retry(None, CFG, job, **params)
+    
+    assert ok
+    assert [(image.index, image.content) for image in response.data] == [(0, b"first"), (2, b"third")]
+    assert job.snapshot()["previews"] == {0: b"first", 2: b"third"}
+
+
+def test_cache_keys_follow_batch_index(monkeypatch):
+    fake_dispatch(monkeypatch, [make_image(b"third", 2, 33), make_image(b"first", 0, 11)])
+    params = unique_params(3)
+    app.generate_images_with_retry(None, SEEDED_CFG, None, **params)
+    
+    cache = app.get_result_cache()
+    key = lambda seed: app.generation_cache_key(SEEDED_CFG["provider"], SEEDED_CFG["base_url"], params, seed)
+    assert cache.get(key(11)) == b"first"
+    assert cache.get(key(22)) is None
+    assert cache.get(key(33)) == b"third"
+
+
+def test_images_generated_without_a_seed_are_not_cached(monkeypatch):
+    # 供應商忽略了請求的種子：固定種子下 n 張圖片不能共用一個快取鍵
+    fake_dispatch(monkeypatch, [make_image(b"first", 0), make_image(b"second", 1)])
+    params = {**unique_params(2), "seeds": [7, 7]}
+    
+    ok, response = app.generate_images_with_retry(None, CFG, None, **params)
+    
+    assert [image.seed for image in response.data] == [None, None]
+    assert app.get_result_cache().get(app.generation_cache_key(CFG["provider"], CFG["base_url"], params, 7)) is None
+
+
+def test_unseeded_requests_skip_the_cache(monkeypatch):
+    calls = []
+    fake_dispatch(monkeypatch, [make_image(b"first", 0), make_image(b"second", 1)], calls)
+    params = {**unique_params(2), "seeds": [None, None]}
+    
+    app.generate_images_with_retry(None, CFG, None, **params)
+    app.generate_images_with_retry(None, CFG, None, **params)
+    
+    assert len(calls) == 2
+
+
+def test_partial_cache_hit_maps_sub_batch_indices(monkeypatch):
+    params = unique_params(3)
+    cache = app.get_result_cache()
+    cache.put(app.generation_cache_key(CFG["provider"], CFG["base_url"], params, 11), b"cached")
+    
+    # 只請求未命中的第 1、2 張；子批次中的索引 1 對應整批的索引 2
+    calls = []
+    fake_dispatch(monkeypatch, [make_image(b"third", 1)], calls)
+    
+    ok, response = app.generate_images_with_retry(None, CFG, None, **params)
+    
+    assert calls[0]["seeds"] == [22, 33]
+    assert [(image.index, image.content) for image in response.data] == [(0, b"cached"), (2, b"third")]
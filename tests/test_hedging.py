@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+import app_complete as app
+
+
+@pytest.fixture
+def make_slow_primary(fake_response):
+    def make_slow_primary(started, primary_delay=0.5, hedge_delay=0.05):
+        async def make_request(token):
+            label = "primary" if not started else "hedge"
+            started.append(label)
+            await asyncio.sleep(primary_delay if label == "primary" else hedge_delay)
+            return fake_response(content=label.encode())
+        return make_request
+    return make_slow_primary
+
+
+def test_hedge_budget_allows_one_duplicate_per_ratio():
+    budget = app.HedgeBudget(0.5, burst=1)
+    budget.record_primary()
+    assert not budget.try_acquire()
+    
+    budget.record_primary()
+    assert budget.try_acquire()
+    assert not budget.try_acquire()
+    
+    budget.refund()
+    assert budget.stats() == {"primary": 2, "hedged": 0, "hedge_wins": 0}
+
+
+def test_hedge_takes_its_own_slot_and_returns_it(run, make_slow_primary):
+    budget = app.HedgeBudget(1.0)
+    started = []
+    
+    async def scenario():
+        semaphore = asyncio.Semaphore(2)
+        await semaphore.acquire()  # 主請求持有的名額
+        response = await app.async_hedged_call(
+            make_slow_primary(started), 0.05, budget, semaphore=semaphore
+        )
+        await asyncio.sleep(0)
+        return response, semaphore._value
+    
+    response, free_slots = run(scenario())
+    
+    assert response.content == b"hedge"
+    assert started == ["primary", "hedge"]
+    assert free_slots == 1
+    assert budget.stats()["hedge_wins"] == 1
+
+
+def test_hedge_is_skipped_when_no_slot_is_free(run, make_slow_primary):
+    budget = app.HedgeBudget(1.0)
+    started = []
+    
+    async def scenario():
+        semaphore = asyncio.Semaphore(1)
+        await semaphore.acquire()
+        return await app.async_hedged_call(
+            make_slow_primary(started, primary_delay=0.3), 0.05, budget, semaphore=semaphore
+        )
+    
+    response = run(scenario())
+    
+    assert response.content == b"primary"
+    assert started == ["primary"]
+    assert budget.stats()["hedged"] == 0
+
+
+def test_hedge_without_rate_token_refunds_budget(run, make_slow_primary):
+    budget = app.HedgeBudget(1.0)
+    limiter = app.TokenBucket(rate=0.01, burst=1)
+    assert limiter.try_acquire()
+    started = []
+    
+    response = run(app.async_hedged_call(
+        make_slow_primary(started, primary_delay=0.3), 0.05, budget, limiter
+    ))
+    
+    assert response.content == b"primary"
+    assert started == ["primary"]
+    assert budget.stats()["hedged"] == 0
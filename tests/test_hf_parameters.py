@@ -0,0 +1,65 @@
+import pytest
+
+import app_complete as app
+
+
+@pytest.fixture
+def payloads(monkeypatch, fake_response):
+    payloads = []
+    
+    async def fake_post(http_client, url, headers, payload, tracker, *args, **kwargs):
+        payloads.append(payload)
+        return fake_response(content=b"image")
+    monkeypatch.setattr(app, "async_hf_post", fake_post)
+    return payloads
+
+
+def test_scale_size_keeps_aspect_ratio_on_multiples_of_eight():
+    assert app.scale_size("1024x1024", 512) == "512x512"
+    assert app.scale_size("1792x1024", 512) == "512x288"
+    assert app.scale_size("256x256", 512) == "256x256"
+    assert app.scale_size("4096x256", 512) == "512x64"
+
+
+def test_advanced_parameters_reach_the_payload(payloads, make_cfg):
+    params = {"model": "m", "prompt": "cat", "negative_prompt": "blurry", "size": "768x512",
+              "num_inference_steps": 40, "guidance_scale": 3.5, "scheduler": "DPMSolver", "seeds": [5]}
+    
+    ok, _ = app.generate_huggingface_images(make_cfg(), params, 1)
+    
+    assert ok
+    assert payloads[0]["inputs"] == "cat"
+    assert payloads[0]["parameters"] == {
+        "negative_prompt": "blurry", "num_inference_steps": 40, "guidance_scale": 3.5,
+        "width": 768, "height": 512, "scheduler": "DPMSolver", "seed": 5,
+    }
+
+
+def test_defaults_are_used_when_parameters_are_missing(payloads, make_cfg):
+    
+    app.generate_huggingface_images(make_cfg(), {"model": "m", "prompt": "cat", "seeds": [1]}, 1)
+    
+    parameters = payloads[0]["parameters"]
+    assert parameters["num_inference_steps"] == app.HF_DEFAULT_STEPS
+    assert parameters["guidance_scale"] == app.HF_DEFAULT_GUIDANCE
+    assert (parameters["width"], parameters["height"]) == (512, 512)
+    assert "scheduler" not in parameters
+
+
+def test_fast_preview_profile_overrides_steps_and_size(payloads, make_cfg):
+    params = {"model": "m", "prompt": "cat", "size": "1024x1024", "num_inference_steps": 40,
+              "quality": "快速預覽", "seeds": [1]}
+    
+    app.generate_huggingface_images(make_cfg(), params, 1)
+    
+    parameters = payloads[0]["parameters"]
+    profile = app.QUALITY_PROFILES["快速預覽"]
+    assert parameters["num_inference_steps"] == profile["num_inference_steps"]
+    assert max(parameters["width"], parameters["height"]) == profile["max_edge"]
+
+
+def test_each_image_gets_its_own_seed(payloads, make_cfg):
+    
+    app.generate_huggingface_images(make_cfg(), {"model": "m", "prompt": "cat", "seeds": [1, 2, 3]}, 3)
+    
+    assert sorted(payload["parameters"]["seed"] for payload in payloads) == [1, 2, 3]
@@ -0,0 +1,118 @@
+import datetime
+
+import pytest
+
+import app_complete as app
+
+
+def make_store(tmp_path, retention=100):
+    blob_store = app.BlobStore(str(tmp_path / "images"), 1 << 20)
+    return app.HistoryStore(str(tmp_path / "history.db"), blob_store, retention)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return make_store(tmp_path)
+
+
+def make_entry(prompt: str, minutes: int = 0, model: str = "flux", images=()):
+    return {
+        "id": f"{prompt}-{minutes}",
+        "timestamp": datetime.datetime(2025, 1, 1) + datetime.timedelta(minutes=minutes),
+        "prompt": prompt,
+        "negative_prompt": "",
+        "model": model,
+        "images": list(images),
+        "metadata": {"style": "無"},
+    }
+
+
+def search(store, query):
+    items, _ = store.page("owner", query, limit=50)
+    return [item["prompt"] for item in items]
+
+
+def test_search_single_cjk_character_in_middle_of_prompt(store):
+    store.add_entry("owner", make_entry("一隻可愛的貓在花園裡玩耍"))
+    store.add_entry("owner", make_entry("一隻小狗在草地上", 1))
+    
+    assert search(store, "貓") == ["一隻可愛的貓在花園裡玩耍"]
+    assert store.count("owner", "貓") == 1
+
+
+def test_search_cjk_phrase_uses_trigram_index(store):
+    assert store.fts_enabled
+    store.add_entry("owner", make_entry("一隻可愛的貓在花園裡玩耍"))
+    store.add_entry("owner", make_entry("花園裡的噴泉", 1))
+    
+    assert search(store, "花園裡") == ["花園裡的噴泉", "一隻可愛的貓在花園裡玩耍"]
+    assert search(store, "可愛的貓") == ["一隻可愛的貓在花園裡玩耍"]
+
+
+def test_search_requires_every_term(store):
+    store.add_entry("owner", make_entry("a cat in the garden"))
+    store.add_entry("owner", make_entry("a dog in the garden", 1))
+    
+    assert search(store, "garden cat") == ["a cat in the garden"]
+    assert search(store, "GARDEN") == ["a dog in the garden", "a cat in the garden"]
+    assert search(store, "rden") == ["a dog in the garden", "a cat in the garden"]
+
+
+def test_search_matches_model_and_ignores_other_owners(store):
+    store.add_entry("owner", make_entry("sunset", model="stable-diffusion-xl"))
+    store.add_entry("someone-else", make_entry("sunset again", model="stable-diffusion-xl"))
+    
+    assert search(store, "diffusion") == ["sunset"]
+
+
+def test_short_terms_escape_like_wildcards(store):
+    store.add_entry("owner", make_entry("a_b"))
+    store.add_entry("owner", make_entry("axb", 1))
+    
+    assert search(store, "a_b") == ["a_b"]
+
+
+def test_keyset_pagination_walks_all_entries_newest_first(store):
+    for minutes in range(7):
+        store.add_entry("owner", make_entry(f"prompt {minutes}", minutes))
+    
+    seen, cursor = [], None
+    while True:
+        items, cursor = store.page("owner", cursor=cursor, limit=3)
+        seen.extend(item["prompt"] for item in items)
+        if cursor is None:
+            break
+    
+    assert seen == [f"prompt {minutes}" for minutes in reversed(range(7))]
+
+
+def test_pagination_keeps_image_order(store):
+    store.add_entry("owner", make_entry("with images", images=["c" * 64, "a" * 64, "b" * 64]))
+    
+    items, cursor = store.page("owner")
+    
+    assert items[0]["images"] == ["c" * 64, "a" * 64, "b" * 64]
+    assert cursor is None
+
+
+def test_retention_prunes_oldest_entries(tmp_path):
+    store = make_store(tmp_path, retention=2)
+    for minutes in range(3):
+        store.add_entry("owner", make_entry(f"prompt {minutes}", minutes))
+    
+    assert store.count("owner") == 2
+    assert search(store, "") == ["prompt 2", "prompt 1"]
+
+
+def test_restored_favorites_report_their_stored_size(tmp_path):
+    store = make_store(tmp_path)
+    data = b"\x89PNG" + b"x" * 1000
+    handle = store.blob_store.put(data)
+    store.add_favorite("owner", {
+        "id": "fav", "image_handle": handle, "seed": 7, "timestamp": datetime.datetime(2025, 1, 1)
+    })
+    store.blob_store.release(handle)
+    
+    favorites = make_store(tmp_path).load_favorites("owner")
+    
+    assert [(fav["image_handle"], fav["bytes"], fav["seed"]) for fav in favorites] == [(handle, len(data), 7)]
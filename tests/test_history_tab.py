@@ -0,0 +1,58 @@
+import datetime
+import uuid
+
+from streamlit.testing.v1 import AppTest
+
+import app_complete as app
+
+
+APP_PATH = app.__file__
+
+
+def seed_history(owner: str, count: int):
+    store = app.get_history_store()
+    for minutes in range(count):
+        store.add_entry(owner, {
+            "id": f"{owner}-{minutes}",
+            "timestamp": datetime.datetime(2025, 1, 1) + datetime.timedelta(minutes=minutes),
+            "prompt": f"prompt {minutes}",
+            "negative_prompt": "",
+            "model": "flux",
+            "images": [],
+            "metadata": {},
+        })
+
+
+def history_toggles(at):
+    return [toggle for toggle in at.toggle if toggle.key and toggle.key.startswith("hist_open_")]
+
+
+def test_history_tab_renders_one_collapsed_page_at_a_time():
+    owner = uuid.uuid4().hex
+    seed_history(owner, app.HISTORY_PAGE_SIZE + 2)
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.session_state["history_owner"] = owner
+    at.run()
+    
+    assert not at.exception
+    assert len(history_toggles(at)) == app.HISTORY_PAGE_SIZE
+    assert all(not toggle.value for toggle in history_toggles(at))
+    assert any("第 1 / 2 頁" in markdown.value for markdown in at.markdown)
+    
+    next(button for button in at.button if button.key == "history_cursors_next").click().run()
+    
+    assert [toggle.key for toggle in history_toggles(at)] == [f"hist_open_{owner}-1", f"hist_open_{owner}-0"]
+    assert any("第 2 / 2 頁" in markdown.value for markdown in at.markdown)
+
+
+def test_history_search_resets_to_the_first_page():
+    owner = uuid.uuid4().hex
+    seed_history(owner, app.HISTORY_PAGE_SIZE + 2)
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.session_state["history_owner"] = owner
+    at.run()
+    next(button for button in at.button if button.key == "history_cursors_next").click().run()
+    
+    at.text_input(key="history_query").input("prompt 11").run()
+    
+    assert [toggle.key for toggle in history_toggles(at)] == [f"hist_open_{owner}-11"]
@@ -0,0 +1,67 @@
+import threading
+import time
+
+import app_complete as app
+
+
+def wait(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.finished
+
+
+def test_job_runs_on_worker_and_records_result():
+    queue = app.JobQueue(1, 600)
+    job = app.GenerationJob("owner", 1, {})
+    
+    queue.submit(job, lambda job: (True, threading.current_thread().name))
+    wait(job)
+    
+    assert job.status == "done"
+    assert job.result[1].startswith("genjob")
+
+
+def test_job_cancelled_while_queued_never_runs():
+    queue = app.JobQueue(1, 600)
+    gate = threading.Event()
+    blocker = app.GenerationJob("owner", 1, {})
+    queued = app.GenerationJob("owner", 1, {})
+    ran = []
+    
+    queue.submit(blocker, lambda job: gate.wait(5) and (True, None))
+    queue.submit(queued, lambda job: ran.append(job) or (True, None))
+    queued.cancel()
+    gate.set()
+    wait(queued)
+    
+    assert queued.status == "cancelled"
+    assert ran == []
+
+
+def test_jobs_are_only_visible_to_their_owner():
+    queue = app.JobQueue(1, 600)
+    job = app.GenerationJob("alice", 1, {})
+    queue.submit(job, lambda job: (True, None))
+    
+    assert queue.get(job.id, "alice") is job
+    assert queue.get(job.id, "bob") is None
+
+
+def test_finished_jobs_are_pruned_after_retention():
+    queue = app.JobQueue(1, 0)
+    old = app.GenerationJob("owner", 1, {})
+    queue.submit(old, lambda job: (True, None))
+    wait(old)
+    
+    queue.submit(app.GenerationJob("owner", 1, {}), lambda job: (True, None))
+    
+    assert queue.get(old.id, "owner") is None
+
+
+def test_cancelling_and_finished_jobs_do_not_count_against_session_cap():
+    running, cancelling, finished = (app.GenerationJob("owner", 1, {}) for _ in range(3))
+    cancelling.cancel()
+    finished.finish((True, None))
+    
+    assert app.count_running_jobs([running, cancelling, finished]) == 1
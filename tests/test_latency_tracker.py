@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import app_complete as app
+
+
+@pytest.fixture
+def tracker(tmp_path):
+    return app.LatencyTracker(str(tmp_path / "latency.json"))
+
+
+def fill(tracker, seconds, workload, model="flux"):
+    for _ in range(int(app.TIMEOUT_DEFAULTS["min_samples"])):
+        tracker.record("Hugging Face", model, seconds, workload)
+
+
+def test_workload_key_includes_quality_and_size():
+    assert app.latency_workload({"quality": "快速預覽", "size": "512x512"}) == "快速預覽|512x512"
+    assert app.latency_workload({"size": "1024x1024"}) == "完整|1024x1024"
+
+
+def test_each_workload_has_its_own_timeout(tracker):
+    fill(tracker, 15.0, "快速預覽|512x512")
+    fill(tracker, 60.0, "完整|1024x1024")
+    
+    assert tracker.timeout("Hugging Face", "flux", "快速預覽|512x512") == 30.0
+    assert tracker.timeout("Hugging Face", "flux", "完整|1024x1024") == 120.0
+    assert tracker.timeout("Hugging Face", "flux", "完整|2048x2048") == app.TIMEOUT_DEFAULTS["ceiling"]
+
+
+def test_timeouts_widen_the_limit_without_becoming_samples(tracker):
+    fill(tracker, 15.0, "w")
+    
+    async def timed_out():
+        raise httpx.ReadTimeout("timed out")
+    
+    for _ in range(2):
+        with pytest.raises(httpx.ReadTimeout):
+            asyncio.run(app.async_timed_call(tracker, "Hugging Face", "flux", "w", timed_out))
+    
+    stats = tracker.stats("Hugging Face", "flux", "w")
+    assert stats["samples"] == app.TIMEOUT_DEFAULTS["min_samples"]
+    assert stats["quantile"] == 15.0
+    assert stats["timeout"] == 120.0
+    
+    tracker.record("Hugging Face", "flux", 15.0, "w")
+    assert tracker.timeout("Hugging Face", "flux", "w") == 30.0
+
+
+def test_widened_timeout_stops_at_the_ceiling(tracker):
+    fill(tracker, 60.0, "w")
+    for _ in range(5):
+        tracker.record_timeout("Hugging Face", "flux", "w")
+    
+    assert tracker.timeout("Hugging Face", "flux", "w") == app.TIMEOUT_DEFAULTS["ceiling"]
+
+
+def test_samples_persist_across_restarts(tmp_path):
+    path = tmp_path / "latency.json"
+    tracker = app.LatencyTracker(str(path))
+    fill(tracker, 15.0, "w")
+    tracker.save()
+    
+    restarted = app.LatencyTracker(str(path))
+    
+    assert restarted.stats("Hugging Face", "flux", "w")["samples"] == app.TIMEOUT_DEFAULTS["min_samples"]
+    assert set(json.loads(path.read_text())) == {"Hugging Face|flux|w"}
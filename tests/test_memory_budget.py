@@ -0,0 +1,55 @@
+import sqlite3
+
+import pytest
+
+import app_complete as app
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch, session_state):
+    store = app.BlobStore(str(tmp_path / "images"), 1 << 20)
+    history = app.HistoryStore(str(tmp_path / "history.db"), store, retention=100)
+    session_state.update(favorite_images=[], latest_generation=None)
+    monkeypatch.setattr(app, "get_blob_store", lambda: store)
+    monkeypatch.setattr(app, "get_history_store", lambda: history)
+    monkeypatch.setattr(app, "get_history_owner", lambda: "owner")
+    return session_state
+
+
+def test_shared_favorite_images_are_counted_once(session):
+    handle = app.store_image(b"x" * 100)
+    session.favorite_images.append({"image_handle": handle})
+    
+    assert app.get_favorites_bytes() == 100
+    assert app.get_favorites_bytes([handle]) == 100
+    assert app.get_favorites_bytes([app.store_image(b"y" * 10)]) == 110
+
+
+def test_persisted_history_holds_the_images_instead_of_the_session(session):
+    handle = app.store_image(b"a" * 100)
+    
+    entry = app.add_to_history("cat", "", "flux", [handle], {})
+    
+    assert entry["images"] == [handle]
+    assert app.get_session_blob_refs().counts[handle] == 0
+    assert app.get_blob_store().get(handle) == b"a" * 100
+    
+    app.clear_history()
+    assert app.get_blob_store().get(handle) is None
+
+
+def test_session_keeps_its_reference_when_history_cannot_be_saved(session, monkeypatch):
+    def fail(owner, entry):
+        raise sqlite3.OperationalError("disk full")
+    monkeypatch.setattr(app.get_history_store(), "add_entry", fail)
+    handle = app.store_image(b"a" * 100)
+    
+    app.add_to_history("cat", "", "flux", [handle], {})
+    
+    assert app.get_session_blob_refs().counts[handle] == 1
+    assert app.get_blob_store().get(handle) == b"a" * 100
+
+
+def test_format_bytes():
+    assert app.format_bytes(2048) == "2 KB"
+    assert app.format_bytes(3 * 1024 * 1024) == "3.0 MB"
@@ -0,0 +1,53 @@
+import threading
+import uuid
+from collections import OrderedDict
+
+import app_complete as app
+
+
+def make_key():
+    return f"sk-{uuid.uuid4().hex}"
+
+
+def test_clients_are_reused_per_key_and_endpoint():
+    api_key = make_key()
+    client = app.get_openai_client(api_key, "http://registry.test/v1")
+    
+    assert app.get_openai_client(api_key, "http://registry.test/v1") is client
+    assert app.get_openai_client(make_key(), "http://registry.test/v1") is not client
+    assert app.get_openai_client(api_key, "http://other.test/v1") is not client
+
+
+def test_registry_keys_do_not_contain_the_api_key():
+    api_key = make_key()
+    app.get_openai_client(api_key, "http://registry.test/v1")
+    clients, _ = app.get_openai_client_registry()
+    
+    assert all(api_key not in key for key in clients)
+
+
+def test_least_recently_used_client_is_dropped_without_closing(monkeypatch):
+    monkeypatch.setattr(app, "MAX_SHARED_CLIENTS", 2)
+    registry = (OrderedDict(), threading.Lock())
+    monkeypatch.setattr(app, "get_openai_client_registry", lambda: registry)
+    closed = []
+    oldest, recent = app.get_openai_client(make_key(), "http://lru.test/v1"), make_key()
+    monkeypatch.setattr(oldest, "close", lambda: closed.append(True))
+    recent_client = app.get_openai_client(recent, "http://lru.test/v1")
+    
+    app.get_openai_client(make_key(), "http://lru.test/v1")
+    
+    # 被擠出的客戶端可能仍被其他會話的請求持有，不能關閉
+    assert closed == []
+    assert oldest not in registry[0].values()
+    assert app.get_openai_client(recent, "http://lru.test/v1") is recent_client
+
+
+def test_validation_does_not_register_a_shared_client():
+    api_key = make_key()
+    clients, _ = app.get_openai_client_registry()
+    
+    ok, _ = app.validate_api_key(api_key, "http://127.0.0.1:9/v1", "OpenAI Compatible")
+    
+    assert not ok
+    assert app.openai_client_key(api_key, "http://127.0.0.1:9/v1") not in clients
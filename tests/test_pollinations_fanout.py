@@ -0,0 +1,82 @@
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import pollinations_fanout
+
+
+CFG = {
+    "base_url": "https://image.pollinations.ai",
+    "pollinations_auth_mode": "令牌",
+    "pollinations_token": "secret",
+}
+
+
+@pytest.fixture
+def requests_log(monkeypatch, fake_response):
+    log = []
+    
+    def fake_get(url, headers=None, timeout=None):
+        log.append({"url": url, "headers": headers, "timeout": timeout})
+        return fake_response(url=url)
+    
+    monkeypatch.setattr(pollinations_fanout.requests, "get", fake_get)
+    return log
+
+
+def test_fetch_builds_prompt_url_with_seed_and_auth(requests_log):
+    params = {"prompt": "一隻貓", "negative_prompt": "blurry", "size": "768x512", "model": "flux", "nologo": True}
+    
+    pollinations_fanout.fetch_pollinations_image(params, CFG, seed=42, timeout=30)
+    
+    request = requests_log[0]
+    url = urlsplit(request["url"])
+    query = parse_qs(url.query)
+    assert url.path == "/prompt/%E4%B8%80%E9%9A%BB%E8%B2%93%20--no%20blurry"
+    assert query == {"model": ["flux"], "width": ["768"], "height": ["512"], "seed": ["42"], "nologo": ["True"]}
+    assert request["headers"] == {"Authorization": "Bearer secret"}
+    assert request["timeout"] == 30
+
+
+def test_fan_out_yields_every_index_with_its_own_seed(requests_log):
+    results = dict(pollinations_fanout.fan_out_pollinations({"prompt": "cat"}, CFG, 4))
+    
+    assert sorted(results) == [0, 1, 2, 3]
+    seeds = {parse_qs(urlsplit(entry["url"]).query)["seed"][0] for entry in requests_log}
+    assert len(seeds) == 4
+
+
+def test_fan_out_runs_requests_concurrently(monkeypatch, fake_response):
+    active, peak = 0, 0
+    lock = threading.Lock()
+    
+    def slow_get(url, headers=None, timeout=None):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.1)
+        with lock:
+            active -= 1
+        return fake_response(url=url)
+    
+    monkeypatch.setattr(pollinations_fanout.requests, "get", slow_get)
+    
+    results = list(pollinations_fanout.fan_out_pollinations({"prompt": "cat"}, CFG, 6))
+    
+    assert len(results) == 6
+    assert peak == pollinations_fanout.MAX_CONCURRENT_REQUESTS
+
+
+def test_fan_out_yields_exceptions_in_place_of_responses(monkeypatch):
+    def failing_get(url, headers=None, timeout=None):
+        raise ConnectionError("boom")
+    
+    monkeypatch.setattr(pollinations_fanout.requests, "get", failing_get)
+    
+    results = list(pollinations_fanout.fan_out_pollinations({"prompt": "cat"}, CFG, 2))
+    
+    assert sorted(i for i, _ in results) == [0, 1]
+    assert all(isinstance(error, ConnectionError) for _, error in results)
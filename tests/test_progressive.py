@@ -0,0 +1,98 @@
+import pytest
+
+import app_complete as app
+
+
+CFG = {"provider": "Pollinations.ai", "base_url": "https://progressive.test"}
+
+
+@pytest.fixture
+def active_config(monkeypatch):
+    monkeypatch.setattr(app, "get_active_config", lambda: dict(CFG))
+
+
+def preview_item(provider="Pollinations.ai", quality="快速預覽"):
+    return {
+        "prompt": "cat",
+        "negative_prompt": "blurry",
+        "model": "flux",
+        "metadata": {
+            "size": "512x288",
+            "target_size": "1792x1024",
+            "provider": provider,
+            "style": "無",
+            "model_name": "Flux",
+            "advanced_options": {"quality": quality, "enhance": True},
+        },
+    }
+
+
+def test_preview_with_seed_can_be_rerun(active_config):
+    assert app.can_rerun_full_quality(preview_item(), 42)
+
+
+def test_rerun_needs_a_seed_a_preview_and_the_same_provider(active_config):
+    assert not app.can_rerun_full_quality(preview_item(), None)
+    assert not app.can_rerun_full_quality(preview_item(quality="完整"), 42)
+    assert not app.can_rerun_full_quality(preview_item(provider="Hugging Face"), 42)
+
+
+def test_rerun_uses_target_size_full_quality_and_the_same_seed(active_config, session_state, monkeypatch):
+    submitted = []
+    session_state.latest_generation = "old"
+    monkeypatch.setattr(app, "init_api_client", lambda: None)
+    monkeypatch.setattr(app, "submit_generation_job",
+                        lambda client, cfg, params, meta, *args: submitted.append((params, meta)) or "job")
+    
+    assert app.submit_full_quality_rerun(preview_item(), 42) == "job"
+    
+    params, meta = submitted[0]
+    assert params["size"] == "1792x1024"
+    assert params["seeds"] == [42] and params["n"] == 1
+    assert params["quality"] == "完整" and params["enhance"] is True
+    assert meta["metadata"]["advanced_options"]["quality"] == "完整"
+    assert app.st.session_state.latest_generation is None
+
+
+def test_rerun_at_the_job_cap_keeps_the_latest_result(active_config, session_state, monkeypatch):
+    session_state.latest_generation = "old"
+    monkeypatch.setattr(app, "init_api_client", lambda: None)
+    monkeypatch.setattr(app, "submit_generation_job", lambda *args: None)
+    
+    assert app.submit_full_quality_rerun(preview_item(), 42) is None
+    assert app.st.session_state.latest_generation == "old"
+
+
+def test_resubmission_repeats_the_recorded_request(active_config, session_state, monkeypatch):
+    submitted = []
+    session_state.latest_generation = "old"
+    monkeypatch.setattr(app, "init_api_client", lambda: None)
+    monkeypatch.setattr(app, "submit_generation_job",
+                        lambda client, cfg, params, meta, *args: submitted.append(params) or "job")
+    item = preview_item()
+    item["metadata"]["style"] = "動漫風"
+    original = app.build_generation_params(
+        "flux", {"prompt": "cat", "negative_prompt": "blurry", "style": "動漫風", "size": "512x288"},
+        item["metadata"]["advanced_options"], [42, 43]
+    )
+    
+    assert app.resubmit_history_item(item, 42) == "job"
+    
+    key = lambda params: app.generation_cache_key(CFG["provider"], CFG["base_url"], params, 42)
+    assert key(submitted[0]) == key(original)
+
+
+def test_resubmission_needs_a_seed_and_the_same_provider(active_config):
+    assert app.can_reproduce(preview_item(quality="完整"), 42)
+    assert not app.can_reproduce(preview_item(), None)
+    assert not app.can_reproduce(preview_item(provider="Hugging Face"), 42)
+
+
+def test_preview_size_is_capped_at_the_preview_edge():
+    size = app.scale_size("1792x1024", app.PREVIEW_MAX_EDGE)
+    
+    assert max(int(v) for v in size.split('x')) == app.PREVIEW_MAX_EDGE
+
+
+def test_progressive_mode_is_offered_only_for_seeded_providers():
+    assert all(app.provider_supports_seeds(provider) for provider in app.PROGRESSIVE_PROVIDERS)
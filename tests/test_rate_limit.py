@@ -0,0 +1,77 @@
+import pytest
+
+import app_complete as app
+
+
+def test_burst_is_granted_without_waiting():
+    limiter = app.TokenBucket(rate=1.0, burst=3)
+    
+    assert [limiter.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+
+
+def test_reservations_queue_behind_the_refill_rate():
+    limiter = app.TokenBucket(rate=2.0, burst=1)
+    limiter.reserve()
+    
+    # 令牌不足時排隊而不是失敗：第 2、3 個預約依次等待 0.5、1 秒
+    assert limiter.reserve() == pytest.approx(0.5, abs=0.05)
+    assert limiter.reserve() == pytest.approx(1.0, abs=0.05)
+
+
+def test_reservation_beyond_max_wait_raises_without_taking_a_token():
+    limiter = app.TokenBucket(rate=0.01, burst=1)
+    limiter.reserve()
+    
+    with pytest.raises(app.RateLimitTimeout):
+        limiter.reserve(max_wait=1)
+    assert limiter.reserve(max_wait=1000) == pytest.approx(100, abs=1)
+
+
+def test_try_acquire_does_not_queue():
+    limiter = app.TokenBucket(rate=0.01, burst=1)
+    
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+
+
+def test_refund_returns_a_token():
+    limiter = app.TokenBucket(rate=0.01, burst=1)
+    limiter.reserve()
+    limiter.refund()
+    
+    assert limiter.try_acquire()
+
+
+def test_throttle_blocks_until_retry_after():
+    limiter = app.TokenBucket(rate=100.0, burst=4)
+    limiter.throttle(5)
+    
+    assert not limiter.try_acquire()
+    assert limiter.reserve(max_wait=10) == pytest.approx(5, abs=0.1)
+
+
+def test_rate_limit_settings_fall_back_to_defaults():
+    assert app.get_rate_limit_settings("Hugging Face") == {"rate": 0.5, "burst": 2}
+    assert app.get_rate_limit_settings("Unknown") == app.DEFAULT_RATE_LIMIT
+
+
+def test_rate_limit_settings_are_clamped(monkeypatch):
+    monkeypatch.setitem(app.RATE_LIMITS, "Clamped", {"rate": 0, "burst": 0})
+    
+    assert app.get_rate_limit_settings("Clamped") == {"rate": 0.01, "burst": 1}
+
+
+def test_free_pollinations_shares_one_bucket_across_sessions():
+    free = {"provider": "Pollinations.ai", "base_url": "https://image.pollinations.ai",
+            "pollinations_auth_mode": "免費", "api_key": "ignored"}
+    
+    assert app.rate_limit_key(free) == app.rate_limit_key({**free, "api_key": "other"})
+    assert app.rate_limit_key(free) != app.rate_limit_key(
+        {**free, "pollinations_auth_mode": "令牌", "pollinations_token": "tok"}
+    )
+
+
+def test_keyed_providers_get_a_bucket_per_credential():
+    cfg = {"provider": "NavyAI", "base_url": "https://api.navy/v1", "api_key": "sk-a"}
+    
+    assert app.rate_limit_key(cfg) != app.rate_limit_key({**cfg, "api_key": "sk-b"})
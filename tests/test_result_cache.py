@@ -0,0 +1,55 @@
+import app_complete as app
+
+
+def make_cache(tmp_path, budget=1 << 20):
+    blob_store = app.BlobStore(str(tmp_path / "images"), 1 << 20)
+    return app.ResultCache(str(tmp_path / "cache.db"), blob_store, budget)
+
+
+def test_hit_and_miss_are_counted(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("k", b"image")
+    
+    assert cache.get("k") == b"image"
+    assert cache.get("missing") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "entries": 1, "bytes": 5}
+
+
+def test_recently_used_entries_survive_eviction(tmp_path):
+    cache = make_cache(tmp_path, budget=20)
+    cache.put("a", b"a" * 10)
+    cache.put("b", b"b" * 10)
+    assert cache.get("a") == b"a" * 10
+    
+    cache.put("c", b"c" * 10)
+    
+    assert cache.get("b") is None
+    assert cache.get("a") == b"a" * 10
+    assert cache.get("c") == b"c" * 10
+
+
+def test_items_larger_than_the_budget_are_not_cached(tmp_path):
+    cache = make_cache(tmp_path, budget=4)
+    cache.put("big", b"too large")
+    
+    assert cache.get("big") is None
+    assert cache.stats()["bytes"] == 0
+
+
+def test_overwriting_a_key_replaces_its_size(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("k", b"old value")
+    cache.put("k", b"new")
+    
+    assert cache.get("k") == b"new"
+    assert cache.stats()["bytes"] == 3
+
+
+def test_cache_key_ignores_batch_size_and_covers_endpoint():
+    params = {"model": "flux", "prompt": "cat", "size": "64x64", "n": 2, "seeds": [1, 2]}
+    
+    key = app.generation_cache_key("Pollinations.ai", "http://a", params, 1)
+    
+    assert key == app.generation_cache_key("Pollinations.ai", "http://a", {**params, "n": 1, "seeds": [1]}, 1)
+    assert key != app.generation_cache_key("Pollinations.ai", "http://b", params, 1)
+    assert key != app.generation_cache_key("Pollinations.ai", "http://a", {**params, "prompt": "dog"}, 1)
@@ -0,0 +1,131 @@
+import time
+
+import httpx
+import pytest
+import requests
+from openai import APIStatusError, RateLimitError
+
+import app_complete as app
+
+
+POLICY = {"max_attempts": 3, "base_delay": 0.01, "max_delay": 0.05, "deadline": 5.0, "batch_deadline": 10.0}
+
+
+def api_error(cls, status_code: int, headers=None):
+    response = httpx.Response(status_code, headers=headers, request=httpx.Request("POST", "http://retry.test"))
+    return cls("error", response=response, body=None)
+
+
+@pytest.fixture
+def fast_policy(monkeypatch):
+    monkeypatch.setattr(app, "get_retry_policy", lambda: dict(POLICY))
+
+
+def test_backoff_is_capped_full_jitter():
+    policy = {"base_delay": 1.0, "max_delay": 4.0}
+    
+    assert all(0 <= app.backoff_delay(2, policy) <= 2.0 for _ in range(50))
+    assert all(0 <= app.backoff_delay(10, policy) <= 4.0 for _ in range(50))
+
+
+def test_retry_after_header_is_parsed(fake_response):
+    assert app.retry_after_seconds(fake_response(429, {"Retry-After": "7"})) == 7.0
+    assert app.retry_after_seconds(fake_response(429, {"Retry-After": "soon"}), 3) == 3
+    assert app.retry_after_seconds(fake_response(429), 0) == 0
+
+
+def test_transient_errors_are_retryable():
+    status = app.RETRYABLE_STATUS
+    
+    assert app.is_retryable_error(requests.ConnectionError(), status)
+    assert app.is_retryable_error(requests.Timeout(), status)
+    assert app.is_retryable_error(api_error(APIStatusError, 503), status)
+    assert not app.is_retryable_error(api_error(APIStatusError, 400), status)
+    assert not app.is_retryable_error(ValueError(), status)
+
+
+def test_non_retryable_status_is_returned_immediately(fake_response):
+    deadline = time.monotonic() + 60
+    
+    assert app.next_retry_delay("NavyAI", 1, POLICY, app.RETRYABLE_STATUS, deadline,
+                                response=fake_response(400)) is None
+
+
+def test_retries_stop_after_max_attempts(fake_response):
+    deadline = time.monotonic() + 60
+    response = fake_response(503)
+    
+    assert app.next_retry_delay("NavyAI", 2, POLICY, app.RETRYABLE_STATUS, deadline, response=response) is not None
+    assert app.next_retry_delay("NavyAI", 3, POLICY, app.RETRYABLE_STATUS, deadline, response=response) is None
+
+
+def test_retry_after_raises_the_backoff(fake_response):
+    delay = app.next_retry_delay("NavyAI", 1, POLICY, app.RETRYABLE_STATUS, time.monotonic() + 60,
+                                 response=fake_response(503, {"Retry-After": "2"}))
+    
+    assert delay == 2.0
+
+
+def test_retry_past_the_deadline_is_abandoned(fake_response):
+    delay = app.next_retry_delay("NavyAI", 1, POLICY, app.RETRYABLE_STATUS, time.monotonic() + 1,
+                                 response=fake_response(503, {"Retry-After": "5"}))
+    
+    assert delay is None
+
+
+def test_rate_limit_error_throttles_the_bucket():
+    limiter = app.TokenBucket(rate=100.0, burst=4)
+    
+    app.next_retry_delay("OpenAI Compatible", 1, POLICY, app.RETRYABLE_STATUS, time.monotonic() + 60, limiter,
+                         error=api_error(RateLimitError, 429, {"Retry-After": "3"}))
+    
+    assert not limiter.try_acquire()
+
+
+def test_cloudflare_origin_timeouts_are_retried_for_pollinations_only(fake_response):
+    deadline = time.monotonic() + 60
+    pollinations = app.PROVIDER_RETRYABLE_STATUS["Pollinations.ai"]
+    
+    assert app.next_retry_delay("Pollinations.ai", 1, POLICY, pollinations, deadline,
+                                response=fake_response(524)) is not None
+    assert app.next_retry_delay("NavyAI", 1, POLICY, app.RETRYABLE_STATUS, deadline,
+                                response=fake_response(524)) is None
+
+
+def test_transient_failures_are_retried_until_success(fast_policy, run, fake_response):
+    responses = [fake_response(503), fake_response(200)]
+    calls = []
+    
+    async def call():
+        calls.append(time.monotonic())
+        return responses[len(calls) - 1]
+    
+    response = run(app.async_call_with_retry("NavyAI", call))
+    
+    assert response.status_code == 200
+    assert len(calls) == 2
+
+
+def test_connection_errors_are_reraised_when_attempts_run_out(fast_policy, run):
+    calls = []
+    
+    async def call():
+        calls.append(1)
+        raise requests.ConnectionError("down")
+    
+    with pytest.raises(requests.ConnectionError):
+        run(app.async_call_with_retry("NavyAI", call))
+    assert len(calls) == POLICY["max_attempts"]
+
+
+def test_last_response_is_returned_when_attempts_run_out(fast_policy, run, fake_response):
+    calls = []
+    
+    async def call():
+        calls.append(1)
+        return fake_response(502)
+    
+    response = run(app.async_call_with_retry("NavyAI", call))
+    
+    assert response.status_code == 502
+    assert len(calls) == POLICY["max_attempts"]
@@ -0,0 +1,119 @@
+import time
+import uuid
+
+import app_complete as app
+
+
+def make_member(name, provider="Pollinations.ai", weight=1.0):
+    cfg = {"provider": provider, "base_url": f"http://{name}-{uuid.uuid4().hex}.test", "api_key": name}
+    return {"name": name, "cfg": cfg, "weight": weight}
+
+
+def succeed(n_images, on_image, seed=None):
+    """像真實生成函數一樣逐張回調並返回帶批次索引的結果"""
+    images = []
+    for i in range(n_images):
+        on_image(i, b"ok", None)
+        images.append(type('Image', (object,), {'content': b"ok", 'seed': seed, 'index': i}))
+    return True, type('Response', (object,), {'data': images})
+
+
+def test_weighted_round_robin_follows_weights():
+    balancer = app.ProfileBalancer()
+    picks = [balancer.acquire([("a", 3.0), ("b", 1.0)], "加權輪詢") for _ in range(8)]
+    
+    assert picks.count("a") == 6 and picks.count("b") == 2
+    assert picks[:4].count("b") == 1
+
+
+def test_least_outstanding_prefers_idle_members_and_skips_cooldown():
+    balancer = app.ProfileBalancer()
+    members = [("a", 1.0), ("b", 1.0)]
+    
+    assert balancer.acquire(members, "最少未完成請求") == "a"
+    assert balancer.acquire(members, "最少未完成請求") == "b"
+    balancer.release("a")
+    assert balancer.acquire(members, "最少未完成請求") == "a"
+    
+    balancer.penalize("a", seconds=60)
+    assert balancer.acquire(members, "最少未完成請求") == "b"
+    assert balancer.state("a")["cooldown"] > 0
+
+
+def test_failover_rounds_share_one_batch_deadline(monkeypatch):
+    first, second = make_member("first"), make_member("second")
+    deadlines = []
+    
+    def dispatch(provider, client, cfg, params, n_images, on_image=None, on_bytes=None, cancel_token=None,
+                 deadline=None):
+        deadlines.append(deadline)
+        if cfg == first["cfg"]:
+            return False, "boom"
+        return succeed(n_images, on_image, 5)
+    
+    monkeypatch.setattr(app, "dispatch_generation", dispatch)
+    routing = {"strategy": "加權輪詢", "members": [first, second]}
+    
+    ok, response = app.dispatch_routed(routing, {"seeds": [5, 5]}, 2, deadline=time.monotonic() + 30)
+    
+    assert ok
+    assert [image.content for image in response.data] == [b"ok", b"ok"]
+    assert len(deadlines) == 3 and len(set(deadlines)) == 1
+
+
+def test_expired_deadline_stops_failover(monkeypatch):
+    calls = []
+    errors = {}
+    
+    def dispatch(*args, **kwargs):
+        calls.append(args)
+        return False, "boom"
+    
+    monkeypatch.setattr(app, "dispatch_generation", dispatch)
+    routing = {"strategy": "加權輪詢", "members": [make_member("a"), make_member("b")]}
+    
+    ok, _ = app.dispatch_routed(
+        routing, {"seeds": [None]}, 1, lambda i, data, error: errors.update({i: error}),
+        deadline=time.monotonic() - 1
+    )
+    
+    assert not ok
+    assert calls == []
+    assert "時間預算" in errors[0]
+
+
+def test_routed_images_keep_the_seed_their_member_used(monkeypatch):
+    def dispatch(provider, client, cfg, params, n_images, on_image, *args, **kwargs):
+        return succeed(n_images, on_image, 9 if provider == "Pollinations.ai" else None)
+    
+    monkeypatch.setattr(app, "dispatch_generation", dispatch)
+    monkeypatch.setattr(app, "get_openai_client", lambda api_key, base_url: None)
+    routing = {"strategy": "加權輪詢", "members": [make_member("p"), make_member("o", "OpenAI Compatible")]}
+    
+    ok, response = app.dispatch_routed(routing, {"seeds": [9, 9]}, 2, deadline=time.monotonic() + 30)
+    
+    assert ok
+    assert sorted(image.seed for image in response.data if image.seed is not None) == [9]
+    assert [image.seed for image in response.data].count(None) == 1
+
+
+def test_routed_results_are_cached_under_the_member_that_produced_them(monkeypatch):
+    active, other = make_member("active"), make_member("other", provider="Hugging Face")
+    
+    def dispatch(provider, client, cfg, params, n_images, on_image=None, on_bytes=None, cancel_token=None,
+                 deadline=None):
+        if cfg == active["cfg"]:
+            return False, "boom"
+        return succeed(n_images, on_image, 9)
+    
+    monkeypatch.setattr(app, "dispatch_generation", dispatch)
+    cfg = {**active["cfg"], "routing": {"strategy": "加權輪詢", "members": [active, other]}}
+    params = {"model": "m", "prompt": f"route {uuid.uuid4().hex}", "size": "64x64", "n": 1, "seeds": [9]}
+    
+    ok, _ = app.generate_images_with_retry(None, cfg, None, **params)
+    
+    cache = app.get_result_cache()
+    key = lambda member: app.generation_cache_key(member["cfg"]["provider"], member["cfg"]["base_url"], params, 9)
+    assert ok
+    assert cache.get(key(active)) is None
+    assert cache.get(key(other)) == b"ok"
@@ -0,0 +1,50 @@
+import app_complete as app
+
+
+def test_fixed_mode_repeats_the_base_seed():
+    assert app.resolve_seeds("固定", 42, 3) == [42, 42, 42]
+
+
+def test_incrementing_mode_wraps_at_max_seed():
+    assert app.resolve_seeds("遞增", app.MAX_SEED - 1, 3) == [app.MAX_SEED - 1, app.MAX_SEED, 0]
+
+
+def test_random_mode_draws_seeds_in_range():
+    seeds = app.resolve_seeds("隨機", 0, 5)
+    
+    assert len(seeds) == 5
+    assert all(0 <= seed <= app.MAX_SEED for seed in seeds)
+
+
+def test_fill_seeds_keeps_given_seeds_and_fills_gaps():
+    seeds = app.fill_seeds([5, None, 7], 3)
+    
+    assert seeds[0] == 5 and seeds[2] == 7
+    assert 0 <= seeds[1] <= app.MAX_SEED
+    assert len(app.fill_seeds(None, 4)) == 4
+
+
+def test_only_providers_that_send_seeds_support_seed_modes():
+    assert app.provider_supports_seeds("Pollinations.ai")
+    assert app.provider_supports_seeds("Hugging Face")
+    assert not app.provider_supports_seeds("OpenAI Compatible")
+    assert not app.provider_supports_seeds("NavyAI")
+
+
+def test_seed_mode_is_not_sent_as_a_provider_option():
+    params = app.build_generation_params(
+        "flux", {"prompt": "cat", "negative_prompt": "", "style": "無", "size": "64x64"},
+        {"seed_mode": "固定", "base_seed": 3, "enhance": True}, [3, 3]
+    )
+    
+    assert params["seeds"] == [3, 3] and params["n"] == 2
+    assert "seed_mode" not in params and "base_seed" not in params
+    assert params["enhance"] is True
+
+
+def test_cache_key_depends_on_seed_but_not_batch_size():
+    params = {"model": "flux", "prompt": "cat", "size": "64x64", "n": 2, "seeds": [1, 2]}
+    key = lambda seed, **extra: app.generation_cache_key("Pollinations.ai", "http://x", {**params, **extra}, seed)
+    
+    assert key(1) != key(2)
+    assert key(1) == key(1, n=4, seeds=[1, 9, 9, 9])
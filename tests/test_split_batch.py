@@ -0,0 +1,57 @@
+import httpx
+import pytest
+from openai import APIStatusError
+
+import app_complete as app
+
+
+def api_error(message: str, status: int = 400) -> APIStatusError:
+    request = httpx.Request("POST", "https://api.example.test/v1/images/generations")
+    return APIStatusError(message, response=httpx.Response(status, request=request), body=None)
+
+
+@pytest.mark.parametrize("message, limit", [
+    # DALL-E 3
+    ("Error code: 400 - {'error': {'code': None, 'message': 'You must provide n=1 for this model.', "
+     "'param': None, 'type': 'invalid_request_error'}}", 1),
+    # DALL-E 2
+    ("Error code: 400 - {'error': {'code': 'integer_above_max_value', 'message': \"Invalid 'n': integer "
+     "above maximum value. Expected a value <= 10, but got 12 instead.\", 'param': 'n', "
+     "'type': 'invalid_request_error'}}", 10),
+    ("Error code: 400 - {'error': {'message': \"12 is greater than the maximum of 10 - 'n'\", "
+     "'type': 'invalid_request_error', 'param': None, 'code': None}}", 10),
+    # OpenAI 兼容後端
+    ("Error code: 422 - {'message': 'Input validation error: `n` must be less than or equal to 4', "
+     "'type': 'invalid_request_error'}", 4),
+    ("Error code: 400 - {'detail': 'n must be between 1 and 4'}", 4),
+])
+def test_explicit_limits_are_parsed(message, limit):
+    assert app.parse_n_limit(api_error(message)) == limit
+
+
+@pytest.mark.parametrize("message", [
+    # 提到 n 但沒有聲明上限
+    "Error code: 400 - {'error': {'message': \"Invalid type for 'n': expected an integer, but got a string "
+    "instead.\", 'param': 'n', 'type': 'invalid_request_error'}}",
+    "Error code: 400 - {'detail': \"Unsupported parameter: 'n' with n=12\"}",
+    # 與 n 無關
+    "Error code: 400 - {'error': {'message': 'Your request was rejected as a result of our safety system.', "
+    "'type': 'invalid_request_error'}}",
+])
+def test_messages_without_a_stated_limit_return_none(message):
+    assert app.parse_n_limit(api_error(message)) is None
+
+
+def test_non_client_errors_are_ignored():
+    assert app.parse_n_limit(api_error("n must be between 1 and 4", status=500)) is None
+    assert app.parse_n_limit(ValueError("n must be between 1 and 4")) is None
+
+
+@pytest.mark.parametrize("n, max_n, chunks", [
+    (4, None, [4]),
+    (4, 10, [4]),
+    (10, 4, [4, 4, 2]),
+    (3, 1, [1, 1, 1]),
+])
+def test_split_batch(n, max_n, chunks):
+    assert app.split_batch(n, max_n) == chunks
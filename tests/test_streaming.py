@@ -0,0 +1,88 @@
+import uuid
+
+import httpx
+import pytest
+
+import app_complete as app
+
+
+def test_read_stream_reports_progress_per_chunk(fake_response):
+    progress = []
+    
+    response = app.read_stream(fake_response(headers={"Content-Length": "6"}), [b"ab", b"cd", b"ef"],
+                               lambda received, total: progress.append((received, total)))
+    
+    assert response.content == b"abcdef"
+    assert progress == [(2, 6), (4, 6), (6, 6)]
+
+
+def test_missing_content_length_reports_unknown_total(fake_response):
+    progress = []
+    
+    app.read_stream(fake_response(), [b"ab"], lambda received, total: progress.append((received, total)))
+    
+    assert progress == [(2, None)]
+
+
+def test_cancelled_download_stops_reading(fake_response):
+    token = app.CancellationToken()
+    read = []
+    
+    def chunks():
+        for chunk in (b"ab", b"cd", b"ef"):
+            read.append(chunk)
+            if len(read) == 2:
+                token.cancel()
+            yield chunk
+    
+    with pytest.raises(app.GenerationCancelled):
+        app.read_stream(fake_response(), chunks(), None, token)
+    assert len(read) == 2
+
+
+def test_async_client_streams_on_the_event_loop(run):
+    body = b"x" * (app.STREAM_CHUNK_SIZE * 2 + 1)
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body))
+    progress = []
+    
+    async def fetch():
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await app.async_stream_request(
+                client, "GET", "http://stream.test/image", lambda received, total: progress.append(received)
+            )
+    
+    response = run(fetch())
+    
+    assert response.content == body
+    assert progress[-1] == len(body)
+    assert len(progress) >= 2
+
+
+def test_job_tracks_bytes_until_the_image_arrives():
+    job = app.GenerationJob("owner", 2, {})
+    
+    job.report_bytes(0, 10, 100)
+    assert job.snapshot()["downloading"] == {0: (10, 100)}
+    
+    job.report(0, b"image")
+    job.report_bytes(0, 100, 100)
+    assert job.snapshot()["downloading"] == {}
+    assert job.snapshot()["previews"] == {0: b"image"}
+
+
+def test_download_progress_maps_sub_batch_indices(monkeypatch):
+    cfg = {"provider": "Pollinations.ai", "base_url": "http://stream.test"}
+    params = {"model": "m", "prompt": f"stream {uuid.uuid4().hex}", "size": "64x64", "n": 2, "seeds": [1, 2]}
+    app.get_result_cache().put(app.generation_cache_key(cfg["provider"], cfg["base_url"], params, 1), b"cached")
+    
+    # 第 0 張命中快取，子批次中的索引 0 對應整批的索引 1
+    def dispatch(provider, client, cfg, params, n_images, on_image=None, on_bytes=None, cancel_token=None,
+                 deadline=None):
+        on_bytes(0, 5, 10)
+        return False, "失敗"
+    monkeypatch.setattr(app, "dispatch_generation", dispatch)
+    job = app.GenerationJob("owner", 2, {})
+    
+    app.generate_images_with_retry(None, cfg, job, **params)
+    
+    assert job.snapshot()["downloading"] == {1: (5, 10)}
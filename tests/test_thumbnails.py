@@ -0,0 +1,60 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+import app_complete as app
+
+
+def png(width: int, height: int) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), "green").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_thumbnail_is_a_bounded_jpeg():
+    thumbnail = Image.open(BytesIO(app.make_thumbnail(png(2048, 1024))))
+    
+    assert thumbnail.format == "JPEG"
+    assert thumbnail.size == (app.THUMBNAIL_MAX_EDGE, app.THUMBNAIL_MAX_EDGE // 2)
+
+
+def test_pending_thumbnail_does_not_block_rendering(tmp_path):
+    gate = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=1)
+    executor.submit(gate.wait, 5)
+    store = app.BlobStore(str(tmp_path), 1 << 20, executor)
+    handle = store.put(png(64, 64))
+    
+    started = time.monotonic()
+    assert store.thumbnail(handle, timeout=0) is None
+    assert time.monotonic() - started < 0.5
+    
+    gate.set()
+    assert store.thumbnail(handle, timeout=5) is not None
+
+
+def test_thumbnail_is_served_from_disk_without_loading_the_original(tmp_path):
+    executor = ThreadPoolExecutor(max_workers=1)
+    store = app.BlobStore(str(tmp_path), 0, executor)
+    handle = store.put(png(64, 64), persistent=True)
+    store.thumbnail(handle, timeout=5)
+    
+    restarted = app.BlobStore(str(tmp_path), 0)
+    
+    assert restarted.thumbnail(handle, timeout=0) is not None
+    assert restarted.stats()["memory_bytes"] == 0
+
+
+def test_failed_thumbnail_falls_back_to_the_original(tmp_path):
+    executor = ThreadPoolExecutor(max_workers=1)
+    store = app.BlobStore(str(tmp_path), 1 << 20, executor)
+    handle = store.put(b"not an image")
+    
+    assert store.thumbnail(handle, timeout=5) == b"not an image"
+    executor.shutdown(wait=True)
+    
+    # 失敗後不再顯示為生成中
+    assert store.thumbnail(handle, timeout=0) == b"not an image"
@@ -0,0 +1,24 @@
+import uuid
+
+import requests
+
+import app_complete as app
+
+
+def test_http_client_is_pooled_per_provider_and_endpoint():
+    base_url = f"http://pool-{uuid.uuid4().hex}.test"
+    client = app.get_http_client("Pollinations.ai", base_url)
+    
+    assert app.get_http_client("Pollinations.ai", base_url) is client
+    assert app.get_http_client("Hugging Face", base_url) is not client
+    assert app.get_http_client("Pollinations.ai", base_url + "/other") is not client
+
+
+def test_http_pool_is_at_least_the_provider_concurrency(monkeypatch):
+    monkeypatch.setitem(app.TRANSPORT_DEFAULTS, "http2", False)
+    monkeypatch.setitem(app.TRANSPORT_DEFAULTS, "pool_maxsize", 1)
+    
+    client = app.get_http_client("Pollinations.ai", f"http://size-{uuid.uuid4().hex}.test")
+    
+    assert isinstance(client, requests.Session)
+    assert client.get_adapter("https://example.test")._pool_maxsize == app.get_provider_concurrency("Pollinations.ai")
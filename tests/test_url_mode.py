@@ -0,0 +1,73 @@
+import base64
+from types import SimpleNamespace
+
+import pytest
+
+import app_complete as app
+
+
+class FakeImages:
+    def __init__(self, data):
+        self.data = data
+        self.calls = []
+    
+    def generate(self, **kwargs):
+        self.calls.append(kwargs)
+        return SimpleNamespace(data=self.data)
+
+
+class FakeClient:
+    """同步 OpenAI 客戶端的最小替身（threads 引擎下直接使用傳入的客戶端）"""
+    
+    def __init__(self, data):
+        self.images = FakeImages(data)
+    
+    def with_options(self, **kwargs):
+        return self
+
+
+@pytest.fixture
+def url_mode(monkeypatch):
+    monkeypatch.setitem(app.TRANSPORT_DEFAULTS, "engine", "threads")
+    monkeypatch.setitem(app.TRANSPORT_DEFAULTS, "openai_response_format", "url")
+
+
+def generate(client, cfg, n):
+    params = {"model": "m", "prompt": "p", "size": "64x64"}
+    return app.generate_openai_compatible_images(client, cfg, params, n)
+
+
+def test_chunk_keeps_positions_when_provider_returns_fewer_images(url_mode, monkeypatch, make_cfg):
+    async def fetch(runner, provider, url, on_bytes=None, cancel_token=None):
+        return None if url.endswith("/bad") else url.encode()
+    monkeypatch.setattr(app, "async_fetch_image", fetch)
+    client = FakeClient([
+        SimpleNamespace(url="http://cdn.test/bad", b64_json=None),
+        SimpleNamespace(url=None, b64_json=base64.b64encode(b"inline").decode()),
+    ])
+    
+    ok, response = generate(client, make_cfg("OpenAI Compatible"), 3)
+    
+    assert ok
+    assert client.images.calls[0]["response_format"] == "url"
+    assert [(image.index, image.content) for image in response.data] == [(1, b"inline")]
+
+
+def test_downloads_share_one_pool_per_provider(url_mode, monkeypatch, make_cfg):
+    clients = []
+    
+    async def stream(http_client, method, url, on_bytes=None, cancel_token=None, **kwargs):
+        clients.append(http_client)
+        return app.StreamedResponse(200, {}, url.encode(), url)
+    monkeypatch.setattr(app, "async_stream_request", stream)
+    client = FakeClient([
+        SimpleNamespace(url="http://cdn-a.test/1", b64_json=None),
+        SimpleNamespace(url="http://cdn-b.test/2", b64_json=None),
+    ])
+    
+    ok, response = generate(client, make_cfg("OpenAI Compatible"), 2)
+    
+    assert ok
+    assert [image.content for image in response.data] == [b"http://cdn-a.test/1", b"http://cdn-b.test/2"]
+    assert clients[0] is clients[1]
+    assert clients[0] is app.get_async_runner().http_client("OpenAI Compatible", app.IMAGE_DOWNLOAD_POOL)
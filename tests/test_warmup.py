@@ -0,0 +1,47 @@
+import threading
+
+import app_complete as app
+
+
+def test_loading_estimate_parses_only_503_bodies(fake_response):
+    assert app.hf_loading_estimate(fake_response(503, body={"estimated_time": 12.5})) == 12.5
+    assert app.hf_loading_estimate(fake_response(503)) is None
+    assert app.hf_loading_estimate(fake_response(500, body={"estimated_time": 3})) is None
+
+
+def test_claim_warmup_skips_warming_ready_and_loading_models(fake_response):
+    tracker = app.ModelWarmupTracker(warm_ttl=60)
+    
+    assert tracker.claim_warmup("model")
+    assert not tracker.claim_warmup("model")
+    
+    tracker.record("model", fake_response(200))
+    assert not tracker.claim_warmup("model")
+    
+    tracker.record("model", fake_response(503, body={"estimated_time": 60}))
+    assert not tracker.claim_warmup("model")
+    
+    tracker.record("model", error=ConnectionError("boom"))
+    assert tracker.claim_warmup("model")
+
+
+def test_warm_up_pings_only_the_given_model_inside_a_provider_slot(monkeypatch, fake_response, make_cfg):
+    cfg = make_cfg()
+    semaphore = app.get_async_runner().semaphore("Hugging Face", app.get_provider_concurrency("Hugging Face"))
+    calls = []
+    done = threading.Event()
+    
+    async def fake_post(http_client, url, headers, payload, tracker, timeout=None, *args, **kwargs):
+        calls.append((url, semaphore._value))
+        tracker.record(url, fake_response(200))
+        done.set()
+        return fake_response(200)
+    
+    monkeypatch.setattr(app, "async_hf_post", fake_post)
+    
+    assert app.warm_up_hf_model(cfg, "org/model")
+    assert done.wait(5)
+    assert not app.warm_up_hf_model(cfg, "org/model")
+    
+    assert calls == [(app.hf_model_url(cfg["base_url"], "org/model"), app.get_provider_concurrency("Hugging Face") - 1)]
+    assert app.get_warmup_tracker().get(calls[0][0])["state"] == "ready"